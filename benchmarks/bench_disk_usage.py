@@ -0,0 +1,43 @@
+"""Аналіз диска: паралельний обхід проти `du -sx` і повторне сканування з кешем.
+
+Для кожної кількості потоків сканує --path без кешу, потім ще раз з кешем
+(незмінені каталоги не читаються), і порівнює підсумок з `du -sxB1`.
+На "холодному" кеші сторінок (echo 3 > /proc/sys/vm/drop_caches) різниця
+між потоками помітніша: тоді час іде на очікування диска, а не на Python.
+
+    python benchmarks/bench_disk_usage.py --path /usr --threads 1 4 8
+"""
+
+import argparse
+import subprocess
+import time
+
+from common import import_bot
+
+bot = import_bot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--path", default="/usr")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    du = subprocess.run(["du", "-sxB1", args.path], capture_output=True, text=True)
+    du_time = time.perf_counter() - started
+    print(f"du -sx: {int(du.stdout.split()[0]):>14} байт за {du_time:6.2f}с")
+
+    for threads in args.threads:
+        bot.DISK_USAGE_CACHE.records.clear()
+        full = bot.DiskUsageScanner(args.path, threads=threads).run()
+        cached = bot.DiskUsageScanner(args.path, threads=threads).run()
+        print(
+            f"потоків {threads:>2}: {full.total:>14} байт за {full.elapsed:6.2f}с "
+            f"({full.dirs} каталогів, {full.files} файлів), "
+            f"з кешем {cached.elapsed:6.2f}с ({cached.cached} з кешу)"
+        )
+
+
+if __name__ == "__main__":
+    main()
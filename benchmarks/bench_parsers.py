@@ -0,0 +1,137 @@
+"""Мікробенчмарки парсерів бота.
+
+Регулярні вирази входу/виходу SSH, розбір записів journald, розбір
+списків оновлень pacman/apt/dnf, таблиця сусідів (/proc/net/arp та
+повідомлення rtnetlink) і класифікація IP.
+
+    python benchmarks/bench_parsers.py --packages 5000 --arp 2000
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import tempfile
+import timeit
+
+from common import import_bot
+
+bot = import_bot()
+
+SSH_MESSAGES = {
+    "login": "Accepted publickey for deploy from 203.0.113.7 port 51122 ssh2: ED25519 SHA256:abc",
+    "logout": "Disconnected from user deploy 203.0.113.7 port 51122",
+    "preauth": "Disconnected from invalid user admin 198.51.100.3 port 40022 [preauth]",
+    "session": "pam_unix(sshd:session): session closed for user deploy",
+    "noise": "Connection closed by 198.51.100.3 port 40022 [preauth]",
+}
+
+
+def bench(name: str, func, number: int, repeat: int = 7):
+    """Друкує час одного виклику (мкс): медіана та мінімум з repeat серій"""
+    per_call = [t / number * 1_000_000 for t in timeit.repeat(func, number=number, repeat=repeat)]
+    print(
+        f"{name:<32} median {statistics.median(per_call):10.2f} мкс   "
+        f"min {min(per_call):10.2f} мкс"
+    )
+
+
+def update_outputs(count: int) -> dict[str, str]:
+    pacman = "\n".join(f"pkg{i} 1.{i}-1 -> 1.{i}-2" for i in range(count))
+    apt = "Listing... Done\n" + "\n".join(
+        f"pkg{i}/jammy-updates 1.{i}-2ubuntu1 amd64 [upgradable from: 1.{i}-1ubuntu1]"
+        for i in range(count)
+    )
+    dnf = "Last metadata expiration check: 0:10:00 ago.\n\n" + "\n".join(
+        f"pkg{i}.x86_64    1.{i}-2.fc40    updates" for i in range(count)
+    )
+    return {"pacman": pacman, "apt": apt, "dnf": dnf}
+
+
+def write_arp_table(count: int) -> str:
+    fd, path = tempfile.mkstemp(prefix="arp-")
+    with os.fdopen(fd, "w") as f:
+        f.write("IP address       HW type     Flags       HW address            Mask     Device\n")
+        for i in range(count):
+            ip = f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+            f.write(f"{ip:<16} 0x1         0x2         02:00:00:{i // 65536 % 256:02x}:{i // 256 % 256:02x}:{i % 256:02x}     *        eth0\n")
+    return path
+
+
+def neighbor_dump(count: int) -> bytes:
+    """Дамп RTM_NEWNEIGH, як його віддає ядро на RTM_GETNEIGH"""
+    messages = []
+    for i in range(count):
+        dst = bytes([10, i // 65536 % 256, i // 256 % 256, i % 256])
+        lladdr = bytes([2, 0, 0, i // 65536 % 256, i // 256 % 256, i % 256])
+        attrs = (
+            bot.RTATTR.pack(4 + len(dst), bot.NDA_DST) + dst
+            + bot.RTATTR.pack(4 + len(lladdr), bot.NDA_LLADDR) + lladdr + b"\0\0"
+        )
+        body = bot.NDMSG.pack(socket.AF_INET, 0, 0, 2, 0x02, 0, 1) + attrs
+        messages.append(
+            bot.NLMSG_HEADER.pack(bot.NLMSG_HEADER.size + len(body), bot.RTM_NEWNEIGH, 2, 1, 0) + body
+        )
+    return b"".join(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--packages", type=int, default=5000)
+    parser.add_argument("--arp", type=int, default=2000)
+    args = parser.parse_args()
+
+    print("== SSH ==")
+    for kind, message in SSH_MESSAGES.items():
+        bench(f"parse_ssh_event[{kind}]", lambda m=message: bot.parse_ssh_event(m), 100000)
+    bench(
+        "REGEX_SSH_LOGIN.match",
+        lambda: bot.REGEX_SSH_LOGIN.match(SSH_MESSAGES["login"]),
+        100000,
+    )
+    bench(
+        "REGEX_SSH_LOGOUT.match",
+        lambda: bot.REGEX_SSH_LOGOUT.match(SSH_MESSAGES["logout"]),
+        100000,
+    )
+    entry = json.dumps(
+        {
+            "__CURSOR": "s=0123456789abcdef;i=1a2b;b=fedcba;m=123;t=456;x=789",
+            "__REALTIME_TIMESTAMP": "1700000000000000",
+            "_PID": "4242",
+            "MESSAGE": SSH_MESSAGES["login"],
+        }
+    ).encode()
+    bench("parse_journal_entry", lambda: bot.parse_journal_entry(entry), 100000)
+
+    print(f"\n== Оновлення ({args.packages} пакетів) ==")
+    for pm, output in update_outputs(args.packages).items():
+        parsed = bot.parse_update_list(pm, output)
+        assert len(parsed) == args.packages, (pm, len(parsed))
+        bench(f"parse_update_list[{pm}]", lambda pm=pm, o=output: bot.parse_update_list(pm, o), 10)
+
+    print(f"\n== Таблиця сусідів ({args.arp} записів) ==")
+    path = write_arp_table(args.arp)
+    last_ip = f"10.{(args.arp - 1) // 65536 % 256}.{(args.arp - 1) // 256 % 256}.{(args.arp - 1) % 256}"
+    table = bot.NeighborTable()
+    try:
+        bench("load_proc_arp", lambda: table.load_proc_arp(path), 50)
+    finally:
+        os.remove(path)
+    assert table.lookup(last_ip)
+    bench("lookup[останній]", lambda: table.lookup(last_ip), 100000)
+    bench("lookup[відсутній]", lambda: table.lookup("192.0.2.1"), 100000)
+    dump = neighbor_dump(args.arp)
+    fresh = bot.NeighborTable()
+    fresh.apply(dump)
+    assert len(fresh.entries) == args.arp
+    bench("apply[rtnetlink дамп]", lambda: fresh.apply(dump), 20)
+
+    print("\n== Класифікація IP ==")
+    for ip in ("203.0.113.7", "172.20.1.5", "100.64.3.3", "fd12::1", "2001:db8::1"):
+        bench(f"classify_ip[{ip}]", lambda ip=ip: bot.classify_ip.__wrapped__(ip), 100000)
+    bench("classify_ip[кеш]", lambda: bot.classify_ip("203.0.113.7"), 100000)
+
+if __name__ == "__main__":
+    main()
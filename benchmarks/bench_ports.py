@@ -0,0 +1,85 @@
+"""Порівняння вбудованого парсера /proc/net з `ss -tulpn`.
+
+Відкриває N слухаючих TCP/UDP сокетів (IPv4 та IPv6) у цьому процесі
+та вимірює час повного збору списку портів обома способами.
+
+    python benchmarks/bench_ports.py --sockets 4000 --rounds 20
+"""
+
+import argparse
+import resource
+import shutil
+import socket
+import subprocess
+import time
+
+from common import import_bot, report
+
+bot = import_bot()
+
+
+def open_sockets(count: int) -> list[socket.socket]:
+    sockets = []
+    kinds = [
+        (socket.AF_INET, socket.SOCK_STREAM, "127.0.0.1"),
+        (socket.AF_INET6, socket.SOCK_STREAM, "::1"),
+        (socket.AF_INET, socket.SOCK_DGRAM, "127.0.0.1"),
+        (socket.AF_INET6, socket.SOCK_DGRAM, "::1"),
+    ]
+    for i in range(count):
+        family, kind, host = kinds[i % len(kinds)]
+        try:
+            sock = socket.socket(family, kind)
+            sock.bind((host, 0))
+            if kind == socket.SOCK_STREAM:
+                sock.listen()
+        except OSError:
+            continue
+        sockets.append(sock)
+    return sockets
+
+
+def measure(func, rounds: int) -> list[float]:
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sockets", type=int, default=4000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = args.sockets + 256
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+    sockets = open_sockets(args.sockets)
+    listeners = bot.collect_listeners()
+    print(f"Відкрито сокетів: {len(sockets)}, знайдено слухаючих: {len(listeners)}")
+
+    report("/proc/net", measure(bot.collect_listeners, args.rounds))
+    if shutil.which("ss"):
+        report(
+            "ss -tulpn",
+            measure(
+                lambda: subprocess.run(
+                    ["ss", "-tulpn"], capture_output=True, text=True, check=True
+                ),
+                args.rounds,
+            ),
+        )
+    else:
+        print("ss не знайдено — порівняння пропущено")
+
+    for sock in sockets:
+        sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Вартість однієї вибірки топу процесів на хості з тисячами процесів.
+
+Запускає --procs сплячих дочірніх процесів і вимірює ProcessSampler.sample()
+(oneshot, дельти CPU/IO, імена з попередньої вибірки). Для порівняння —
+голе читання тих самих полів через process_iter(attrs) без жодних
+обчислень: це нижня межа для psutil.
+
+    python benchmarks/bench_processes.py --procs 2000 --repeat 20
+"""
+
+import argparse
+import subprocess
+import time
+
+import psutil
+from common import import_bot, report
+
+bot = import_bot()
+
+
+def naive_sample():
+    return list(psutil.process_iter(
+        ["create_time", "cpu_times", "memory_info", "name", "io_counters"], ad_value=None
+    ))
+
+
+def measure(func, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--procs", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    children = [subprocess.Popen(["sleep", "600"]) for _ in range(args.procs)]
+    try:
+        sampler = bot.ProcessSampler()
+        sampler.sample()
+        print(f"процесів: {len(sampler.rows)}")
+        timings = measure(sampler.sample, args.repeat)
+        report("ProcessSampler.sample", timings)
+        report("process_iter(attrs)", measure(naive_sample, args.repeat))
+        print(f"на процес: {min(timings) * 1000 / len(sampler.rows):.1f} мкс")
+    finally:
+        for child in children:
+            child.kill()
+        for child in children:
+            child.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Тест швидкості проти вбудованого тестового сервера.
+
+Піднімає сервер /__down та /__up на loopback (або використовує вказаний
+--server, напр. інший хост у локальній мережі, запущений з
+--speedtest-server) і проганяє run_speedtest з різною кількістю потоків.
+Так перевіряється стеля самого вимірювача без залежності від інтернету.
+
+    python benchmarks/bench_speedtest.py --streams 1 4 8 --duration 3
+"""
+
+import argparse
+import asyncio
+
+from common import import_bot
+
+bot = import_bot()
+
+
+async def run(args):
+    runner = None
+    server = args.server
+    if not server:
+        server = "127.0.0.1:18080"
+        runner = await bot.start_speedtest_server(server)
+    try:
+        for streams in args.streams:
+            result = await bot.run_speedtest(
+                [f"http://{server}/__down?bytes={args.bytes}"],
+                [f"http://{server}/__up"],
+                f"http://{server}/__down?bytes=0",
+                streams=streams,
+                duration=args.duration,
+            )
+            print(
+                f"потоків {streams:>2}: "
+                f"⬇️ {result.download_mbps:8.1f} Мбіт/с (p10 {result.download_p10:8.1f})   "
+                f"⬆️ {result.upload_mbps:8.1f} Мбіт/с (p10 {result.upload_p10:8.1f})   "
+                f"затримка p50 {result.latency_p50:.2f} мс, джитер {result.jitter:.2f} мс"
+            )
+    finally:
+        if runner:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", default="", help="host:port тестового сервера")
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--duration", type=float, default=3)
+    parser.add_argument("--bytes", type=int, default=100_000_000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
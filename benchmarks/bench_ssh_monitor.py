@@ -0,0 +1,146 @@
+"""Наскрізний бенчмарк SSH-монітора: фейковий journalctl -> бот -> фейковий Telegram.
+
+Вимірює пропускну здатність читання журналу (рядків/сек), затримку
+сповіщення про вхід від появи рядка до отримання "Telegram" (перцентилі)
+та приріст пам'яті процесу.
+
+    python benchmarks/bench_ssh_monitor.py --lines 200000 --rate 20000
+    python benchmarks/bench_ssh_monitor.py --mode storm --rate 0
+    python benchmarks/bench_ssh_monitor.py --replay recorded.json
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import shlex
+import stat
+import sys
+import tempfile
+import time
+
+from common import BENCH_DIR, import_bot, percentile
+
+REGEX_LOGIN_TS = re.compile(r"Юзер: <code>t(\d+)</code>")
+
+
+def install_fake_journalctl(directory: str) -> str:
+    """Кладе у directory скрипт journalctl, що запускає fake_journalctl.py"""
+    path = os.path.join(directory, "journalctl")
+    script = os.path.join(BENCH_DIR, "fake_journalctl.py")
+    with open(path, "w") as f:
+        f.write(f'#!/bin/sh\nexec {shlex.quote(sys.executable)} {shlex.quote(script)} "$@"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+async def run(args):
+    tmp = tempfile.mkdtemp(prefix="lmb-bench-")
+    install_fake_journalctl(tmp)
+    os.environ["PATH"] = f"{tmp}{os.pathsep}{os.environ['PATH']}"
+    os.environ["FAKE_JOURNAL_LINES"] = str(args.lines)
+    os.environ["FAKE_JOURNAL_RATE"] = str(args.rate)
+    os.environ["FAKE_JOURNAL_MODE"] = args.mode
+    os.environ["FAKE_JOURNAL_LOGINS"] = str(args.login_share)
+    if args.replay:
+        os.environ["FAKE_JOURNAL_REPLAY"] = os.path.abspath(args.replay)
+
+    bot_module = import_bot(
+        SSH_CURSOR_FILE=os.path.join(tmp, "cursor"),
+        NOTIFY_RATE=args.notify_rate,
+        NOTIFY_BURST=args.notify_rate,
+        NOTIFY_QUEUE_SIZE=100000,
+        IP_CACHE_FILE="",
+        SSH_DB_FILE=os.path.join(tmp, "ssh_events.db"),
+    )
+    import psutil
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from fake_telegram import FakeTelegram
+
+    if not args.real_dns:
+        # Зворотний DNS у пісочниці може "висіти" секундами — вимірюємо сам бот
+        async def no_dns(ip):
+            return None
+
+        bot_module._lookup_hostname = no_dns
+
+    telegram = FakeTelegram()
+    await telegram.start()
+    bot = Bot(bot_module.API_TOKEN, session=AiohttpSession(api=telegram.api_server()))
+
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    rss_peak = rss_before
+    stats = bot_module.SSH_MONITOR_STATS
+
+    bot_module.spawn(bot_module.NOTIFIER.run(bot))
+    bot_module.spawn(bot_module.SSH_STORE.run())
+    monitor = asyncio.create_task(bot_module.monitor_ssh_logins())
+
+    started = None
+    deadline = time.monotonic() + args.timeout
+    while stats["entries"] < args.lines and time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+        if started is None and stats["entries"]:
+            started = time.monotonic()
+        rss_peak = max(rss_peak, process.memory_info().rss)
+    finished = time.monotonic()
+
+    # Чекаємо, поки черга сповіщень спорожніє
+    while not bot_module.NOTIFIER.queue.empty() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.2)
+    await bot_module.SSH_STORE.flush()
+    rss_after = process.memory_info().rss
+
+    monitor.cancel()
+    await bot.session.close()
+    await telegram.stop()
+
+    latencies = []
+    for received, text in telegram.messages:
+        match = REGEX_LOGIN_TS.search(text)
+        if match:
+            latencies.append((received - int(match.group(1)) / 1_000_000) * 1000)
+
+    elapsed = finished - (started or finished)
+    processed = stats["entries"]
+    print(f"Режим: {args.mode}, задана швидкість: {args.rate or 'без обмеження'} рядків/с")
+    print(f"Оброблено записів: {processed}/{args.lines}, подій: {stats['events']}")
+    if elapsed:
+        print(f"Пропускна здатність: {processed / elapsed:,.0f} рядків/с за {elapsed:.2f} с")
+    print(
+        f"Повідомлень у Telegram: {len(telegram.messages)}, "
+        f"черга: {bot_module.NOTIFIER.stats()}"
+    )
+    print(f"База SSH: {bot_module.SSH_STORE.stats()}")
+    print(f"Перебір паролів: {bot_module.BRUTEFORCE.stats()}")
+    if latencies:
+        print(
+            f"Затримка входу (мс): p50 {percentile(latencies, 50):.1f}  "
+            f"p95 {percentile(latencies, 95):.1f}  p99 {percentile(latencies, 99):.1f}  "
+            f"max {max(latencies):.1f}  (n={len(latencies)})"
+        )
+    mb = 1024 * 1024
+    print(
+        f"RSS: до {rss_before / mb:.1f} MB, пік {rss_peak / mb:.1f} MB, "
+        f"після {rss_after / mb:.1f} MB (приріст {(rss_after - rss_before) / mb:+.1f} MB)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=10000, help="рядків/сек, 0 — без обмеження")
+    parser.add_argument("--mode", choices=["mixed", "storm"], default="mixed")
+    parser.add_argument("--login-share", type=float, default=0.01)
+    parser.add_argument("--replay", help="файл з записаним трафіком sshd")
+    parser.add_argument("--notify-rate", type=float, default=1000)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--real-dns", action="store_true", help="не вимикати reverse DNS")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Затримка доставки апдейтів: long polling проти вебхука.
+
+Той самий диспетчер бота по черзі отримує натискання кнопки "menu_main"
+через getUpdates фейкового Telegram API (fake_telegram.py) та через
+вбудований сервер вебхука. Вимірюється час від появи апдейту до
+отримання фейковим API відповіді бота (editMessageText). --latency
+імітує RTT до Telegram: у режимі polling на нього затримується відповідь
+getUpdates, у режимі вебхука — запит від "Telegram" до бота.
+
+    python benchmarks/bench_webhook.py --updates 500 --latency 20
+"""
+
+import argparse
+import asyncio
+import itertools
+import time
+
+from common import import_bot, percentile, report
+
+bot_module = import_bot(IP_CACHE_FILE="", METRICS_DB_FILE="")
+
+WEBHOOK_ADDRESS = "127.0.0.1:18443"
+WEBHOOK_PATH = "/bench-webhook"
+WEBHOOK_SECRET = "bench-secret"
+
+
+def make_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": bot_module.ALLOWED_USER_ID, "is_bot": False, "first_name": "bench"},
+            "chat_instance": "1",
+            "data": "menu_main",
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": bot_module.ALLOWED_USER_ID, "type": "private"},
+                "text": "bench",
+            },
+        },
+    }
+
+
+async def wait_edit(telegram, count: int, started: float) -> float:
+    while len(telegram.edits) < count:
+        await asyncio.sleep(0.001)
+    return (telegram.edits[count - 1][0] - started) * 1000
+
+
+async def bench_polling(dp, bot, telegram, args, update_ids) -> list[float]:
+    polling = asyncio.create_task(
+        dp.start_polling(bot, handle_signals=False, close_bot_session=False, polling_timeout=30)
+    )
+    # Перший апдейт прогріває сесію та getMe
+    telegram.push_update(make_update(next(update_ids)))
+    await wait_edit(telegram, len(telegram.edits) + 1, time.time())
+
+    timings = []
+    for _ in range(args.updates):
+        expected = len(telegram.edits) + 1
+        started = time.time()
+        telegram.push_update(make_update(next(update_ids)))
+        timings.append(await wait_edit(telegram, expected, started))
+        await asyncio.sleep(args.interval / 1000)
+    await dp.stop_polling()
+    await polling
+    return timings
+
+
+async def bench_webhook(dp, bot, telegram, args, update_ids) -> list[float]:
+    import aiohttp
+
+    runner = await bot_module.start_webhook_server(
+        dp, bot, WEBHOOK_ADDRESS, WEBHOOK_PATH, WEBHOOK_SECRET
+    )
+    url = f"http://{WEBHOOK_ADDRESS}{WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}
+    timings = []
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                url, json=make_update(0), headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+            ) as resp:
+                assert resp.status == 401, f"неправильний секрет прийнято: {resp.status}"
+
+            for warmup in (True,) + (False,) * args.updates:
+                expected = len(telegram.edits) + 1
+                started = time.time()
+                if telegram.latency:
+                    await asyncio.sleep(telegram.latency)
+                async with session.post(url, json=make_update(next(update_ids)), headers=headers) as resp:
+                    resp.raise_for_status()
+                elapsed = await wait_edit(telegram, expected, started)
+                if not warmup:
+                    timings.append(elapsed)
+                await asyncio.sleep(args.interval / 1000)
+    finally:
+        await runner.cleanup()
+    return timings
+
+
+async def run(args):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from fake_telegram import FakeTelegram
+
+    telegram = FakeTelegram(latency=args.latency / 1000)
+    await telegram.start()
+    bot = Bot(bot_module.API_TOKEN, session=AiohttpSession(api=telegram.api_server()))
+    dp = bot_module.build_dispatcher()
+    update_ids = itertools.count(1)
+    try:
+        results = {
+            "polling": await bench_polling(dp, bot, telegram, args, update_ids),
+            "webhook": await bench_webhook(dp, bot, telegram, args, update_ids),
+        }
+    finally:
+        await bot.session.close()
+        await telegram.stop()
+
+    print(f"апдейтів: {args.updates}, RTT до API: {args.latency:g} мс")
+    for name, timings in results.items():
+        report(name, timings)
+        print(f"{'':<28} p99 {percentile(timings, 99):9.3f} ms   max {max(timings):9.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0, help="затримка API, мс")
+    parser.add_argument("--interval", type=float, default=5, help="пауза між апдейтами, мс")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
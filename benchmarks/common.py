@@ -0,0 +1,41 @@
+"""Спільні помічники для бенчмарків: імпорт бота та звіти."""
+
+import os
+import statistics
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+
+def import_bot(**env):
+    """Імпортує linux_monitor_bot з тестовою конфігурацією.
+
+    Бот читає налаштування з оточення під час імпорту, тому env
+    потрібно задати до імпорту.
+    """
+    os.environ.setdefault("TELEGRAM_API_TOKEN", "123456:bench")
+    os.environ.setdefault("ALLOWED_USER_ID", "1")
+    os.environ.setdefault("STATE_DIR", os.path.join(BENCH_DIR, ".state"))
+    for key, value in env.items():
+        os.environ[key] = str(value)
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+    import linux_monitor_bot
+
+    return linux_monitor_bot
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name: str, timings_ms: list[float]):
+    print(
+        f"{name:<28} median {statistics.median(timings_ms):9.3f} ms   "
+        f"p95 {percentile(timings_ms, 95):9.3f} ms   min {min(timings_ms):9.3f} ms"
+    )
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Замінник `journalctl -f -o json` для бенчмарків SSH-монітора.
+
+Генерує (або відтворює з файлу) трафік sshd/PAM у форматі journald JSON
+з заданою швидкістю. Параметри — через змінні оточення, бо монітор
+запускає цей скрипт з аргументами справжнього journalctl:
+
+    FAKE_JOURNAL_LINES   кількість рядків (за замовчуванням 100000)
+    FAKE_JOURNAL_RATE    рядків/сек, 0 — без обмеження (за замовчуванням 10000)
+    FAKE_JOURNAL_MODE    mixed | storm (brute-force з багатьох IP)
+    FAKE_JOURNAL_LOGINS  частка успішних входів (за замовчуванням 0.01)
+    FAKE_JOURNAL_REPLAY  файл для відтворення: вивід `journalctl -o json`
+                         або просто повідомлення sshd по одному на рядок
+
+Для вимірювання затримки ім'я користувача у рядках "Accepted" містить
+час генерації в мікросекундах: t<unix_us>.
+"""
+
+import json
+import os
+import random
+import sys
+import time
+
+LINES = int(os.getenv("FAKE_JOURNAL_LINES", "100000"))
+RATE = float(os.getenv("FAKE_JOURNAL_RATE", "10000"))
+MODE = os.getenv("FAKE_JOURNAL_MODE", "mixed")
+LOGIN_SHARE = float(os.getenv("FAKE_JOURNAL_LOGINS", "0.01"))
+REPLAY = os.getenv("FAKE_JOURNAL_REPLAY", "")
+
+# Пакет рядків за один "тік", щоб не спати після кожного рядка
+TICK = 0.01
+
+
+def random_ip(rng: random.Random, storm: bool) -> str:
+    if storm:
+        return f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+    return f"10.0.{rng.randint(0, 3)}.{rng.randint(1, 20)}"
+
+
+def generate_messages(rng: random.Random):
+    storm = MODE == "storm"
+    users = ["root", "admin", "oracle", "test", "ubuntu", "git"]
+    while True:
+        ip = random_ip(rng, storm)
+        port = rng.randint(1024, 65535)
+        roll = rng.random()
+        if roll < LOGIN_SHARE:
+            yield f"Accepted password for t{int(time.time() * 1_000_000)} from 10.0.0.1 port {port} ssh2"
+        elif storm or roll < 0.5:
+            user = rng.choice(users)
+            if rng.random() < 0.5:
+                yield f"Failed password for {user} from {ip} port {port} ssh2"
+            else:
+                yield f"Invalid user {user} from {ip} port {port}"
+        elif roll < 0.75:
+            yield f"Disconnected from user git {ip} port {port}"
+        elif roll < 0.9:
+            yield "pam_unix(sshd:session): session closed for user git"
+        else:
+            yield f"Connection closed by {ip} port {port} [preauth]"
+
+
+def replay_messages():
+    with open(REPLAY) as f:
+        lines = [line.rstrip("\n") for line in f if line.strip()]
+    while True:
+        for line in lines:
+            if line.startswith("{"):
+                yield json.loads(line).get("MESSAGE", "")
+            else:
+                yield line
+
+
+def main():
+    messages = replay_messages() if REPLAY else generate_messages(random.Random(42))
+    out = sys.stdout
+    per_tick = max(1, int(RATE * TICK)) if RATE else LINES
+    sent = 0
+    started = time.monotonic()
+    while sent < LINES:
+        batch = min(per_tick, LINES - sent)
+        now_us = int(time.time() * 1_000_000)
+        for _ in range(batch):
+            sent += 1
+            out.write(
+                json.dumps(
+                    {
+                        "__CURSOR": f"s=bench;i={sent}",
+                        "__REALTIME_TIMESTAMP": str(now_us),
+                        "_PID": "4242",
+                        "MESSAGE": next(messages),
+                    }
+                )
+                + "\n"
+            )
+        out.flush()
+        if RATE:
+            # Тримаємо задану швидкість відносно початку, а не між тіками
+            delay = started + sent / RATE - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    # Як `journalctl -f`: після виводу продовжуємо "слухати"
+    if "-f" in sys.argv[1:]:
+        while True:
+            time.sleep(3600)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass
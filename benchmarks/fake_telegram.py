@@ -0,0 +1,109 @@
+"""Мінімальний фейковий Telegram Bot API сервер на aiohttp.
+
+Відповідає на методи, які використовує бот, і запам'ятовує час
+отримання кожного повідомлення. Використовується бенчмарками як
+локальна заміна api.telegram.org:
+
+    server = FakeTelegram()
+    await server.start()
+    bot = Bot(token, session=AiohttpSession(api=server.api_server()))
+"""
+
+import asyncio
+import itertools
+import time
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        # Штучна затримка відповіді, імітує RTT до справжнього API
+        self.latency = latency
+        self.messages: list[tuple[float, str]] = []
+        self.edits: list[tuple[float, str]] = []
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def api_server(self):
+        from aiogram.client.telegram import TelegramAPIServer
+
+        return TelegramAPIServer.from_base(self.base_url)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def push_update(self, update: dict):
+        """Ставить апдейт у чергу для getUpdates"""
+        update.setdefault("update_id", next(self._update_ids))
+        self.updates.put_nowait(update)
+
+    def _message(self, chat_id, text: str = "") -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 1), "type": "private"},
+            "text": text,
+        }
+
+    async def _params(self, request: web.Request) -> dict:
+        params = dict(request.query)
+        if request.content_type == "application/json":
+            params.update(await request.json())
+        elif request.can_read_body:
+            params.update(await request.post())
+        return params
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = await self._params(request)
+        received = time.time()
+        if method == "getupdates":
+            timeout = float(params.get("timeout") or 0)
+            result = []
+            try:
+                result.append(await asyncio.wait_for(self.updates.get(), timeout or 0.01))
+                while not self.updates.empty():
+                    result.append(self.updates.get_nowait())
+            except asyncio.TimeoutError:
+                pass
+            # Затримка після появи апдейту: він "летить" до бота так само,
+            # як запит вебхука від Telegram
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return web.json_response({"ok": True, "result": result})
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method in ("sendmessage", "senddocument"):
+            text = str(params.get("text") or params.get("caption") or "")
+            self.messages.append((received, text))
+            result = self._message(params.get("chat_id"), text)
+        elif method == "editmessagetext":
+            text = str(params.get("text", ""))
+            self.edits.append((received, text))
+            result = self._message(params.get("chat_id"), text)
+        else:
+            # deleteWebhook, setWebhook, answerCallbackQuery, deleteMessage ...
+            result = True
+        return web.json_response({"ok": True, "result": result})
@@ -1,33 +1,262 @@
+import argparse
 import asyncio
+import base64
+import bisect
+import concurrent.futures
 import datetime
+import fnmatch
+import functools
+import glob
+import hashlib
+import heapq
+import hmac
+import html
+import ipaddress
+import itertools
+import json
 import logging
+import math
+import mmap
 import os
+import pwd
+import queue
 import re
+import secrets
+import shlex
+import signal
 import shutil
 import socket
+import sqlite3
+import ssl
+import stat
+import struct
 import subprocess
-from typing import Union
+import threading
+import time
+import urllib.parse
+import zlib
+from collections import OrderedDict, deque
+from typing import NamedTuple, Union
 
 import aiohttp
 import psutil
 from aiogram import Bot, Dispatcher, F, Router, types
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import BaseFilter, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import CallbackQuery, FSInputFile, Message
+from aiogram.types import (
+    BufferedInputFile,
+    CallbackQuery,
+    InputFile,
+    InputMediaPhoto,
+    Message,
+)
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from dotenv import load_dotenv
 
+try:
+    from dbus_fast import BusType, Message as DBusMessage, MessageType
+    from dbus_fast.aio import MessageBus
+except ImportError:  # без dbus-fast працює запасний варіант через systemctl
+    MessageBus = None
+
 # --- КОНФІГУРАЦІЯ ---
 load_dotenv()
 API_TOKEN = os.getenv("TELEGRAM_API_TOKEN")
-ALLOWED_USER_ID = int(os.getenv("ALLOWED_USER_ID"))
-
-if not API_TOKEN or not ALLOWED_USER_ID:
-    raise ValueError(
-        "Помилка: Не вдалося завантажити API_TOKEN або ALLOWED_USER_ID з .env файлу."
-    )
+ALLOWED_USER_ID = int(os.getenv("ALLOWED_USER_ID") or 0)
+
+# Фоновий збір метрик: інтервал (сек) та розмір кільцевого буфера (к-сть замірів).
+# За замовчуванням буфер вміщує 15 хвилин історії.
+METRICS_SAMPLE_INTERVAL = float(os.getenv("METRICS_SAMPLE_INTERVAL", "5"))
+METRICS_BUFFER_SIZE = int(
+    os.getenv("METRICS_BUFFER_SIZE", str(int(900 / METRICS_SAMPLE_INTERVAL) + 1))
+)
+# Топ процесів: інтервал (сек) між вибірками, з яких рахується CPU% та IO,
+# і скільки процесів показувати
+PROCESS_SAMPLE_INTERVAL = float(os.getenv("PROCESS_SAMPLE_INTERVAL", "3"))
+PROCESS_TOP_N = int(os.getenv("PROCESS_TOP_N", "10"))
+# Аналіз диска (/du): скільки потоків читають каталоги, скільки каталогів і
+# файлів показувати, максимальна тривалість (сек) та розмір кешу (каталогів)
+DISK_SCAN_THREADS = int(os.getenv("DISK_SCAN_THREADS", "8"))
+DISK_SCAN_TOP_N = int(os.getenv("DISK_SCAN_TOP_N", "10"))
+DISK_SCAN_TIMEOUT = float(os.getenv("DISK_SCAN_TIMEOUT", "600"))
+DISK_SCAN_CACHE_SIZE = int(os.getenv("DISK_SCAN_CACHE_SIZE", "200000"))
+
+# Інтервал (сек) фонової перевірки відкритих портів; 0 — вимкнено
+PORTS_WATCH_INTERVAL = float(os.getenv("PORTS_WATCH_INTERVAL", "60"))
+
+# Адреса шини D-Bus для стеження за systemd (порожнє — системна шина)
+SYSTEMD_DBUS_ADDRESS = os.getenv("SYSTEMD_DBUS_ADDRESS") or None
+
+# Фонова перевірка оновлень: інтервал (сек) та кількість пакетів на сторінці
+UPDATES_CHECK_INTERVAL = float(os.getenv("UPDATES_CHECK_INTERVAL", "3600"))
+UPDATES_PAGE_SIZE = int(os.getenv("UPDATES_PAGE_SIZE", "40"))
+
+# Оновлення системи: загальний тайм-аут (сек) та мінімальний інтервал (сек)
+# між редагуваннями повідомлення з прогресом
+UPGRADE_TIMEOUT = float(os.getenv("UPGRADE_TIMEOUT", "3600"))
+UPGRADE_EDIT_INTERVAL = float(os.getenv("UPGRADE_EDIT_INTERVAL", "3"))
+# Фонове завантаження пакетів після перевірки, що знайшла оновлення
+# (1 — увімкнено; без root потрібне правило sudo NOPASSWD, див. README),
+# обмеження швидкості в КБ/с (0 — без обмеження) та пріоритет nice/ionice
+PREFETCH_UPDATES = os.getenv("PREFETCH_UPDATES", "0") == "1"
+PREFETCH_BANDWIDTH_KB = int(os.getenv("PREFETCH_BANDWIDTH_KB", "0"))
+PREFETCH_NICE = int(os.getenv("PREFETCH_NICE", "19"))
+PREFETCH_IONICE_CLASS = int(os.getenv("PREFETCH_IONICE_CLASS", "3"))
+
+# Каталог для стану між перезапусками (курсор журналу, кеші тощо)
+STATE_DIR = os.getenv("STATE_DIR", "state")
+# Файл з курсором journald, з якого SSH-монітор продовжить після перезапуску
+SSH_CURSOR_FILE = os.getenv(
+    "SSH_CURSOR_FILE", os.path.join(STATE_DIR, "ssh_monitor.cursor")
+)
+# Кеш reverse DNS / GeoIP: розмір, TTL (сек), TTL для невдалих запитів,
+# файл знімка між перезапусками (порожнє значення вимикає збереження)
+IP_CACHE_SIZE = int(os.getenv("IP_CACHE_SIZE", "1024"))
+IP_CACHE_TTL = float(os.getenv("IP_CACHE_TTL", "86400"))
+IP_CACHE_NEGATIVE_TTL = float(os.getenv("IP_CACHE_NEGATIVE_TTL", "300"))
+IP_CACHE_FILE = os.getenv("IP_CACHE_FILE", os.path.join(STATE_DIR, "ip_cache.json"))
+# Довірені мережі (CIDR через кому): входи з них не перевіряються через GeoIP
+TRUSTED_NETWORKS = [
+    ipaddress.ip_network(net.strip(), strict=False)
+    for net in os.getenv("TRUSTED_NETWORKS", "").split(",")
+    if net.strip()
+]
+# Черга сповіщень: розмір, швидкість (повідомлень/сек), розмір "пачки",
+# вікно (сек), протягом якого схожі події об'єднуються в одне зведення
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "500"))
+NOTIFY_RATE = float(os.getenv("NOTIFY_RATE", "1"))
+NOTIFY_BURST = int(os.getenv("NOTIFY_BURST", "5"))
+NOTIFY_COALESCE_WINDOW = float(os.getenv("NOTIFY_COALESCE_WINDOW", "30"))
+# Максимальна пауза (сек) між перезапусками journalctl у SSH-моніторі
+SSH_MONITOR_MAX_BACKOFF = float(os.getenv("SSH_MONITOR_MAX_BACKOFF", "60"))
+# База SSH-подій та сесій (SQLite; порожнє — вимкнено): запис пачками по
+# N подій або раз на T мс, та скільки днів зберігати історію
+SSH_DB_FILE = os.getenv("SSH_DB_FILE", os.path.join(STATE_DIR, "ssh_events.db"))
+SSH_DB_BATCH_SIZE = int(os.getenv("SSH_DB_BATCH_SIZE", "1000"))
+SSH_DB_FLUSH_MS = float(os.getenv("SSH_DB_FLUSH_MS", "500"))
+SSH_DB_RETENTION_DAYS = float(os.getenv("SSH_DB_RETENTION_DAYS", "90"))
+# Історія метрик на диску (кільцеві архіви фіксованого розміру; порожнє —
+# вимкнено) та архіви "крок_сек:рядків,..." — за замовчуванням 10с на добу,
+# 1 хв на тиждень та 1 год на рік
+METRICS_DB_FILE = os.getenv("METRICS_DB_FILE", os.path.join(STATE_DIR, "metrics.rrd"))
+METRICS_DB_ARCHIVES = [
+    tuple(int(part) for part in item.split(":"))
+    for item in os.getenv("METRICS_DB_ARCHIVES", "10:8640,60:10080,3600:8760").split(",")
+    if item.strip()
+]
+# Захист від перебору паролів: вікно (сек) та пороги невдалих спроб з одного
+# IP, на одного користувача і загалом (0 — поріг вимкнено), скільки IP/імен
+# тримати в пам'яті, набори nftables для блокування ("family table set",
+# окремо для IPv6; порожнє — не блокувати) та час блокування (сек)
+BRUTEFORCE_WINDOW = float(os.getenv("BRUTEFORCE_WINDOW", "600"))
+BRUTEFORCE_IP_THRESHOLD = int(os.getenv("BRUTEFORCE_IP_THRESHOLD", "10"))
+BRUTEFORCE_USER_THRESHOLD = int(os.getenv("BRUTEFORCE_USER_THRESHOLD", "30"))
+BRUTEFORCE_TOTAL_THRESHOLD = int(os.getenv("BRUTEFORCE_TOTAL_THRESHOLD", "200"))
+BRUTEFORCE_MAX_KEYS = int(os.getenv("BRUTEFORCE_MAX_KEYS", "10000"))
+BRUTEFORCE_NFT_SET = os.getenv("BRUTEFORCE_NFT_SET", "")
+BRUTEFORCE_NFT_SET6 = os.getenv("BRUTEFORCE_NFT_SET6", "")
+BRUTEFORCE_NFT_TIMEOUT = int(os.getenv("BRUTEFORCE_NFT_TIMEOUT", "3600"))
+
+# Алерти за порогами (0 — правило вимкнено). Правило спрацьовує, коли
+# поріг перевищено ALERT_SAMPLES замірів поспіль, і знімається лише після
+# повернення за поріг з запасом ALERT_HYSTERESIS_PERCENT відсотків від порогу.
+ALERT_CPU_PERCENT = float(os.getenv("ALERT_CPU_PERCENT", "90"))
+ALERT_MEM_AVAILABLE_MB = float(os.getenv("ALERT_MEM_AVAILABLE_MB", "256"))
+ALERT_DISK_PERCENT = float(os.getenv("ALERT_DISK_PERCENT", "90"))
+ALERT_DISK_MOUNTS = [m for m in os.getenv("ALERT_DISK_MOUNTS", "/").split(",") if m]
+ALERT_TEMP = float(os.getenv("ALERT_TEMP", "85"))
+ALERT_SAMPLES = int(os.getenv("ALERT_SAMPLES", "6"))
+ALERT_HYSTERESIS_PERCENT = float(os.getenv("ALERT_HYSTERESIS_PERCENT", "5"))
+ALERT_COOLDOWN = float(os.getenv("ALERT_COOLDOWN", "1800"))
+
+# Режим флоту: спільний секрет, адреса агента ("host:port" або "unix:/шлях"),
+# список агентів для бота ("ім'я=адреса,..."), тайм-аут на хост (сек),
+# ліміт розміру логів через агента (МБ) та необов'язковий TLS
+FLEET_SECRET = os.getenv("FLEET_SECRET", "")
+FLEET_AGENT_LISTEN = os.getenv("FLEET_AGENT_LISTEN", "127.0.0.1:8765")
+FLEET_AGENTS = dict(
+    item.strip().split("=", 1)
+    for item in os.getenv("FLEET_AGENTS", "").split(",")
+    if "=" in item
+)
+FLEET_TIMEOUT = float(os.getenv("FLEET_TIMEOUT", "10"))
+FLEET_LOG_LIMIT_MB = int(os.getenv("FLEET_LOG_LIMIT_MB", "20"))
+FLEET_TLS_CERT = os.getenv("FLEET_TLS_CERT", "")
+FLEET_TLS_KEY = os.getenv("FLEET_TLS_KEY", "")
+FLEET_TLS_CA = os.getenv("FLEET_TLS_CA", "")
+
+# Тест швидкості: URL для завантаження/вивантаження/затримки (через кому —
+# потоки розподіляються між ними), кількість паралельних потоків, тривалість
+# кожної фази (сек), адреса вбудованого тестового сервера ("host:port"; порожнє —
+# вимкнено) та файл з історією результатів
+SPEEDTEST_DOWNLOAD_URLS = os.getenv(
+    "SPEEDTEST_DOWNLOAD_URLS", "https://speed.cloudflare.com/__down?bytes=25000000"
+).split(",")
+SPEEDTEST_UPLOAD_URLS = os.getenv(
+    "SPEEDTEST_UPLOAD_URLS", "https://speed.cloudflare.com/__up"
+).split(",")
+SPEEDTEST_LATENCY_URL = os.getenv(
+    "SPEEDTEST_LATENCY_URL", "https://speed.cloudflare.com/__down?bytes=0"
+)
+SPEEDTEST_STREAMS = int(os.getenv("SPEEDTEST_STREAMS", "4"))
+SPEEDTEST_DURATION = float(os.getenv("SPEEDTEST_DURATION", "10"))
+SPEEDTEST_SERVER_LISTEN = os.getenv("SPEEDTEST_SERVER_LISTEN", "")
+SPEEDTEST_HISTORY_FILE = os.getenv(
+    "SPEEDTEST_HISTORY_FILE", os.path.join(STATE_DIR, "speedtest_history.json")
+)
+
+# Адреса HTTP-ендпоінта /metrics у форматі Prometheus ("host:port"; порожнє — вимкнено)
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "")
+
+# Максимальний розмір однієї частини експорту логів (ліміт Telegram — 50 МБ)
+LOGS_PART_SIZE_MB = int(os.getenv("LOGS_PART_SIZE_MB", "45"))
+# Максимальна тривалість експорту логів (сек), разом з відправкою частин
+LOGS_EXPORT_TIMEOUT = float(os.getenv("LOGS_EXPORT_TIMEOUT", "1800"))
+# Кількість записів на одній сторінці пошуку в журналі (/journal)
+JOURNAL_SEARCH_PAGE_SIZE = int(os.getenv("JOURNAL_SEARCH_PAGE_SIZE", "20"))
+# Живий журнал (/tail): скільки останніх рядків показувати, як часто (сек)
+# редагувати повідомлення, через скільки секунд зупинятись та скільки хвостів
+# може працювати одночасно
+LIVE_TAIL_LINES = int(os.getenv("LIVE_TAIL_LINES", "15"))
+LIVE_TAIL_EDIT_INTERVAL = float(os.getenv("LIVE_TAIL_EDIT_INTERVAL", "3"))
+LIVE_TAIL_TIMEOUT = float(os.getenv("LIVE_TAIL_TIMEOUT", "600"))
+LIVE_TAIL_MAX = int(os.getenv("LIVE_TAIL_MAX", "4"))
+
+# Скільки задач кожного виду виконується одночасно ("вид=N,..."); решта чекає
+# в черзі. pkg — пакетний менеджер, logs — експорт логів, net — тест швидкості,
+# disk — аналіз диска
+JOB_LIMITS = {
+    "pkg": 1,
+    "logs": 2,
+    "net": 1,
+    "disk": 1,
+    **{
+        kind.strip(): int(limit)
+        for kind, _, limit in (
+            item.partition("=") for item in os.getenv("JOB_LIMITS", "").split(",") if "=" in item
+        )
+    },
+}
+# Як часто (сек) оновлювати повідомлення з позицією задачі в черзі
+JOB_STATUS_INTERVAL = float(os.getenv("JOB_STATUS_INTERVAL", "5"))
+
+# Режим вебхука: якщо задано публічну адресу (напр. https://bot.example.com/tg),
+# бот не опитує getUpdates, а приймає апдейти на вбудованому HTTP-сервері.
+# Шлях маршруту береться з адреси, сервер слухає WEBHOOK_LISTEN ("host:port")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1:8080")
+# Секрет із заголовка X-Telegram-Bot-Api-Secret-Token (порожнє — випадковий на кожен запуск)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "") or secrets.token_urlsafe(32)
+# Сертифікат і ключ, щоб приймати HTTPS без reverse proxy; самопідписаний
+# сертифікат потрібно ще й передати в Telegram (WEBHOOK_SELF_SIGNED=1)
+WEBHOOK_TLS_CERT = os.getenv("WEBHOOK_TLS_CERT", "")
+WEBHOOK_TLS_KEY = os.getenv("WEBHOOK_TLS_KEY", "")
+WEBHOOK_SELF_SIGNED = os.getenv("WEBHOOK_SELF_SIGNED", "0") == "1"
 
 
 # --- ФІЛЬТР БЕЗПЕКИ ---
@@ -47,6 +276,453 @@ class ActionStates(StatesGroup):
     waiting_for_upgrade_password = State()
     waiting_for_reboot_password = State()
     waiting_for_ssh_password = State()
+    waiting_for_process_password = State()
+
+
+# --- МЕТРИКИ БОТА (PROMETHEUS) ---
+# Спостереження коштує пошук у dict та bisect по кошиках, тож метрики
+# збираються завжди, а ендпоінт /metrics вмикається через METRICS_LISTEN.
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # labels -> [лічильники по кошиках (не кумулятивні), сума, кількість]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+def metric_lines(
+    name: str, help_text: str, samples: list[tuple[dict, float]], metric_type: str = "gauge"
+) -> list[str]:
+    """Рядки метрики, значення якої обчислюються під час запиту /metrics"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        if value is not None:
+            lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+    return lines
+
+
+HANDLER_LATENCY = Histogram(
+    "lmb_handler_duration_seconds", "Час обробки callback-ів та команд Telegram"
+)
+THREAD_JOB_DURATION = Histogram(
+    "lmb_thread_job_duration_seconds", "Тривалість задач у пулі потоків"
+)
+SUBPROCESS_DURATION = Histogram(
+    "lmb_subprocess_duration_seconds", "Тривалість зовнішніх команд"
+)
+SUBPROCESS_EXITS = Counter(
+    "lmb_subprocess_exits_total", "Завершення зовнішніх команд за кодом виходу"
+)
+SUBPROCESS_TIMEOUTS = Counter(
+    "lmb_subprocess_timeouts_total", "Зовнішні команди, перервані за тайм-аутом"
+)
+METRICS_COLLECTORS: list = [
+    HANDLER_LATENCY,
+    THREAD_JOB_DURATION,
+    SUBPROCESS_DURATION,
+    SUBPROCESS_EXITS,
+    SUBPROCESS_TIMEOUTS,
+]
+
+
+def command_label(command: list[str]) -> str:
+    """Ім'я програми для міток: 'sudo -p "" -S pacman -Syu' -> 'pacman'"""
+    args = list(command)
+    if args and args[0] == "sudo":
+        args = args[1:]
+        while args and (args[0].startswith("-") or args[0] == ""):
+            # -p приймає аргумент (рядок запрошення)
+            if args[0] == "-p" and len(args) > 1:
+                args = args[1:]
+            args = args[1:]
+    return os.path.basename(args[0]) if args else "?"
+
+
+def record_subprocess(
+    command: list[str], started: float, returncode: int | None, timed_out: bool = False
+):
+    label = command_label(command)
+    SUBPROCESS_DURATION.observe(time.monotonic() - started, command=label)
+    if timed_out:
+        SUBPROCESS_TIMEOUTS.inc(command=label)
+    else:
+        SUBPROCESS_EXITS.inc(command=label, code=str(returncode))
+
+
+def run_command(command: list[str], **kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run з записом тривалості, коду виходу та тайм-аутів"""
+    started = time.monotonic()
+    try:
+        result = subprocess.run(command, **kwargs)
+    except subprocess.TimeoutExpired:
+        record_subprocess(command, started, None, timed_out=True)
+        raise
+    except subprocess.CalledProcessError as e:
+        record_subprocess(command, started, e.returncode)
+        raise
+    record_subprocess(command, started, result.returncode)
+    return result
+
+
+async def run_in_thread(func, *args):
+    """asyncio.to_thread з записом тривалості задачі"""
+    started = time.monotonic()
+    try:
+        return await asyncio.to_thread(func, *args)
+    finally:
+        THREAD_JOB_DURATION.observe(
+            time.monotonic() - started, job=getattr(func, "__name__", "?")
+        )
+
+
+async def handler_timing_middleware(handler, event, data):
+    """Middleware aiogram: час обробки кожного callback-а/команди"""
+    if isinstance(event, CallbackQuery):
+        label = (event.data or "").split(":", 1)[0]
+    elif isinstance(event, Message) and event.text and event.text.startswith("/"):
+        label = event.text.split()[0].split("@")[0]
+    else:
+        label = "message"
+    started = time.monotonic()
+    try:
+        return await handler(event, data)
+    finally:
+        HANDLER_LATENCY.observe(time.monotonic() - started, handler=label)
+
+
+def collect_runtime_metrics() -> list[str]:
+    """Gauge-и та лічильники, які вже ведуть інші частини бота.
+
+    Значення беруться з останнього зразка METRICS_HISTORY (ті самі дані, що
+    й у дашборді), тож запит /metrics не викликає psutil.
+    """
+    lines = []
+    if METRICS_HISTORY:
+        s = METRICS_HISTORY[-1]
+        lines += metric_lines("lmb_host_cpu_percent", "Завантаження CPU", [({}, s.cpu_percent)])
+        lines += metric_lines(
+            "lmb_host_memory_bytes",
+            "Пам'ять",
+            [({"kind": "total"}, s.mem_total), ({"kind": "used"}, s.mem_used),
+             ({"kind": "available"}, s.mem_available)],
+        )
+        lines += metric_lines(
+            "lmb_host_disk_bytes",
+            "Коренева ФС",
+            [({"kind": "total"}, s.disk_total), ({"kind": "used"}, s.disk_used)],
+        )
+        lines += metric_lines("lmb_host_temperature_celsius", "Температура CPU", [({}, s.temp)])
+        lines += metric_lines("lmb_host_uptime_seconds", "Аптайм", [({}, s.uptime)])
+        lines += metric_lines("lmb_host_sample_timestamp_seconds", "Час зразка", [({}, s.ts)])
+    lines += metric_lines(
+        "lmb_ssh_monitor_total",
+        "Лічильники SSH-монітора (записи журналу, події, перезапуски)",
+        [({"kind": key}, value) for key, value in SSH_MONITOR_STATS.items()],
+        "counter",
+    )
+    caches = {"hostname": HOSTNAME_CACHE, "geoip": GEOIP_CACHE}
+    lines += metric_lines(
+        "lmb_ip_cache_requests_total",
+        "Звернення до кешів IP-інформації",
+        [({"cache": name, "result": result}, getattr(cache, attr))
+         for name, cache in caches.items()
+         for result, attr in (("hit", "hits"), ("miss", "misses"), ("coalesced", "coalesced"))],
+        "counter",
+    )
+    lines += metric_lines(
+        "lmb_notifications_total",
+        "Сповіщення за результатом",
+        [({"result": key}, getattr(NOTIFIER, key))
+         for key in ("sent", "failed", "dropped", "coalesced")],
+        "counter",
+    )
+    lines += metric_lines(
+        "lmb_notification_queue_depth", "Повідомлень у черзі", [({}, NOTIFIER.queue.qsize())]
+    )
+    return lines
+
+
+METRICS_COLLECTORS.append(collect_runtime_metrics)
+
+
+def render_metrics() -> str:
+    lines = []
+    for collector in METRICS_COLLECTORS:
+        lines.extend(collector() if callable(collector) else collector.render())
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    return web.Response(
+        text=render_metrics(), content_type="text/plain", charset="utf-8",
+        headers={"X-Content-Type-Options": "nosniff"},
+    )
+
+
+async def start_metrics_server(address: str = METRICS_LISTEN) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_endpoint)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    host, _, port = address.rpartition(":")
+    await web.TCPSite(runner, host.strip("[]") or None, int(port)).start()
+    logging.info(f"📈 Метрики Prometheus: http://{address}/metrics")
+    return runner
+
+
+# --- ЧЕРГА ЗАДАЧ ---
+class JobCancelled(Exception):
+    """Задачу скасовано кнопкою, /jobs або запитом з вищим пріоритетом"""
+
+
+class Job:
+    """Задача JobManager: вид, стан, час у черзі та виконання, результат"""
+
+    def __init__(self, job_id: int, kind: str, title: str, factory, key, timeout, preemptible, on_cancel):
+        self.id = job_id
+        self.kind = kind
+        self.title = title
+        self.factory = factory
+        self.key = key
+        self.timeout = timeout
+        self.preemptible = preemptible
+        self.on_cancel = on_cancel
+        self.created = time.monotonic()
+        self.started: float | None = None
+        self.cancelled = False
+        self.task: asyncio.Task | None = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # На результат фонових задач ніхто не чекає — не лишаємо "never retrieved"
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    async def wait(self):
+        """Результат задачі; JobCancelled або TimeoutError, якщо її перервано.
+
+        Скасування того, хто чекає, не скасовує саму задачу.
+        """
+        return await asyncio.shield(self.future)
+
+    def describe(self) -> str:
+        now = time.monotonic()
+        if self.started is None:
+            return f"у черзі {format_duration(now - self.created)}"
+        return f"виконується {format_duration(now - self.started)}"
+
+
+class JobManager:
+    """Фонові задачі з обмеженням кількості одночасних на вид, чергою,
+    об'єднанням однакових запитів, тайм-аутами та скасуванням.
+
+    Вид "pkg" (усе, що запускає пакетний менеджер) виконується по одному,
+    тож перевірка, фонове завантаження та оновлення не змагаються за lock.
+    Задача з тим самим key, що вже в черзі чи виконується, не створюється
+    вдруге — запит приєднується до наявної. Задачі preemptible (фонова
+    робота) скасовуються, коли за ними в черзі з'являється звичайна.
+    """
+
+    def __init__(self, limits: dict[str, int]):
+        self.limits = limits
+        self.jobs: dict[int, Job] = {}
+        self.by_key: dict = {}
+        self.running: dict[str, list[Job]] = {}
+        self.queues: dict[str, deque[Job]] = {}
+        self.finished = Counter("lmb_jobs_total", "Задачі за результатом")
+        self.duration = Histogram("lmb_job_duration_seconds", "Тривалість виконання задач")
+        self._ids = itertools.count(1)
+
+    def submit(
+        self,
+        kind: str,
+        title: str,
+        factory,
+        key=None,
+        timeout: float | None = None,
+        preemptible: bool = False,
+        on_cancel=None,
+    ) -> tuple[Job, bool]:
+        """Ставить factory() у чергу виду kind -> (задача, чи створена нова)"""
+        if key is not None and key in self.by_key:
+            self.finished.inc(kind=kind, result="coalesced")
+            return self.by_key[key], False
+        job = Job(next(self._ids), kind, title, factory, key, timeout, preemptible, on_cancel)
+        self.jobs[job.id] = job
+        if key is not None:
+            self.by_key[key] = job
+        running = self.running.setdefault(kind, [])
+        queue = self.queues.setdefault(kind, deque())
+        if len(running) < self.limits.get(kind, 1) and not queue:
+            self._start(job)
+            return job, True
+        if preemptible:
+            queue.append(job)
+        else:
+            # Запит користувача стає перед фоновою роботою і витісняє її
+            index = next((i for i, other in enumerate(queue) if other.preemptible), len(queue))
+            queue.insert(index, job)
+            for other in list(running):
+                if other.preemptible:
+                    self.cancel(other.id)
+        return job, True
+
+    def _start(self, job: Job):
+        job.started = time.monotonic()
+        self.running[job.kind].append(job)
+        job.task = spawn(self._run(job))
+
+    async def _run(self, job: Job):
+        result = "ok"
+        try:
+            coro = job.factory()
+            value = await (asyncio.wait_for(coro, job.timeout) if job.timeout else coro)
+        except asyncio.CancelledError:
+            result = "cancelled"
+            job.future.set_exception(JobCancelled(job.title))
+        except asyncio.TimeoutError as e:
+            # TimeoutError зсередини задачі (напр. мережевий запит) — звичайна
+            # помилка; тайм-аут задачі — лише якщо спрацював wait_for
+            if job.timeout and time.monotonic() - job.started >= job.timeout:
+                result = "timeout"
+                logging.warning(f"⏱ Задача «{job.title}» перервана за тайм-аутом ({job.timeout:g}с)")
+                job.future.set_exception(TimeoutError(f"тайм-аут {job.timeout:g}с"))
+            else:
+                result = self._failed(job, e)
+        except Exception as e:
+            result = self._failed(job, e)
+        else:
+            job.future.set_result(value)
+        finally:
+            self.finished.inc(kind=job.kind, result=result)
+            self.duration.observe(time.monotonic() - job.started, kind=job.kind)
+            self.running[job.kind].remove(job)
+            self._forget(job)
+            queue = self.queues[job.kind]
+            while queue and len(self.running[job.kind]) < self.limits.get(job.kind, 1):
+                self._start(queue.popleft())
+
+    def _failed(self, job: Job, error: Exception) -> str:
+        logging.error(f"Задача «{job.title}» завершилась з помилкою: {error!r}")
+        job.future.set_exception(error)
+        return "error"
+
+    def _forget(self, job: Job):
+        self.jobs.pop(job.id, None)
+        if job.key is not None and self.by_key.get(job.key) is job:
+            del self.by_key[job.key]
+
+    def cancel(self, job_id: int) -> Job | None:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job.cancelled = True
+        if job.started is None:
+            self.queues[job.kind].remove(job)
+            self._forget(job)
+            self.finished.inc(kind=job.kind, result="cancelled")
+            job.future.set_exception(JobCancelled(job.title))
+        elif job.on_cancel is not None:
+            # Задача сама завершує свій процес (напр. група процесів оновлення)
+            job.on_cancel()
+        else:
+            job.task.cancel()
+        return job
+
+    def position(self, job: Job) -> int:
+        """Позиція в черзі (з 1), 0 — якщо задача вже виконується"""
+        queue = self.queues.get(job.kind, ())
+        return queue.index(job) + 1 if job in queue else 0
+
+    def render(self) -> str:
+        if not self.jobs:
+            return "⚙️ Задач немає."
+        lines = ["⚙️ <b>Задачі:</b>"]
+        for kind, running in self.running.items():
+            for job in running:
+                lines.append(f"▶️ #{job.id} {html.escape(job.title)} [{kind}] — {job.describe()}")
+        for kind, queue in self.queues.items():
+            for position, job in enumerate(queue, 1):
+                lines.append(
+                    f"🕒 #{job.id} {html.escape(job.title)} [{kind}] — "
+                    f"{job.describe()}, позиція {position}"
+                )
+        return "\n".join(lines)
+
+    def stats(self) -> str:
+        running = sum(len(jobs) for jobs in self.running.values())
+        queued = sum(len(queue) for queue in self.queues.values())
+        return f"виконується {running}, у черзі {queued}"
+
+
+JOBS = JobManager(JOB_LIMITS)
+
+
+def collect_job_metrics() -> list[str]:
+    lines = metric_lines(
+        "lmb_jobs_running", "Задачі, що виконуються",
+        [({"kind": kind}, len(jobs)) for kind, jobs in JOBS.running.items()],
+    )
+    lines += metric_lines(
+        "lmb_jobs_queued", "Задачі в черзі",
+        [({"kind": kind}, len(queue)) for kind, queue in JOBS.queues.items()],
+    )
+    return lines
+
+
+METRICS_COLLECTORS.extend([JOBS.finished, JOBS.duration, collect_job_metrics])
 
 
 # --- СИСТЕМНІ ФУНКЦІЇ (HELPER) ---
@@ -72,53 +748,1178 @@ def get_distro_pretty_name() -> str:
 # --- ФУНКЦІЇ МОНІТОРИНГУ ТА МЕРЕЖІ ---
 
 
-def get_system_dashboard() -> str:
-    """Збирає статистику: CPU, RAM, Disk, Uptime, Temp"""
-    # CPU
-    cpu_percent = psutil.cpu_percent(interval=1)
+# Сенсори температури CPU у порядку пріоритету
+TEMP_SENSORS = ["coretemp", "cpu_thermal", "k10temp", "acpitz", "soc_thermal"]
 
-    # RAM
-    mem = psutil.virtual_memory()
-    total_mem = round(mem.total / (1024**3), 2)
-    used_mem = round(mem.used / (1024**3), 2)
-    free_mem = round(mem.available / (1024**3), 2)
+# Вікна статистики на дашборді: (підпис, секунди)
+METRICS_WINDOWS = [("1 хв", 60), ("5 хв", 300), ("15 хв", 900)]
 
-    # DISK
-    disk = psutil.disk_usage("/")
-    total_disk = round(disk.total / (1024**3), 2)
-    used_disk = round(disk.used / (1024**3), 2)
-    disk_percent = disk.percent
 
-    # UPTIME
-    boot_time = datetime.datetime.fromtimestamp(psutil.boot_time())
-    now = datetime.datetime.now()
-    uptime = str(now - boot_time).split(".")[0]
+class MetricsSample(NamedTuple):
+    ts: float
+    cpu_percent: float
+    mem_total: int
+    mem_used: int
+    mem_available: int
+    mem_percent: float
+    disk_total: int
+    disk_used: int
+    disk_percent: float
+    temp: float | None
+    uptime: float
 
-    # TEMP
-    temp_str = "N/A"
+
+# Кільцевий буфер останніх замірів (наповнює metrics_sampler)
+METRICS_HISTORY: deque[MetricsSample] = deque(maxlen=METRICS_BUFFER_SIZE)
+
+
+def read_cpu_temperature() -> float | None:
+    """Температура CPU з першого знайденого сенсора"""
     try:
         temps = psutil.sensors_temperatures()
-        for name in ["coretemp", "cpu_thermal", "k10temp", "acpitz", "soc_thermal"]:
+        for name in TEMP_SENSORS:
             if name in temps:
-                temp_str = f"{temps[name][0].current}°C"
-                break
+                return temps[name][0].current
     except Exception:
         pass
+    return None
+
+
+def collect_metrics_sample(cpu_interval: float | None = None) -> MetricsSample:
+    """Робить один замір CPU, RAM, Disk, Temp, Uptime.
+
+    З cpu_interval=None завантаженість рахується від попереднього виклику
+    і функція не блокується.
+    """
+    cpu_percent = psutil.cpu_percent(interval=cpu_interval)
+    mem = psutil.virtual_memory()
+    disk = psutil.disk_usage("/")
+    now = time.time()
+    return MetricsSample(
+        ts=now,
+        cpu_percent=cpu_percent,
+        mem_total=mem.total,
+        mem_used=mem.used,
+        mem_available=mem.available,
+        mem_percent=mem.percent,
+        disk_total=disk.total,
+        disk_used=disk.used,
+        disk_percent=disk.percent,
+        temp=read_cpu_temperature(),
+        uptime=now - psutil.boot_time(),
+    )
+
+
+async def metrics_sampler():
+    """Фоново збирає метрики у METRICS_HISTORY"""
+    logging.info(
+        f"📈 Збір метрик: кожні {METRICS_SAMPLE_INTERVAL}с, буфер {METRICS_BUFFER_SIZE}"
+    )
+    # Перший виклик cpu_percent(None) лише задає точку відліку
+    psutil.cpu_percent(interval=None)
+    while True:
+        await asyncio.sleep(METRICS_SAMPLE_INTERVAL)
+        try:
+            sample = await run_in_thread(collect_metrics_sample)
+            METRICS_HISTORY.append(sample)
+            METRICS_DB.update(sample)
+            if ALERT_ENGINE.rules:
+                mounts = await run_in_thread(read_mount_usage, ALERT_DISK_MOUNTS)
+                ALERT_ENGINE.evaluate(sample, mounts)
+        except Exception as e:
+            logging.error(f"Помилка збору метрик: {e}")
+
+
+# --- ТОП ПРОЦЕСІВ ---
+class ProcessRow(NamedTuple):
+    pid: int
+    started: float  # create_time: разом з PID однозначно визначає процес
+    name: str
+    cpu_percent: float
+    rss: int
+    io_rate: float | None  # байт/с читання + запису; None — немає доступу
+
+
+PROCESS_SORT_KEYS = {
+    "cpu": lambda row: row.cpu_percent,
+    "mem": lambda row: row.rss,
+    "io": lambda row: -1 if row.io_rate is None else row.io_rate,
+}
+
+
+@functools.lru_cache(maxsize=256)
+def uid_name(uid: int) -> str:
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+class ProcessSampler:
+    """CPU% та IO процесів як різниця двох вибірок.
+
+    Для кожного PID зберігається (create_time, час CPU, байти IO, ім'я) з
+    попередньої вибірки, тож одна вибірка — це один прохід process_iter
+    з oneshot(), без очікування інтервалу на кожен процес. Ім'я вже
+    відомого процесу не читається повторно (для довгих імен psutil
+    читає ще й cmdline), власник — лише в подробицях. Процес, що
+    з'явився між вибірками (або отримав перевикористаний PID), рахується
+    від свого старту. Вибірки йдуть лише, поки список хтось переглядає.
+    """
+
+    IDLE_STOP = 300
+    WARMUP = 1.0
+
+    def __init__(self, interval: float = PROCESS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.table: dict[int, tuple[float, float, int | None, str]] = {}
+        self.rows: list[ProcessRow] = []
+        self.sampled_at = 0.0
+        self.duration = 0.0
+        self.last_used = 0.0
+        self.task: asyncio.Task | None = None
+        self.ready = asyncio.Event()
+
+    def sample(self):
+        now = time.time()
+        previous, table, rows = self.table, {}, []
+        for proc in psutil.process_iter():
+            try:
+                with proc.oneshot():
+                    started = proc.create_time()
+                    cpu = proc.cpu_times()
+                    rss = proc.memory_info().rss
+                    prev = previous.get(proc.pid)
+                    if prev and prev[0] == started:
+                        name = prev[3]
+                    else:
+                        prev, name = None, proc.name()
+                    try:
+                        io = proc.io_counters()
+                        io_bytes = io.read_bytes + io.write_bytes
+                    except psutil.AccessDenied:
+                        io_bytes = None
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            cpu_total = cpu.user + cpu.system
+            table[proc.pid] = (started, cpu_total, io_bytes, name)
+            if prev:
+                window = now - self.sampled_at
+                cpu_delta = cpu_total - prev[1]
+                io_delta = None if io_bytes is None or prev[2] is None else io_bytes - prev[2]
+            else:
+                window = now - max(started, self.sampled_at)
+                cpu_delta, io_delta = cpu_total, io_bytes
+            window = max(window, 0.01)
+            rows.append(ProcessRow(
+                proc.pid, started, name, cpu_delta / window * 100, rss,
+                None if io_delta is None else io_delta / window,
+            ))
+        self.table, self.rows, self.sampled_at = table, rows, now
+        self.duration = time.time() - now
+
+    async def run(self):
+        logging.info(f"🔝 Вибірки процесів: кожні {self.interval:g}с")
+        try:
+            # Перша вибірка лише задає точку відліку
+            await run_in_thread(self.sample)
+            delay = self.WARMUP
+            while time.monotonic() - self.last_used < self.IDLE_STOP:
+                await asyncio.sleep(delay)
+                delay = self.interval
+                try:
+                    await run_in_thread(self.sample)
+                except Exception as e:
+                    logging.error(f"Помилка вибірки процесів: {e}")
+                self.ready.set()
+        finally:
+            self.task = None
+            self.table, self.rows = {}, []
+            self.ready.set()
+
+    async def top(self, sort: str, count: int = PROCESS_TOP_N) -> list[ProcessRow]:
+        """Топ процесів з останньої вибірки; за потреби запускає вибірки"""
+        self.last_used = time.monotonic()
+        if self.task is None:
+            self.ready.clear()
+            self.task = spawn(self.run())
+        await self.ready.wait()
+        return heapq.nlargest(count, self.rows, key=PROCESS_SORT_KEYS[sort])
+
+    def find(self, pid: int) -> ProcessRow | None:
+        return next((row for row in self.rows if row.pid == pid), None)
+
+    def stats(self) -> str:
+        if self.task is None:
+            return "не працює"
+        return f"процесів {len(self.rows)}, вибірка {self.duration * 1000:.0f} мс"
+
+
+PROCESS_SAMPLER = ProcessSampler()
+
+
+def render_top_processes(rows: list[ProcessRow], sort: str) -> str:
+    titles = {"cpu": "CPU", "mem": "пам'яттю", "io": "диском"}
+    lines = [f"{'PID':>7} {'CPU%':>6} {'RSS':>8} {'IO/с':>8}  КОМАНДА"]
+    for row in rows:
+        io = "—" if row.io_rate is None else format_bytes(row.io_rate)
+        lines.append(
+            f"{row.pid:>7} {row.cpu_percent:6.1f} {format_bytes(row.rss):>8} "
+            f"{io:>8}  {row.name[:20]}"
+        )
+    return (
+        f"🔝 <b>Топ процесів за {titles[sort]}</b>\n"
+        f"Усього процесів: {len(PROCESS_SAMPLER.rows)}, "
+        f"інтервал {PROCESS_SAMPLER.interval:g}с\n"
+        f"<pre>{html.escape(chr(10).join(lines))}</pre>"
+    )
+
+
+def describe_process(pid: int, started: int) -> str | None:
+    """Подробиці процесу або None, якщо його вже немає (чи PID зайняв інший)"""
+    try:
+        proc = psutil.Process(pid)
+        with proc.oneshot():
+            if int(proc.create_time()) != started:
+                return None
+            name = proc.name()
+            user = uid_name(proc.uids().real)
+            status = proc.status()
+            nice = proc.nice()
+            threads = proc.num_threads()
+            rss = proc.memory_info().rss
+            create_time = proc.create_time()
+        try:
+            cmdline = " ".join(proc.cmdline()) or f"[{name}]"
+        except psutil.AccessDenied:
+            cmdline = f"[{name}]"
+    except psutil.NoSuchProcess:
+        return None
+    row = PROCESS_SAMPLER.find(pid)
+    cpu = f"{row.cpu_percent:.1f}%" if row else "—"
+    if len(cmdline) > 500:
+        cmdline = cmdline[:500] + "…"
+    return (
+        f"⚙️ <b>{html.escape(name)}</b> (PID {pid})\n"
+        f"👤 {html.escape(user)}, стан {status}, nice {nice}, потоків {threads}\n"
+        f"🔥 CPU {cpu}, 🧠 RSS {format_bytes(rss)}\n"
+        f"🕒 Запущено {datetime.datetime.fromtimestamp(create_time):%d.%m %H:%M:%S}\n"
+        f"<code>{html.escape(cmdline)}</code>"
+    )
+
+
+# --- АНАЛІЗ ДИСКА ---
+# Записи кешу, молодші за цей час, не зберігаються: зміна в тому самому
+# "тіку" годинника файлової системи не змінила б mtime
+DISK_SCAN_RACY_NS = 2_000_000_000
+DISK_SCAN_PROGRESS_INTERVAL = 3
+
+
+class DirRecord(NamedTuple):
+    """Власний вміст каталогу (без підкаталогів) на момент mtime_ns"""
+
+    mtime_ns: int
+    size: int  # зайняте місце (st_blocks) файлів з одним жорстким посиланням
+    files: int
+    largest: list[tuple[int, str, int]]  # (розмір, ім'я, inode або 0)
+    hardlinks: list[tuple[int, int]]  # (inode, розмір) файлів з st_nlink > 1
+    subdirs: list[str]
+
+
+class DiskUsageCache:
+    """LRU-кеш DirRecord за шляхом каталогу.
+
+    Запис дійсний, поки не змінився mtime каталогу: його змінює створення,
+    видалення чи перейменування файлу всередині, але не дописування в
+    наявний файл. Тому розмір файлів, що ростуть на місці (логи, бази),
+    оновлює лише сканування без кешу.
+    """
+
+    def __init__(self, max_dirs: int = DISK_SCAN_CACHE_SIZE):
+        self.max_dirs = max_dirs
+        self.records: OrderedDict[str, DirRecord] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str, mtime_ns: int) -> DirRecord | None:
+        with self.lock:
+            record = self.records.get(path)
+            if record is None or record.mtime_ns != mtime_ns:
+                self.misses += 1
+                return None
+            self.records.move_to_end(path)
+            self.hits += 1
+            return record
+
+    def put(self, path: str, record: DirRecord):
+        with self.lock:
+            self.records[path] = record
+            self.records.move_to_end(path)
+            while len(self.records) > self.max_dirs:
+                self.records.popitem(last=False)
+
+    def stats(self) -> str:
+        return f"каталогів {len(self.records)}, влучань {self.hits}, промахів {self.misses}"
+
+
+DISK_USAGE_CACHE = DiskUsageCache()
+
+
+class DiskUsageReport(NamedTuple):
+    root: str
+    total: int
+    dirs: int
+    files: int
+    cached: int
+    errors: int
+    children: list[tuple[int, str]]  # найбільші підкаталоги першого рівня
+    heaviest: list[tuple[int, str]]  # каталоги з найбільшим власним вмістом
+    largest: list[tuple[int, str]]  # найбільші файли
+    other_mounts: list[str]
+    elapsed: float
+    stop_reason: str
+
+
+class DiskUsageScanner:
+    """Паралельний `du` одного розділу.
+
+    Кожен каталог читається os.scandir в окремій задачі пулу потоків, а
+    координатор (у своєму потоці) розсилає знайдені підкаталоги та підсумовує
+    результати, тож пам'ять — це лише черга необроблених каталогів, а не
+    дерево. Каталоги з іншим st_dev (точки монтування) пропускаються,
+    файли з кількома жорсткими посиланнями рахуються один раз за inode.
+    Незмінений каталог (той самий mtime) береться з DISK_USAGE_CACHE без
+    читання вмісту: перевіряються лише mtime його підкаталогів.
+    """
+
+    def __init__(
+        self, root: str, use_cache: bool = True, threads: int = DISK_SCAN_THREADS,
+        top: int = DISK_SCAN_TOP_N, timeout: float = DISK_SCAN_TIMEOUT,
+    ):
+        self.root = root
+        self.use_cache = use_cache
+        self.threads = threads
+        self.top = top
+        self.timeout = timeout
+        self.dirs = 0
+        self.files = 0
+        self.size = 0
+        self.cached = 0
+        self.errors = 0
+        self.current = root
+        self.started = time.monotonic()
+        self.stop_reason = ""
+
+    def cancel(self):
+        self.stop_reason = "скасовано"
+
+    def _read_dir(self, path: str, mtime_ns: int) -> tuple[DirRecord, list]:
+        size = files = 0
+        largest, hardlinks, subdirs, substats = [], [], [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    subdirs.append(entry.name)
+                    substats.append((entry.path, st))
+                    continue
+                used = st.st_blocks * 512
+                files += 1
+                inode = 0
+                if st.st_nlink > 1:
+                    inode = st.st_ino
+                    hardlinks.append((inode, used))
+                else:
+                    size += used
+                if len(largest) < self.top:
+                    heapq.heappush(largest, (used, entry.name, inode))
+                elif used > largest[0][0]:
+                    heapq.heapreplace(largest, (used, entry.name, inode))
+        return DirRecord(mtime_ns, size, files, largest, hardlinks, subdirs), substats
+
+    def _visit(self, path: str, mtime_ns: int) -> tuple[DirRecord, list, bool]:
+        """Виконується в пулі: вміст каталогу та stat його підкаталогів"""
+        record = DISK_USAGE_CACHE.get(path, mtime_ns) if self.use_cache else None
+        if record is not None:
+            substats = []
+            for name in record.subdirs:
+                subpath = os.path.join(path, name)
+                try:
+                    substats.append((subpath, os.stat(subpath, follow_symlinks=False)))
+                except OSError:
+                    continue
+            return record, substats, True
+        record, substats = self._read_dir(path, mtime_ns)
+        if time.time_ns() - mtime_ns > DISK_SCAN_RACY_NS:
+            DISK_USAGE_CACHE.put(path, record)
+        return record, substats, False
+
+    def run(self) -> DiskUsageReport:
+        """Сканує root (викликати в потоці). OSError, якщо root недоступний."""
+        root_stat = os.stat(self.root)
+        dev = root_stat.st_dev
+        deadline = self.started + self.timeout
+        children: dict[str, int] = {}
+        heaviest, largest = [], []
+        seen_inodes, largest_inodes = set(), set()
+        other_mounts = []
+
+        def push(heap: list, item: tuple):
+            if len(heap) < self.top:
+                heapq.heappush(heap, item)
+            elif item[0] > heap[0][0]:
+                heapq.heapreplace(heap, item)
+
+        # Готові задачі приходять через чергу: concurrent.futures.wait()
+        # перебирав би всі тисячі незавершених на кожному кроці
+        results = queue.SimpleQueue()
+
+        def submit(path: str, mtime_ns: int, top: str | None, size: int):
+            future = pool.submit(self._visit, path, mtime_ns)
+            future.add_done_callback(lambda f: results.put((f, path, top, size)))
+
+        with concurrent.futures.ThreadPoolExecutor(self.threads, thread_name_prefix="du") as pool:
+            # top — підкаталог першого рівня, size — місце під сам каталог
+            submit(self.root, root_stat.st_mtime_ns, None, root_stat.st_blocks * 512)
+            pending = 1
+            while pending:
+                try:
+                    future, path, top, size = results.get(timeout=1)
+                except queue.Empty:
+                    future = None
+                if not self.stop_reason and time.monotonic() > deadline:
+                    self.stop_reason = "тайм-аут"
+                if self.stop_reason:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                if future is None:
+                    continue
+                pending -= 1
+                try:
+                    record, substats, hit = future.result()
+                except (OSError, concurrent.futures.CancelledError):
+                    self.errors += not future.cancelled()
+                    continue
+                self.dirs += 1
+                self.cached += hit
+                self.files += record.files
+                self.current = path
+                size += record.size
+                for inode, used in record.hardlinks:
+                    if inode not in seen_inodes:
+                        seen_inodes.add(inode)
+                        size += used
+                for used, name, inode in record.largest:
+                    if len(largest) == self.top and used <= largest[0][0]:
+                        continue
+                    if inode:
+                        if inode in largest_inodes:
+                            continue
+                        largest_inodes.add(inode)
+                    push(largest, (used, os.path.join(path, name)))
+                push(heaviest, (size, path))
+                self.size += size
+                if top is not None:
+                    children[top] += size
+                if self.stop_reason:
+                    continue
+                for subpath, st in substats:
+                    if not stat.S_ISDIR(st.st_mode):
+                        continue
+                    if st.st_dev != dev:
+                        other_mounts.append(subpath)
+                        continue
+                    subtop = top or subpath
+                    children.setdefault(subtop, 0)
+                    submit(subpath, st.st_mtime_ns, subtop, st.st_blocks * 512)
+                    pending += 1
+
+        return DiskUsageReport(
+            root=self.root,
+            total=self.size,
+            dirs=self.dirs,
+            files=self.files,
+            cached=self.cached,
+            errors=self.errors,
+            children=heapq.nlargest(self.top, ((size, path) for path, size in children.items())),
+            heaviest=sorted(heaviest, reverse=True),
+            largest=sorted(largest, reverse=True),
+            other_mounts=other_mounts,
+            elapsed=time.monotonic() - self.started,
+            stop_reason=self.stop_reason,
+        )
+
+    def render_progress(self) -> str:
+        return (
+            f"⏳ <b>Аналіз диска:</b> <code>{html.escape(self.root)}</code>\n"
+            f"📁 Каталогів: {self.dirs} (з кешу {self.cached}), файлів: {self.files}\n"
+            f"💾 Знайдено: {format_bytes(self.size)}, "
+            f"⏱ {format_duration(time.monotonic() - self.started)}\n"
+            f"<code>{html.escape(self.current[-80:])}</code>"
+        )
+
+
+def render_disk_usage(report: DiskUsageReport) -> str:
+    def entry(size: int, path: str) -> str:
+        path = os.path.relpath(path, report.root)
+        if len(path) > 60:
+            path = "…" + path[-59:]
+        return f"<b>{format_bytes(size)}</b>  <code>{html.escape(path)}</code>"
+
+    lines = [
+        f"💽 <b>Аналіз диска:</b> <code>{html.escape(report.root)}</code>",
+        f"💾 Зайнято: <b>{format_bytes(report.total)}</b> — каталогів {report.dirs}, "
+        f"файлів {report.files}",
+        f"⏱ {format_duration(report.elapsed)}, з кешу {report.cached} каталогів"
+        + (f", без доступу {report.errors}" if report.errors else ""),
+    ]
+    if report.stop_reason:
+        lines.append(f"⚠️ Зупинено ({report.stop_reason}) — результати неповні")
+    if report.children:
+        lines.append("\n📁 <b>Найбільші підкаталоги:</b>")
+        lines += [entry(size, path) for size, path in report.children]
+    if report.heaviest:
+        lines.append("\n📂 <b>Де лежать файли</b> (без підкаталогів):")
+        lines += [entry(size, path) for size, path in report.heaviest]
+    if report.largest:
+        lines.append("\n📄 <b>Найбільші файли:</b>")
+        lines += [entry(size, path) for size, path in report.largest]
+    if report.other_mounts:
+        mounts = ", ".join(html.escape(path) for path in report.other_mounts[:5])
+        more = len(report.other_mounts) - 5
+        lines.append(f"\n🔀 Інші розділи не враховано: {mounts}" + (f" та ще {more}" if more > 0 else ""))
+    return "\n".join(lines)
+
+
+DISK_REPORTS: OrderedDict[int, DiskUsageReport] = OrderedDict()
+DISK_REPORTS_LIMIT = 32
+_disk_report_ids = itertools.count(1)
+
+
+def register_disk_report(report: DiskUsageReport) -> int:
+    report_id = next(_disk_report_ids)
+    DISK_REPORTS[report_id] = report
+    while len(DISK_REPORTS) > DISK_REPORTS_LIMIT:
+        DISK_REPORTS.popitem(last=False)
+    return report_id
+
+
+# --- ІСТОРІЯ МЕТРИК (RRD) ---
+# Файл: заголовок, описи архівів (крок, рядків), далі рядки архівів. Рядок —
+# номер слота (ts // крок) та для кожної серії avg/min/max/кількість замірів.
+# Рядок, чий номер слота не збігається з очікуваним, вважається порожнім,
+# тож пропуски (бот не працював) не треба затирати.
+RRD_MAGIC = b"LMBRRD01"
+RRD_HEADER = struct.Struct("<8sII")
+RRD_ARCHIVE = struct.Struct("<II")
+RRD_SERIES = ("cpu_percent", "mem_percent", "disk_percent", "temp")
+NAN = float("nan")
+
+
+class RoundRobinArchive:
+    """Кільце з rows рядків по step секунд у спільному mmap"""
+
+    def __init__(self, mm: mmap.mmap, offset: int, step: int, rows: int, series: int):
+        self.mm = mm
+        self.offset = offset
+        self.step = step
+        self.rows = rows
+        self.series = series
+        self.row = struct.Struct(f"<q{4 * series}f")
+        self.size = rows * self.row.size
+        # Поточний (незавершений) слот та його avg/min/max/n по серіях
+        self.slot: int | None = None
+        self.acc: list[list[float]] = []
+
+    def _read(self, slot: int) -> tuple | None:
+        values = self.row.unpack_from(self.mm, self.offset + (slot % self.rows) * self.row.size)
+        return values[1:] if values[0] == slot else None
+
+    def update(self, ts: float, values: list[float | None]):
+        """Консолідує замір у рядок поточного слота: O(1), один запис у mmap"""
+        slot = int(ts // self.step)
+        if slot != self.slot:
+            self.slot = slot
+            # Після перезапуску продовжуємо рядок, записаний раніше
+            stored = self._read(slot)
+            self.acc = (
+                [list(stored[i * 4:i * 4 + 4]) for i in range(self.series)]
+                if stored
+                else [[NAN, NAN, NAN, 0.0] for _ in range(self.series)]
+            )
+        flat = []
+        for acc, value in zip(self.acc, values):
+            if value is not None:
+                n = acc[3] + 1
+                if n == 1:
+                    acc[:] = [value, value, value, 1.0]
+                else:
+                    acc[0] += (value - acc[0]) / n
+                    acc[1] = min(acc[1], value)
+                    acc[2] = max(acc[2], value)
+                    acc[3] = n
+            flat += acc
+        self.row.pack_into(self.mm, self.offset + (slot % self.rows) * self.row.size, slot, *flat)
+
+    def read(self, start: float, end: float):
+        """Рядки за [start, end] -> (ts, [(avg, min, max) | None, ...]); читає лише їх"""
+        first = max(int(start // self.step), int(end // self.step) - self.rows + 1)
+        for slot in range(first, int(end // self.step) + 1):
+            stored = self._read(slot)
+            if stored is None:
+                continue
+            yield slot * self.step, [
+                stored[i * 4:i * 4 + 3] if stored[i * 4 + 3] else None
+                for i in range(self.series)
+            ]
+
+
+class RoundRobinDatabase:
+    """Історія метрик у файлі фіксованого розміру з кількома роздільностями.
+
+    Кожен замір потрапляє в усі архіви одразу (avg/min/max за крок
+    архіву), тож консолідація не потребує окремого проходу, а розмір файла
+    не росте. Файл відображений у пам'ять (mmap): запис — кілька байтів у
+    page cache, читання графіка торкається лише потрібних рядків.
+    """
+
+    def __init__(self, path: str = METRICS_DB_FILE, archives=METRICS_DB_ARCHIVES, series=RRD_SERIES):
+        self.path = path
+        self.layout = archives
+        self.series = series
+        self.archives: list[RoundRobinArchive] = []
+        self.mm: mmap.mmap | None = None
+        self.updates = 0
+
+    def _header(self) -> bytes:
+        return RRD_HEADER.pack(RRD_MAGIC, len(self.series), len(self.layout)) + b"".join(
+            RRD_ARCHIVE.pack(step, rows) for step, rows in self.layout
+        )
+
+    def open(self):
+        header = self._header()
+        row_size = struct.calcsize(f"<q{4 * len(self.series)}f")
+        size = len(header) + sum(rows * row_size for _, rows in self.layout)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            existing = os.pread(fd, len(header), 0)
+            if existing != header or os.fstat(fd).st_size != size:
+                if existing:
+                    logging.warning(f"⚠️ Формат {self.path} змінився, історію метрик скинуто")
+                os.ftruncate(fd, 0)
+                # Розріджений файл: нулі не займають місця, поки не записані
+                os.ftruncate(fd, size)
+                os.pwrite(fd, header, 0)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        offset = len(header)
+        for step, rows in self.layout:
+            archive = RoundRobinArchive(self.mm, offset, step, rows, len(self.series))
+            self.archives.append(archive)
+            offset += archive.size
+
+    def update(self, sample: MetricsSample):
+        if self.mm is None:
+            return
+        values = [getattr(sample, name) for name in self.series]
+        for archive in self.archives:
+            archive.update(sample.ts, values)
+        self.updates += 1
+
+    def archive_for(self, seconds: float) -> RoundRobinArchive:
+        """Найдетальніший архів, що покриває seconds (інакше — найдовший)"""
+        for archive in sorted(self.archives, key=lambda a: a.step):
+            if archive.step * archive.rows >= seconds:
+                return archive
+        return max(self.archives, key=lambda a: a.step * a.rows)
+
+    def query(self, seconds: float, points: int, end: float | None = None):
+        """Історія за seconds секунд, стиснута до points точок.
+
+        -> (крок архіву, [(ts, [(avg, min, max) | None по серіях])]).
+        Рядки читаються потоком і зводяться в точки одразу, тож у пам'яті
+        ніколи не більше points точок.
+        """
+        end = end or time.time()
+        start = end - seconds
+        archive = self.archive_for(seconds)
+        width = max(seconds / points, archive.step)
+        result = []
+        bucket = None
+        for ts, values in archive.read(start, end):
+            index = int((ts - start) // width)
+            if bucket is None or bucket[0] != index:
+                bucket = [index, start + index * width, [None] * len(self.series)]
+                result.append(bucket)
+            merged = bucket[2]
+            for i, value in enumerate(values):
+                if value is None:
+                    continue
+                if merged[i] is None:
+                    # [сума avg, min, max, кількість рядків]
+                    merged[i] = [value[0], value[1], value[2], 1]
+                else:
+                    m = merged[i]
+                    m[0] += value[0]
+                    m[1] = min(m[1], value[1])
+                    m[2] = max(m[2], value[2])
+                    m[3] += 1
+        points_out = [
+            (ts, [(m[0] / m[3], m[1], m[2]) if m else None for m in merged])
+            for _, ts, merged in result
+        ]
+        return archive.step, points_out
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.flush()
+            self.mm.close()
+            self.mm = None
+
+    def stats(self) -> str:
+        if self.mm is None:
+            return "вимкнено"
+        layout = ", ".join(f"{format_step(s)}×{r}" for s, r in self.layout)
+        return f"{self.path} ({format_bytes(len(self.mm))}; {layout}), записів {self.updates}"
+
+
+METRICS_DB = RoundRobinDatabase()
+
+
+def format_step(seconds: int) -> str:
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600} год"
+    if seconds % 60 == 0:
+        return f"{seconds // 60} хв"
+    return f"{seconds}с"
+
+
+# --- ГРАФІКИ (PNG) ---
+# Растровий шрифт 3x5: рядки гліфа зверху вниз, біти зліва направо
+CHART_FONT = {
+    "0": (7, 5, 5, 5, 7), "1": (2, 6, 2, 2, 7), "2": (7, 1, 7, 4, 7),
+    "3": (7, 1, 7, 1, 7), "4": (5, 5, 7, 1, 1), "5": (7, 4, 7, 1, 7),
+    "6": (7, 4, 7, 5, 7), "7": (7, 1, 1, 1, 1), "8": (7, 5, 7, 5, 7),
+    "9": (7, 5, 7, 1, 7), "%": (5, 1, 2, 4, 5), ".": (0, 0, 0, 0, 2),
+    ":": (0, 2, 0, 2, 0), "-": (0, 0, 7, 0, 0), "°": (2, 5, 2, 0, 0),
+    " ": (0, 0, 0, 0, 0), "A": (2, 5, 7, 5, 5), "C": (7, 4, 4, 4, 7),
+    "D": (6, 5, 5, 5, 6), "E": (7, 4, 6, 4, 7), "I": (7, 2, 2, 2, 7),
+    "K": (5, 5, 6, 5, 5), "M": (5, 7, 7, 5, 5), "P": (6, 5, 6, 4, 4),
+    "R": (6, 5, 6, 5, 5), "S": (3, 4, 2, 1, 6), "T": (7, 2, 2, 2, 2),
+    "U": (5, 5, 5, 5, 7),
+}
+# Панелі графіка: (серія з RRD_SERIES, підпис, колір, фіксований діапазон осі Y)
+CHART_PANELS = [
+    ("cpu_percent", "CPU %", (31, 119, 180), (0, 100)),
+    ("mem_percent", "RAM %", (44, 160, 44), (0, 100)),
+    ("disk_percent", "DISK %", (148, 103, 189), (0, 100)),
+    ("temp", "TEMP °C", (214, 39, 40), None),
+]
+# Скільки точок (по ширині) малювати: довгі діапазони зводяться до них
+CHART_POINTS = 720
+CHART_RANGES = {"1h": 3600, "6h": 6 * 3600, "1d": 86400, "7d": 7 * 86400, "30d": 30 * 86400, "1y": 365 * 86400}
+# Кроки сітки по осі часу (сек)
+CHART_TIME_TICKS = [300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 86400, 2 * 86400, 7 * 86400, 30 * 86400]
+
+
+class Canvas:
+    """Мінімальне RGB-полотно з лініями, текстом та кодуванням у PNG"""
+
+    def __init__(self, width: int, height: int, background=(255, 255, 255)):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(bytes(background) * (width * height))
+
+    def point(self, x: int, y: int, color: bytes):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            i = (y * self.width + x) * 3
+            self.pixels[i:i + 3] = color
+
+    def hline(self, x0: int, x1: int, y: int, color: bytes):
+        x0, x1 = max(0, x0), min(self.width - 1, x1)
+        if 0 <= y < self.height and x0 <= x1:
+            i = (y * self.width + x0) * 3
+            self.pixels[i:i + (x1 - x0 + 1) * 3] = color * (x1 - x0 + 1)
+
+    def vline(self, x: int, y0: int, y1: int, color: bytes):
+        for y in range(min(y0, y1), max(y0, y1) + 1):
+            self.point(x, y, color)
+
+    def line(self, x0: int, y0: int, x1: int, y1: int, color: bytes):
+        """Брезенгем, товщина 2 пікселі"""
+        dx, dy = abs(x1 - x0), -abs(y1 - y0)
+        sx, sy = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+        err = dx + dy
+        while True:
+            self.point(x0, y0, color)
+            self.point(x0, y0 + 1, color)
+            if x0 == x1 and y0 == y1:
+                return
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x0 += sx
+            if e2 <= dx:
+                err += dx
+                y0 += sy
+
+    def text(self, x: int, y: int, text: str, color: bytes, scale: int = 2):
+        for char in text:
+            for row, bits in enumerate(CHART_FONT.get(char, CHART_FONT[" "])):
+                for col in range(3):
+                    if bits & (4 >> col):
+                        for dy in range(scale):
+                            self.hline(x + col * scale, x + col * scale + scale - 1, y + row * scale + dy, color)
+            x += 4 * scale
+
+    def png(self) -> bytes:
+        stride = self.width * 3
+        raw = b"".join(
+            b"\x00" + self.pixels[y * stride:(y + 1) * stride] for y in range(self.height)
+        )
+
+        def chunk(kind: bytes, data: bytes) -> bytes:
+            return (
+                struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+            )
+
+        return (
+            b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 6))
+            + chunk(b"IEND", b"")
+        )
+
+
+def format_chart_tick(ts: float, seconds: float) -> str:
+    fmt = "%H:%M" if seconds <= 2 * 86400 else "%d.%m"
+    return time.strftime(fmt, time.localtime(ts))
+
+
+def render_metrics_chart(points: list, start: float, end: float, step: int, width: int = 800) -> bytes:
+    """PNG з панелями CHART_PANELS: смуга min–max та лінія середнього"""
+    left, right, title_h, plot_h, axis_h = 56, 12, 20, 130, 18
+    panel_h = title_h + plot_h + axis_h
+    canvas = Canvas(width, panel_h * len(CHART_PANELS) + 8)
+    plot_w = width - left - right
+    grid, axis, label = bytes((225, 225, 225)), bytes((150, 150, 150)), bytes((60, 60, 60))
+    seconds = end - start
+    tick = next((t for t in CHART_TIME_TICKS if seconds / t <= 8), CHART_TIME_TICKS[-1])
+    # Сітка по місцевому часу (мітки на рівних годинах/днях)
+    utc_offset = time.localtime(end).tm_gmtoff
+    first_tick = ((start + utc_offset) // tick + 1) * tick - utc_offset
+
+    def x_of(ts: float) -> int:
+        return left + int((ts - start) / seconds * (plot_w - 1))
+
+    for index, (name, title, color, fixed) in enumerate(CHART_PANELS):
+        series = RRD_SERIES.index(name)
+        top = 8 + index * panel_h + title_h
+        bottom = top + plot_h - 1
+        values = [(ts, v[series]) for ts, v in points if v[series] is not None]
+        if fixed:
+            low, high = fixed
+        elif values:
+            # Діапазон кратний 20, щоб поділки сітки були цілими
+            low = math.floor(min(v[1] for _, v in values) / 10) * 10
+            high = low + max(1, math.ceil((max(v[2] for _, v in values) - low) / 20)) * 20
+        else:
+            low, high = 0, 100
+        canvas.text(left, top - title_h + 4, title, bytes(color))
+
+        def y_of(value: float) -> int:
+            return bottom - int((value - low) / (high - low) * (plot_h - 1))
+
+        for i in range(5):
+            value = low + (high - low) * i / 4
+            y = y_of(value)
+            canvas.hline(left, left + plot_w - 1, y, grid)
+            text = f"{value:.0f}"
+            canvas.text(left - 6 - len(text) * 8, y - 5, text, label)
+        ts = first_tick
+        while ts < end:
+            x = x_of(ts)
+            canvas.vline(x, top, bottom, grid)
+            text = format_chart_tick(ts, seconds)
+            canvas.text(x - len(text) * 4, bottom + 5, text, label)
+            ts += tick
+        canvas.hline(left, left + plot_w - 1, bottom, axis)
+        canvas.vline(left, top, bottom, axis)
+
+        band = bytes(c + (255 - c) * 3 // 4 for c in color)
+        for ts, (_, vmin, vmax) in values:
+            canvas.vline(x_of(ts), y_of(vmax), y_of(vmin), band)
+        previous = None
+        # Розрив лінії там, де даних немає довше за три точки
+        max_gap = 3 * max(step, seconds / plot_w)
+        for ts, (avg, _, _) in values:
+            point = (x_of(ts), y_of(avg))
+            if previous and ts - previous[0] <= max_gap:
+                canvas.line(*previous[1], *point, bytes(color))
+            else:
+                canvas.point(*point, bytes(color))
+            previous = (ts, point)
+    return canvas.png()
+
+
+# --- АЛЕРТИ ЗА ПОРОГАМИ ---
+def read_mount_usage(mounts: list[str]) -> dict[str, float]:
+    """Відсоток заповнення для кожної точки монтування"""
+    usage = {}
+    for mount in mounts:
+        try:
+            usage[mount] = psutil.disk_usage(mount).percent
+        except OSError:
+            continue
+    return usage
+
+
+class ThresholdRule:
+    """Поріг з гістерезисом над ковзним вікном останніх samples замірів.
+
+    Лічильники порушень оновлюються інкрементально при кожному замірі,
+    без повторного проходу по історії.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        title: str,
+        unit: str,
+        read,
+        threshold: float,
+        above: bool = True,
+        samples: int = ALERT_SAMPLES,
+        hysteresis: float = 0,
+        cooldown: float = ALERT_COOLDOWN,
+    ):
+        self.key = key
+        self.title = title
+        self.unit = unit
+        self.read = read
+        self.threshold = threshold
+        self.above = above
+        self.samples = samples
+        # Поріг зняття алерту — "за" основним порогом на величину гістерезису
+        self.clear_threshold = threshold - hysteresis if above else threshold + hysteresis
+        self.cooldown = cooldown
+        self.window: deque[tuple[bool, bool]] = deque()
+        self.breaches = 0
+        self.clears = 0
+        self.firing = False
+        self.notified = False
+        self.last_fired = 0.0
+        self.last_value: float | None = None
+
+    def _push(self, breach: bool, clear: bool):
+        if len(self.window) == self.samples:
+            old_breach, old_clear = self.window.popleft()
+            self.breaches -= old_breach
+            self.clears -= old_clear
+        self.window.append((breach, clear))
+        self.breaches += breach
+        self.clears += clear
+
+    def evaluate(self, value: float | None, now: float) -> str | None:
+        """Додає замір -> 'fire', 'resolve' або None"""
+        if value is None:
+            return None
+        self.last_value = value
+        if self.above:
+            self._push(value > self.threshold, value < self.clear_threshold)
+        else:
+            self._push(value < self.threshold, value > self.clear_threshold)
+
+        if not self.firing and self.breaches == self.samples:
+            self.firing = True
+            # Під час cooldown стан змінюється, але повідомлення не надсилається
+            if now - self.last_fired >= self.cooldown:
+                self.last_fired = now
+                self.notified = True
+                return "fire"
+        elif self.firing and self.clears == self.samples:
+            self.firing = False
+            if self.notified:
+                self.notified = False
+                return "resolve"
+        return None
+
+    def describe(self) -> str:
+        sign = ">" if self.above else "<"
+        value = "—" if self.last_value is None else f"{self.last_value:.1f}"
+        state = "🔴" if self.firing else "🟢"
+        return f"{state} {self.title}: {value}{self.unit} (поріг {sign} {self.threshold:g}{self.unit})"
+
+
+class AlertEngine:
+    """Набір правил, що перевіряються на кожному тіку збору метрик"""
+
+    def __init__(self, rules: list[ThresholdRule]):
+        self.rules = rules
+
+    def evaluate(self, sample: MetricsSample, mounts: dict[str, float]):
+        for rule in self.rules:
+            result = rule.evaluate(rule.read(sample, mounts), sample.ts)
+            if result == "fire":
+                NOTIFIER.notify(
+                    f"🚨 <b>{rule.title}:</b> {rule.last_value:.1f}{rule.unit} "
+                    f"(поріг {rule.threshold:g}{rule.unit}, {rule.samples} замірів поспіль)"
+                )
+            elif result == "resolve":
+                NOTIFIER.notify(
+                    f"✅ <b>{rule.title}</b> в нормі: {rule.last_value:.1f}{rule.unit}"
+                )
+
+    def render(self) -> str:
+        if not self.rules:
+            return "Правила алертів не налаштовані."
+        return "\n".join(rule.describe() for rule in self.rules)
+
+
+def build_alert_rules() -> list[ThresholdRule]:
+    def margin(threshold: float) -> float:
+        return threshold * ALERT_HYSTERESIS_PERCENT / 100
+
+    rules = []
+    if ALERT_CPU_PERCENT:
+        rules.append(
+            ThresholdRule(
+                "cpu",
+                "Навантаження CPU",
+                "%",
+                lambda sample, mounts: sample.cpu_percent,
+                ALERT_CPU_PERCENT,
+                hysteresis=margin(ALERT_CPU_PERCENT),
+            )
+        )
+    if ALERT_MEM_AVAILABLE_MB:
+        rules.append(
+            ThresholdRule(
+                "mem",
+                "Вільна RAM",
+                " MB",
+                lambda sample, mounts: sample.mem_available / (1024**2),
+                ALERT_MEM_AVAILABLE_MB,
+                above=False,
+                hysteresis=margin(ALERT_MEM_AVAILABLE_MB),
+            )
+        )
+    if ALERT_DISK_PERCENT:
+        for mount in ALERT_DISK_MOUNTS:
+            rules.append(
+                ThresholdRule(
+                    f"disk:{mount}",
+                    f"Диск {mount}",
+                    "%",
+                    lambda sample, mounts, mount=mount: mounts.get(mount),
+                    ALERT_DISK_PERCENT,
+                    # Диск заповнюється повільно — достатньо одного заміру
+                    samples=1,
+                    hysteresis=margin(ALERT_DISK_PERCENT),
+                )
+            )
+    if ALERT_TEMP:
+        rules.append(
+            ThresholdRule(
+                "temp",
+                "Температура CPU",
+                "°C",
+                lambda sample, mounts: sample.temp,
+                ALERT_TEMP,
+                hysteresis=margin(ALERT_TEMP),
+            )
+        )
+    return rules
+
+
+ALERT_ENGINE = AlertEngine(build_alert_rules())
+
+
+def window_stats(field: str, seconds: float) -> tuple[float, float, float] | None:
+    """min/avg/max поля за останні seconds секунд"""
+    if not METRICS_HISTORY:
+        return None
+    since = METRICS_HISTORY[-1].ts - seconds
+    values = []
+    # Йдемо з кінця буфера, поки заміри потрапляють у вікно
+    for sample in reversed(METRICS_HISTORY):
+        if sample.ts < since:
+            break
+        value = getattr(sample, field)
+        if value is not None:
+            values.append(value)
+    if not values:
+        return None
+    return (min(values), sum(values) / len(values), max(values))
+
+
+def format_window_stats() -> str:
+    rows = [("CPU %", "cpu_percent"), ("RAM %", "mem_percent"), ("Temp °C", "temp")]
+    lines = ["".ljust(8) + "".join(label.rjust(12) for label, _ in METRICS_WINDOWS)]
+    for title, field in rows:
+        cells = []
+        for _, seconds in METRICS_WINDOWS:
+            stats = window_stats(field, seconds)
+            if stats is None:
+                cells.append("—".rjust(12))
+            else:
+                cells.append("{:.0f}/{:.0f}/{:.0f}".format(*stats).rjust(12))
+        lines.append(title.ljust(8) + "".join(cells))
+    return "\n".join(lines)
+
+
+def get_system_dashboard(sample: MetricsSample | None = None) -> str:
+    """Збирає статистику: CPU, RAM, Disk, Uptime, Temp"""
+    if sample is None and METRICS_HISTORY:
+        sample = METRICS_HISTORY[-1]
+    elif sample is None:
+        # Фоновий збір ще не встиг зробити замір
+        sample = collect_metrics_sample(cpu_interval=1)
+
+    # RAM
+    total_mem = round(sample.mem_total / (1024**3), 2)
+    used_mem = round(sample.mem_used / (1024**3), 2)
+    free_mem = round(sample.mem_available / (1024**3), 2)
+
+    # DISK
+    total_disk = round(sample.disk_total / (1024**3), 2)
+    used_disk = round(sample.disk_used / (1024**3), 2)
+
+    # UPTIME
+    uptime = str(datetime.timedelta(seconds=int(sample.uptime)))
+
+    # TEMP
+    temp_str = f"{sample.temp}°C" if sample.temp is not None else "N/A"
 
     msg = (
         f"📊 <b>Стан системи:</b>\n\n"
-        f"🖥 <b>Температура та загруженість процесора:</b> {cpu_percent}% (Temp: {temp_str})\n"
+        f"🖥 <b>Температура та загруженість процесора:</b> {sample.cpu_percent}% (Temp: {temp_str})\n"
         f"🧠 <b>Використовування оперативної пам'яті:</b> {used_mem}GB / {total_mem}GB (Вільн: {free_mem}GB)\n"
-        f"💾 <b>Кількість місця на диску (/):</b> {used_disk}GB / {total_disk}GB ({disk_percent}%)\n"
+        f"💾 <b>Кількість місця на диску (/):</b> {used_disk}GB / {total_disk}GB ({sample.disk_percent}%)\n"
         f"⏱ <b>Час роботи системи:</b> {uptime}"
     )
+    if len(METRICS_HISTORY) > 1:
+        msg += f"\n\n📈 <b>min/avg/max:</b>\n<pre>{format_window_stats()}</pre>"
     return msg
 
 
 def get_failed_services() -> str:
     """Повертає список служб systemd, що впали"""
+    if SYSTEMD_WATCHER.connected:
+        return SYSTEMD_WATCHER.render_failed()
+    return get_failed_services_systemctl()
+
+
+def get_failed_services_systemctl() -> str:
+    """Запасний варіант без D-Bus: розбір виводу systemctl --failed"""
     try:
-        result = subprocess.run(
+        result = run_command(
             ["systemctl", "--failed", "--no-pager"], capture_output=True, text=True
         )
         if "0 loaded units listed" in result.stdout:
@@ -138,114 +1939,1174 @@ def get_failed_services() -> str:
         return f"❌ Помилка: {e}"
 
 
-def get_open_ports_file() -> str | None:
-    """Записує відкриті порти у файл"""
-    filename = "open_ports.txt"
-    try:
-        # Використовуємо ss без sudo. Це безпечніше.
-        # Процеси (PID) можуть не відображатися без root, але порти буде видно.
-        cmd = ["ss", "-tulpn"]
-        with open(filename, "w") as f:
-            # Пишемо заголовок
-            f.write(f"Scan time: {datetime.datetime.now()}\n")
-            f.write("Command: ss -tulpn\n\n")
-            # Виконуємо команду і пишемо результат прямо у файл
-            subprocess.run(cmd, stdout=f, text=True, check=True)
-        return filename
-    except Exception as e:
-        logging.error(f"Помилка сканування портів: {e}")
-        return None
+SYSTEMD_DEST = "org.freedesktop.systemd1"
+SYSTEMD_PATH = "/org/freedesktop/systemd1"
+SYSTEMD_MANAGER = "org.freedesktop.systemd1.Manager"
+SYSTEMD_UNIT = "org.freedesktop.systemd1.Unit"
+DBUS_PROPERTIES = "org.freedesktop.DBus.Properties"
+
+
+class SystemdWatcher:
+    """Стан юнітів systemd через D-Bus без опитування.
+
+    Список failed-юнітів береться одним викликом ListUnitsFiltered, далі
+    підтримується за сигналами PropertiesChanged / JobRemoved.
+    """
+
+    def __init__(self):
+        self.bus = None
+        # unit -> (опис, sub-state) для юнітів у стані failed
+        self.failed: dict[str, tuple[str, str]] = {}
+        # об'єктний шлях D-Bus -> ім'я юніта
+        self.paths: dict[str, str] = {}
+        self.on_change = None
+
+    @property
+    def connected(self) -> bool:
+        return self.bus is not None and self.bus.connected
+
+    async def _call(self, path: str, interface: str, member: str, signature="", body=None):
+        reply = await self.bus.call(
+            DBusMessage(
+                destination=SYSTEMD_DEST,
+                path=path,
+                interface=interface,
+                member=member,
+                signature=signature,
+                body=body or [],
+            )
+        )
+        if reply.message_type == MessageType.ERROR:
+            raise RuntimeError(f"{member}: {reply.error_name} {reply.body}")
+        return reply.body
+
+    async def _add_match(self, rule: str):
+        await self.bus.call(
+            DBusMessage(
+                destination="org.freedesktop.DBus",
+                path="/org/freedesktop/DBus",
+                interface="org.freedesktop.DBus",
+                member="AddMatch",
+                signature="s",
+                body=[rule],
+            )
+        )
+
+    async def connect(self, bus=None):
+        """Підключається до шини, підписується на сигнали та читає failed-юніти"""
+        if bus is None:
+            if SYSTEMD_DBUS_ADDRESS:
+                bus = MessageBus(bus_address=SYSTEMD_DBUS_ADDRESS)
+            else:
+                bus = MessageBus(bus_type=BusType.SYSTEM)
+            bus = await bus.connect()
+        self.bus = bus
+        bus.add_message_handler(self._on_message)
+        await self._add_match(
+            f"type='signal',sender='{SYSTEMD_DEST}',interface='{DBUS_PROPERTIES}',"
+            "member='PropertiesChanged'"
+        )
+        await self._add_match(
+            f"type='signal',sender='{SYSTEMD_DEST}',interface='{SYSTEMD_MANAGER}',"
+            "member='JobRemoved'"
+        )
+        # Без Subscribe systemd не розсилає сигнали про юніти
+        await self._call(SYSTEMD_PATH, SYSTEMD_MANAGER, "Subscribe")
+        (units,) = await self._call(
+            SYSTEMD_PATH, SYSTEMD_MANAGER, "ListUnitsFiltered", "as", [["failed"]]
+        )
+        self.failed = {}
+        for name, description, _load, _active, sub, _f, path, *_ in units:
+            self.failed[name] = (description, sub)
+            self.paths[path] = name
+
+    def _on_message(self, msg):
+        if msg.message_type != MessageType.SIGNAL:
+            return
+        if msg.member == "PropertiesChanged" and msg.body[0] == SYSTEMD_UNIT:
+            changed = msg.body[1]
+            if "ActiveState" in changed:
+                spawn(self._update_path(msg.path, changed))
+        elif msg.member == "JobRemoved":
+            # (id, job, unit, result) — юніт після завершення job-у
+            _job_id, _job, unit, result = msg.body
+            if result == "failed" and unit not in self.failed:
+                spawn(self._refresh_unit(unit))
+
+    async def _update_path(self, path: str, changed: dict):
+        name = self.paths.get(path)
+        if name is None:
+            try:
+                (variant,) = await self._call(
+                    path, DBUS_PROPERTIES, "Get", "ss", [SYSTEMD_UNIT, "Id"]
+                )
+            except RuntimeError:
+                # Юніт вивантажено раніше, ніж ми встигли спитати його ім'я
+                return
+            name = self.paths[path] = variant.value
+        sub = changed["SubState"].value if "SubState" in changed else ""
+        self._set_state(name, changed["ActiveState"].value, sub)
+
+    async def _refresh_unit(self, name: str):
+        try:
+            (path,) = await self._call(
+                SYSTEMD_PATH, SYSTEMD_MANAGER, "GetUnit", "s", [name]
+            )
+            (props,) = await self._call(path, DBUS_PROPERTIES, "GetAll", "s", [SYSTEMD_UNIT])
+        except RuntimeError:
+            return
+        self.paths[path] = name
+        self._set_state(
+            name,
+            props["ActiveState"].value,
+            props["SubState"].value,
+            props["Description"].value,
+        )
+
+    def _set_state(self, name: str, active: str, sub: str, description: str = ""):
+        was_failed = name in self.failed
+        if active == "failed":
+            self.failed[name] = (description or self.failed.get(name, ("", ""))[0], sub)
+            if not was_failed and self.on_change:
+                self.on_change(name, True)
+        elif was_failed and active in ("active", "inactive"):
+            del self.failed[name]
+            if self.on_change:
+                self.on_change(name, False)
+
+    def render_failed(self) -> str:
+        if not self.failed:
+            return "✅ Немає служб, що впали."
+        lines = [
+            f"• <code>{html.escape(name)}</code> — {html.escape(desc)} ({sub})"
+            for name, (desc, sub) in sorted(self.failed.items())
+        ]
+        return "⚠️ <b>Служби, що впали:</b>\n\n" + "\n".join(lines)
+
+    async def run(self):
+        """Підключення з перепідключенням при втраті шини"""
+        if MessageBus is None:
+            logging.warning("dbus-fast не встановлено: стеження за systemd вимкнено.")
+            return
+        backoff = 1.0
+        while True:
+            try:
+                await self.connect()
+                logging.info("✅ systemd D-Bus підключено.")
+                backoff = 1.0
+                await self.bus.wait_for_disconnect()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"systemd D-Bus error: {e}")
+            self.bus = None
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+
+def notify_unit_change(name: str, failed: bool):
+    if failed:
+        NOTIFIER.notify(f"🔥 <b>Служба впала:</b> <code>{html.escape(name)}</code>")
+    else:
+        NOTIFIER.notify(f"✅ <b>Служба відновилась:</b> <code>{html.escape(name)}</code>")
+
+
+SYSTEMD_WATCHER = SystemdWatcher()
+SYSTEMD_WATCHER.on_change = notify_unit_change
+
+
+# (файл, протокол, сімейство адрес)
+PROC_NET_TABLES = [
+    ("/proc/net/tcp", "tcp", socket.AF_INET),
+    ("/proc/net/tcp6", "tcp6", socket.AF_INET6),
+    ("/proc/net/udp", "udp", socket.AF_INET),
+    ("/proc/net/udp6", "udp6", socket.AF_INET6),
+]
+# Стан у /proc/net: 0A — TCP LISTEN, 07 — незв'язаний UDP-сокет
+PROC_NET_LISTEN_STATES = {"tcp": "0A", "tcp6": "0A", "udp": "07", "udp6": "07"}
+
+
+class Listener(NamedTuple):
+    proto: str
+    address: str
+    port: int
+    inode: int
+    pid: int | None
+    process: str
+
+
+# Рядок таблиці: локальна адреса, віддалена адреса, стан, ..., inode.
+# Стан підставляється у шаблон, тож непотрібні рядки відкидає regex-рушій.
+PROC_NET_LINE_TEMPLATE = (
+    r"^\s*\d+: ([0-9A-F]+):([0-9A-F]{{4}}) [0-9A-F]+:([0-9A-F]{{4}}) {state} "
+    r"(?:\S+\s+){{5}}(\d+)"
+)
+PROC_NET_REGEXES = {
+    state: re.compile(PROC_NET_LINE_TEMPLATE.format(state=state), re.MULTILINE)
+    for state in set(PROC_NET_LISTEN_STATES.values())
+}
+
+
+@functools.lru_cache(maxsize=1024)
+def decode_proc_net_ip(hex_addr: str, family: int) -> str:
+    """'0100007F' -> '127.0.0.1'. Адреса у /proc — 32-бітні слова host-order."""
+    raw = bytes.fromhex(hex_addr)
+    # Кожне 32-бітне слово записане у little-endian
+    raw = b"".join(raw[i : i + 4][::-1] for i in range(0, len(raw), 4))
+    return socket.inet_ntop(family, raw)
+
+
+def read_proc_net_listeners() -> list[tuple[str, str, int, int]]:
+    """Слухаючі сокети з /proc/net/{tcp,udp}{,6} -> (proto, адреса, порт, inode)"""
+    sockets = []
+    for path, proto, family in PROC_NET_TABLES:
+        regex = PROC_NET_REGEXES[PROC_NET_LISTEN_STATES[proto]]
+        is_udp = proto.startswith("udp")
+        try:
+            with open(path) as f:
+                content = f.read()
+        except FileNotFoundError:
+            continue
+        for addr, port, remote_port, inode in regex.findall(content):
+            # Для UDP пропускаємо "підключені" сокети (віддалений порт != 0)
+            if is_udp and remote_port != "0000":
+                continue
+            sockets.append(
+                (proto, decode_proc_net_ip(addr, family), int(port, 16), int(inode))
+            )
+    return sockets
+
 
+def map_socket_inodes(inodes: set[int]) -> dict[int, tuple[int, str]]:
+    """Один прохід по /proc/*/fd: inode сокета -> (PID, ім'я процесу).
 
-def run_speedtest_cli() -> str:
-    """Запускає speedtest-cli"""
+    Без root видно лише власні процеси — решта залишиться без PID.
+    """
+    owners: dict[int, tuple[int, str]] = {}
+    remaining = set(inodes)
+    for pid_name in os.listdir("/proc"):
+        if not remaining:
+            break
+        if not pid_name.isdigit():
+            continue
+        try:
+            fd_dir = os.open(f"/proc/{pid_name}/fd", os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            continue
+        found = []
+        try:
+            for fd in os.listdir(fd_dir):
+                try:
+                    # readlink відносно відкритого каталогу — без збирання шляхів
+                    target = os.readlink(fd, dir_fd=fd_dir)
+                except OSError:
+                    continue
+                # Посилання на сокет виглядає як 'socket:[12345]'
+                if target[:8] != "socket:[":
+                    continue
+                inode = int(target[8:-1])
+                if inode in remaining:
+                    remaining.discard(inode)
+                    found.append(inode)
+        except OSError:
+            pass
+        finally:
+            os.close(fd_dir)
+        if found:
+            try:
+                with open(f"/proc/{pid_name}/comm") as f:
+                    comm = f.read().strip()
+            except OSError:
+                comm = ""
+            for inode in found:
+                owners[inode] = (int(pid_name), comm)
+    return owners
+
+
+def collect_listeners() -> list[Listener]:
+    """Відкриті (слухаючі) порти разом з процесами-власниками"""
+    sockets = read_proc_net_listeners()
+    owners = map_socket_inodes({inode for *_, inode in sockets})
+    listeners = []
+    for proto, address, port, inode in sockets:
+        pid, comm = owners.get(inode, (None, ""))
+        listeners.append(Listener(proto, address, port, inode, pid, comm))
+    listeners.sort(key=lambda l: (l.proto, l.port, l.address))
+    return listeners
+
+
+def format_listener(listener: Listener) -> str:
+    address = listener.address
+    if ":" in address:
+        address = f"[{address}]"
+    owner = f"{listener.process}({listener.pid})" if listener.pid else "—"
+    return f"{listener.proto:<5} {address + ':' + str(listener.port):<28} {owner}"
+
+
+class PortsWatcher:
+    """Останній знімок відкритих портів та різниця з попереднім"""
+
+    def __init__(self):
+        self.snapshot: list[Listener] | None = None
+        self.taken_at: float | None = None
+
+    @staticmethod
+    def _key(listener: Listener) -> tuple[str, str, int]:
+        return (listener.proto, listener.address, listener.port)
+
+    def update(self, listeners: list[Listener]) -> tuple[list[Listener], list[Listener]]:
+        """Зберігає новий знімок -> (нові порти, закриті порти)"""
+        previous = self.snapshot
+        self.snapshot = listeners
+        self.taken_at = time.time()
+        if previous is None:
+            return ([], [])
+        old = {self._key(l): l for l in previous}
+        new = {self._key(l): l for l in listeners}
+        opened = [l for k, l in new.items() if k not in old]
+        closed = [l for k, l in old.items() if k not in new]
+        return (opened, closed)
+
+    async def run(self, interval: float = PORTS_WATCH_INTERVAL):
+        """Фоново стежить за портами та сповіщає про зміни"""
+        while True:
+            try:
+                listeners = await run_in_thread(collect_listeners)
+                opened, closed = self.update(listeners)
+                if opened or closed:
+                    lines = [f"+ {format_listener(l)}" for l in opened]
+                    lines += [f"- {format_listener(l)}" for l in closed]
+                    NOTIFIER.notify(
+                        f"🛡 <b>Зміна відкритих портів:</b>\n"
+                        f"<pre>{html.escape(chr(10).join(lines))}</pre>"
+                    )
+            except Exception as e:
+                logging.error(f"Помилка сканування портів: {e}")
+            await asyncio.sleep(interval)
+
+
+PORTS_WATCHER = PortsWatcher()
+
+
+def split_message(text_lines: list[str], limit: int = 3900) -> list[str]:
+    """Групує рядки у шматки, що вміщуються в одне повідомлення"""
+    chunks, current, size = [], [], 0
+    for line in text_lines:
+        if current and size + len(line) + 1 > limit:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+# --- ТЕСТ ШВИДКОСТІ ---
+SPEEDTEST_CHUNK = 64 * 1024
+# Один запит вивантаження не більший за цей обсяг (далі — новий запит)
+SPEEDTEST_UPLOAD_REQUEST_BYTES = 25_000_000
+SPEEDTEST_LATENCY_PROBES = 20
+# Інтервал, за який рахується миттєва швидкість для перцентилів
+SPEEDTEST_SAMPLE_INTERVAL = 0.25
+SPEEDTEST_HISTORY_SIZE = 200
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Перцентиль з лінійною інтерполяцією (q від 0 до 100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+class SpeedtestResult(NamedTuple):
+    ts: float
+    download_mbps: float
+    download_p10: float
+    download_p90: float
+    upload_mbps: float
+    upload_p10: float
+    upload_p90: float
+    latency_p50: float
+    latency_p90: float
+    jitter: float
+    streams: int
+    server: str
+
+
+class ThroughputMeter:
+    """Лічильник байтів спільний для всіх потоків, з вибірками швидкості"""
+
+    def __init__(self):
+        self.bytes = 0
+        self.samples: list[float] = []
+        self.started = time.monotonic()
+        self.finished: float | None = None
+
+    async def sample(self, deadline: float):
+        last_bytes, last_ts = 0, self.started
+        while time.monotonic() < deadline:
+            await asyncio.sleep(SPEEDTEST_SAMPLE_INTERVAL)
+            now = time.monotonic()
+            self.samples.append((self.bytes - last_bytes) * 8 / (now - last_ts) / 1e6)
+            last_bytes, last_ts = self.bytes, now
+
+    def mbps(self) -> float:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.bytes * 8 / elapsed / 1e6 if elapsed else 0.0
+
+
+async def _download_stream(session: aiohttp.ClientSession, url: str, meter: ThroughputMeter, deadline: float):
+    while time.monotonic() < deadline:
+        async with session.get(url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(SPEEDTEST_CHUNK):
+                meter.bytes += len(chunk)
+                if time.monotonic() >= deadline:
+                    return
+
+
+async def _upload_stream(session: aiohttp.ClientSession, url: str, meter: ThroughputMeter, deadline: float):
+    payload = os.urandom(SPEEDTEST_CHUNK)  # випадкові дані не стискаються проксі
+
+    async def body():
+        sent = 0
+        while sent < SPEEDTEST_UPLOAD_REQUEST_BYTES and time.monotonic() < deadline:
+            yield payload
+            sent += len(payload)
+            meter.bytes += len(payload)
+
+    while time.monotonic() < deadline:
+        async with session.post(url, data=body()) as resp:
+            resp.raise_for_status()
+            await resp.read()
+
+
+async def _run_phase(session, stream, urls: list[str], streams: int, duration: float) -> ThroughputMeter:
+    meter = ThroughputMeter()
+    deadline = meter.started + duration
+    tasks = [
+        asyncio.create_task(stream(session, urls[i % len(urls)], meter, deadline))
+        for i in range(streams)
+    ]
     try:
-        result = subprocess.run(
-            ["speedtest-cli", "--simple"], capture_output=True, text=True, timeout=90
+        await asyncio.wait_for(
+            asyncio.gather(meter.sample(deadline), *tasks), timeout=duration + 15
         )
-        return f"🚀 <b>Speedtest:</b>\n\n{result.stdout}"
+    finally:
+        meter.finished = time.monotonic()
+        for task in tasks:
+            task.cancel()
+    return meter
+
+
+async def measure_latency(session: aiohttp.ClientSession, url: str, probes: int = SPEEDTEST_LATENCY_PROBES) -> list[float]:
+    """Час відповіді (мс) на маленькі запити через уже відкрите з'єднання"""
+    samples = []
+    for i in range(probes + 1):
+        started = time.perf_counter()
+        async with session.get(url) as resp:
+            await resp.read()
+        if i:  # перший запит включає TCP/TLS рукостискання
+            samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+async def run_speedtest(
+    download_urls: list[str] = SPEEDTEST_DOWNLOAD_URLS,
+    upload_urls: list[str] = SPEEDTEST_UPLOAD_URLS,
+    latency_url: str = SPEEDTEST_LATENCY_URL,
+    streams: int = SPEEDTEST_STREAMS,
+    duration: float = SPEEDTEST_DURATION,
+) -> SpeedtestResult:
+    """Вимірює затримку, потім завантаження та вивантаження у streams потоків"""
+    connector = aiohttp.TCPConnector(limit=streams + 1, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(
+        connector=connector,
+        auto_decompress=False,
+        headers={"Accept-Encoding": "identity"},
+        timeout=aiohttp.ClientTimeout(total=None, sock_read=15, sock_connect=10),
+    ) as session:
+        latency = await measure_latency(session, latency_url)
+        download = await _run_phase(session, _download_stream, download_urls, streams, duration)
+        upload = await _run_phase(session, _upload_stream, upload_urls, streams, duration)
+    jitter = (
+        sum(abs(a - b) for a, b in zip(latency, latency[1:])) / (len(latency) - 1)
+        if len(latency) > 1 else 0.0
+    )
+    return SpeedtestResult(
+        ts=time.time(),
+        download_mbps=download.mbps(),
+        download_p10=percentile(download.samples, 10),
+        download_p90=percentile(download.samples, 90),
+        upload_mbps=upload.mbps(),
+        upload_p10=percentile(upload.samples, 10),
+        upload_p90=percentile(upload.samples, 90),
+        latency_p50=percentile(latency, 50),
+        latency_p90=percentile(latency, 90),
+        jitter=jitter,
+        streams=streams,
+        server=urllib.parse.urlsplit(download_urls[0]).hostname or "?",
+    )
+
+
+def load_speedtest_history() -> list[SpeedtestResult]:
+    try:
+        with open(SPEEDTEST_HISTORY_FILE) as f:
+            return [SpeedtestResult(**item) for item in json.load(f)]
     except FileNotFoundError:
-        return "❌ 'speedtest-cli' не встановлено. (pip install speedtest-cli)"
-    except subprocess.TimeoutExpired:
-        return "❌ Тайм-аут тесту швидкості."
+        return []
     except Exception as e:
-        return f"❌ Помилка: {e}"
+        logging.error(f"Не вдалося прочитати історію тесту швидкості: {e}")
+        return []
+
+
+def save_speedtest_result(result: SpeedtestResult) -> list[SpeedtestResult]:
+    history = (load_speedtest_history() + [result])[-SPEEDTEST_HISTORY_SIZE:]
+    try:
+        os.makedirs(os.path.dirname(SPEEDTEST_HISTORY_FILE) or ".", exist_ok=True)
+        tmp_path = f"{SPEEDTEST_HISTORY_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump([item._asdict() for item in history], f)
+        os.replace(tmp_path, SPEEDTEST_HISTORY_FILE)
+    except Exception as e:
+        logging.error(f"Не вдалося зберегти історію тесту швидкості: {e}")
+    return history
+
+
+def format_speedtest(result: SpeedtestResult, history: list[SpeedtestResult]) -> str:
+    text = (
+        f"🚀 <b>Тест швидкості</b> ({html.escape(result.server)}, потоків: {result.streams})\n\n"
+        f"⬇️ Завантаження: <b>{result.download_mbps:.1f}</b> Мбіт/с "
+        f"(p10 {result.download_p10:.1f}, p90 {result.download_p90:.1f})\n"
+        f"⬆️ Вивантаження: <b>{result.upload_mbps:.1f}</b> Мбіт/с "
+        f"(p10 {result.upload_p10:.1f}, p90 {result.upload_p90:.1f})\n"
+        f"📶 Затримка: p50 {result.latency_p50:.1f} мс, p90 {result.latency_p90:.1f} мс, "
+        f"джитер {result.jitter:.1f} мс"
+    )
+    previous = [item for item in history if item.ts < result.ts][-20:]
+    if previous:
+        # Порівняння з медіаною попередніх замірів, щоб бачити деградацію
+        base_down = percentile([item.download_mbps for item in previous], 50)
+        base_up = percentile([item.upload_mbps for item in previous], 50)
+        base_lat = percentile([item.latency_p50 for item in previous], 50)
+
+        def delta(value: float, base: float) -> str:
+            return f"{(value - base) / base * 100:+.0f}%" if base else "—"
+
+        text += (
+            f"\n\n📈 <b>Відносно медіани {len(previous)} попередніх:</b> "
+            f"⬇️ {delta(result.download_mbps, base_down)}, "
+            f"⬆️ {delta(result.upload_mbps, base_up)}, "
+            f"📶 {delta(result.latency_p50, base_lat)}\n<pre>"
+        )
+        for item in previous[-5:] + [result]:
+            when = datetime.datetime.fromtimestamp(item.ts).strftime("%d.%m %H:%M")
+            text += (
+                f"{when}  ⬇️{item.download_mbps:7.1f}  ⬆️{item.upload_mbps:7.1f}  "
+                f"{item.latency_p50:5.1f}мс\n"
+            )
+        text += "</pre>"
+    return text
+
+
+# Тестовий сервер (сумісний з URL speed.cloudflare.com): /__down?bytes=N та /__up
+SPEEDTEST_SERVER_MAX_BYTES = 1 << 30
+_SPEEDTEST_PAYLOAD = os.urandom(SPEEDTEST_CHUNK)
+
+
+async def speedtest_down(request: web.Request) -> web.StreamResponse:
+    try:
+        size = min(int(request.query.get("bytes", "0")), SPEEDTEST_SERVER_MAX_BYTES)
+    except ValueError:
+        raise web.HTTPBadRequest()
+    response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+    response.content_length = size
+    await response.prepare(request)
+    try:
+        while size > 0:
+            chunk = _SPEEDTEST_PAYLOAD[: min(size, SPEEDTEST_CHUNK)]
+            await response.write(chunk)
+            size -= len(chunk)
+        await response.write_eof()
+    except ConnectionError:
+        pass  # клієнт закриває з'єднання, щойно закінчився час фази
+    return response
+
+
+async def speedtest_up(request: web.Request) -> web.Response:
+    received = 0
+    async for chunk in request.content.iter_chunked(SPEEDTEST_CHUNK):
+        received += len(chunk)
+    return web.json_response({"bytes": received})
+
+
+async def start_speedtest_server(address: str = SPEEDTEST_SERVER_LISTEN) -> web.AppRunner:
+    app = web.Application(client_max_size=SPEEDTEST_SERVER_MAX_BYTES)
+    app.router.add_get("/__down", speedtest_down)
+    app.router.add_post("/__up", speedtest_up)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    host, _, port = address.rpartition(":")
+    await web.TCPSite(runner, host.strip("[]") or None, int(port)).start()
+    logging.info(f"🚀 Тестовий сервер швидкості: http://{address}/__down?bytes=N, /__up")
+    return runner
+
+
+async def speedtest_server_main():
+    """Режим тестового сервера для вимірювань у локальній мережі (без Telegram)"""
+    await start_speedtest_server(SPEEDTEST_SERVER_LISTEN or "0.0.0.0:8080")
+    await asyncio.Event().wait()
 
 
 async def get_external_ip() -> str:
     """Отримує зовнішній IP через API"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://ifconfig.me/ip") as resp:
-                ip = await resp.text()
-                return f"🌍 <b>Зовнішній IP:</b> {ip}"
+        async with get_http_session().get("https://ifconfig.me/ip") as resp:
+            ip = await resp.text()
+            return f"🌍 <b>Зовнішній IP:</b> {ip}"
     except Exception as e:
         return f"❌ Не вдалося отримати IP: {e}"
 
 
 # --- ІСНУЮЧІ ФУНКЦІЇ ---
-def check_system_updates() -> list[str]:
-    TELEGRAM_MAX_LEN = 4000
+UPDATE_CHECK_COMMANDS = {
+    "pacman": ["checkupdates"],
+    "dnf": ["dnf", "check-update"],
+    "apt": ["apt", "list", "--upgradable"],
+}
+# Коди виходу, що означають успішну перевірку
+# (checkupdates: 2 — оновлень немає; dnf: 100 — є оновлення)
+UPDATE_CHECK_OK_CODES = {"pacman": {0, 2}, "dnf": {0, 100}, "apt": {0}}
+
+# linux 6.9.1.arch1-1 -> 6.9.2.arch1-1
+REGEX_PACMAN_UPDATE = re.compile(r"^(\S+)\s+(\S+)\s+->\s+(\S+)")
+# bash/jammy-updates 5.1-6ubuntu1.1 amd64 [upgradable from: 5.1-6ubuntu1]
+REGEX_APT_UPDATE = re.compile(
+    r"^([^/\s]+)/(\S+)\s+(\S+)\s+\S+\s+\[upgradable from:\s+([^\]]+)\]"
+)
+# bash.x86_64    5.2.26-3.fc40    updates
+REGEX_DNF_UPDATE = re.compile(r"^(\S+)\.[^.\s]+\s+(\S+)\s+(\S+)\s*$")
+
+
+class PackageUpdate(NamedTuple):
+    name: str
+    old_version: str
+    new_version: str
+    repository: str
+
+
+def parse_update_list(pm_family: str, output: str) -> list[PackageUpdate]:
+    """Розбирає вивід команди перевірки оновлень у список пакетів"""
+    updates = []
+    for line in output.splitlines():
+        if pm_family == "pacman":
+            match = REGEX_PACMAN_UPDATE.match(line)
+            if match:
+                name, old, new = match.groups()
+                updates.append(PackageUpdate(name, old, new, ""))
+        elif pm_family == "apt":
+            match = REGEX_APT_UPDATE.match(line)
+            if match:
+                name, repo, new, old = match.groups()
+                updates.append(PackageUpdate(name, old, new, repo))
+        elif pm_family == "dnf":
+            # Після "Obsoleting Packages" йдуть пакети, що замінюються, — не оновлення
+            if line.startswith("Obsoleting"):
+                break
+            match = REGEX_DNF_UPDATE.match(line)
+            if match:
+                name, new, repo = match.groups()
+                updates.append(PackageUpdate(name, "", new, repo))
+    return updates
+
+
+async def check_system_updates() -> list[PackageUpdate]:
+    """Запускає перевірку оновлень. RuntimeError — якщо перевірка не вдалася."""
     pm_family = get_package_manager()
     if not pm_family:
-        return ["⚠️ Помилка: Не вдалося визначити пакетний менеджер."]
-    distro_commands = {
-        "pacman": ["checkupdates"],
-        "dnf": ["dnf", "check-update"],
-        "apt": ["apt", "list", "--upgradable"],
-    }
-    command = distro_commands.get(pm_family)
+        raise RuntimeError("Не вдалося визначити пакетний менеджер.")
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        *UPDATE_CHECK_COMMANDS[pm_family],
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
     try:
-        result = subprocess.run(command, capture_output=True, text=True)
-        output = result.stdout.strip() if result.returncode in [0, 100] else ""
-        if pm_family == "apt" and output.startswith("Listing..."):
-            output = "\n".join(output.split("\n")[1:])
+        stdout, stderr = await process.communicate()
+    finally:
+        # Перевірку скасовано або перервано за тайм-аутом
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    record_subprocess(UPDATE_CHECK_COMMANDS[pm_family], started, process.returncode)
+    if process.returncode not in UPDATE_CHECK_OK_CODES[pm_family]:
+        raise RuntimeError(
+            stderr.decode(errors="replace").strip() or f"код {process.returncode}"
+        )
+    return parse_update_list(pm_family, stdout.decode(errors="replace"))
 
-        if not output:
-            return ["✅ Система оновлена."]
 
-        full_message = f"✅ <b>Доступні оновлення:</b>\n<pre>{output}</pre>"
-        if len(full_message) <= TELEGRAM_MAX_LEN:
-            return [full_message]
-        return [
-            f"✅ Є оновлення (занадто довгий список).\nКількість рядків: {len(output.splitlines())}"
-        ]
-    except Exception as e:
-        return [f"⚠️ Помилка перевірки оновлень: {e}"]
+class UpdateChecker:
+    """Кешований результат перевірки оновлень з фоновим оновленням.
 
+    Перевірка — задача JOBS виду "pkg": одночасні запити приєднуються до
+    перевірки, що вже виконується або чекає в черзі.
+    """
 
-def run_system_upgrade(password: str) -> (bool, str):  # type: ignore
-    pm_family = get_package_manager()
-    upgrade_commands = {
-        "pacman": ["sudo", "-S", "pacman", "-Syu", "--noconfirm"],
-        "dnf": ["sudo", "-S", "dnf", "upgrade", "-y"],
-        "apt": ["sudo", "-S", "bash", "-c", "apt update && apt upgrade -y"],
-    }
-    command = upgrade_commands.get(pm_family)
-    if not command:
-        return (False, "Менеджер не знайдено")
+    TIMEOUT = 600
 
-    try:
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            input=password + "\n",
-            check=True,
-            timeout=900,
+    def __init__(self):
+        self.updates: list[PackageUpdate] | None = None
+        self.checked_at: float | None = None
+        self.error: str | None = None
+        # Зміни відносно попередньої перевірки
+        self.added: list[PackageUpdate] = []
+        self.changed: list[PackageUpdate] = []
+        self.removed: list[PackageUpdate] = []
+
+    def start(self) -> Job:
+        job, _ = JOBS.submit(
+            "pkg", "Перевірка оновлень", self._check, key="updates_check", timeout=self.TIMEOUT
         )
-        return (True, result.stdout[-2000:] or "Оновлення завершено.")
-    except subprocess.CalledProcessError as e:
-        if "try again" in (e.stderr or ""):
-            return (False, "❌ Невірний пароль sudo!")
-        return (False, f"Error:\n{e.stderr}")
-    except Exception as e:
-        return (False, str(e))
+        return job
 
+    async def refresh(self, job: Job | None = None) -> list[PackageUpdate] | None:
+        try:
+            return await (job or self.start()).wait()
+        except (JobCancelled, TimeoutError) as e:
+            self._failed(str(e) if isinstance(e, TimeoutError) else "перевірку скасовано")
+            return self.updates
 
-def reboot_system(password: str) -> (bool, str):  # type: ignore
-    try:
-        subprocess.run(
+    async def _check(self) -> list[PackageUpdate] | None:
+        try:
+            updates = await check_system_updates()
+        except Exception as e:
+            logging.error(f"Помилка перевірки оновлень: {e}")
+            self._failed(str(e))
+            return self.updates
+        self._diff(updates)
+        self.updates = updates
+        self.checked_at = time.time()
+        self.error = None
+        if PREFETCH_UPDATES and updates:
+            UPDATE_PREFETCHER.schedule(updates)
+        return updates
+
+    def _failed(self, error: str):
+        # Різниця стосується попередньої перевірки — інакше run() повідомляв би
+        # про ті самі оновлення після кожної невдалої спроби
+        self.error = error
+        self.added, self.changed, self.removed = [], [], []
+
+    def _diff(self, updates: list[PackageUpdate]):
+        if self.updates is None:
+            self.added, self.changed, self.removed = [], [], []
+            return
+        previous = {u.name: u for u in self.updates}
+        current = {u.name: u for u in updates}
+        self.added = [u for u in updates if u.name not in previous]
+        self.changed = [
+            u
+            for u in updates
+            if u.name in previous and previous[u.name].new_version != u.new_version
+        ]
+        self.removed = [u for u in self.updates if u.name not in current]
+
+    def age(self) -> str:
+        if self.checked_at is None:
+            return "ще не перевірялося"
+        minutes = int((time.time() - self.checked_at) // 60)
+        return "щойно" if minutes == 0 else f"{minutes} хв тому"
+
+    async def run(self, interval: float = UPDATES_CHECK_INTERVAL):
+        """Фонова перевірка; про нові оновлення повідомляє через NOTIFIER"""
+        while True:
+            had_result = self.updates is not None
+            await self.refresh()
+            new_items = self.added + self.changed
+            if had_result and new_items:
+                lines = [format_package_update(u) for u in new_items[:20]]
+                if len(new_items) > 20:
+                    lines.append(f"... і ще {len(new_items) - 20}")
+                NOTIFIER.notify(
+                    f"🔔 <b>Нові оновлення ({len(new_items)}):</b>\n"
+                    f"<pre>{html.escape(chr(10).join(lines))}</pre>"
+                )
+            await asyncio.sleep(interval)
+
+
+def format_package_update(update: PackageUpdate) -> str:
+    line = update.name
+    if update.old_version:
+        line += f" {update.old_version} -> {update.new_version}"
+    else:
+        line += f" {update.new_version}"
+    if update.repository:
+        line += f" [{update.repository}]"
+    return line
+
+
+def render_updates_page(checker: UpdateChecker, page: int) -> tuple[str, int]:
+    """Текст сторінки зі списком оновлень -> (HTML, кількість сторінок)"""
+    if checker.updates is None:
+        return (f"⚠️ Помилка перевірки оновлень: {html.escape(checker.error or '')}", 1)
+    header = f"🕒 Перевірено: {checker.age()}"
+    if checker.error:
+        header += f"\n⚠️ Остання перевірка не вдалася: {html.escape(checker.error)}"
+    if UPDATE_PREFETCHER.status():
+        header += f"\n{UPDATE_PREFETCHER.status()}"
+    if checker.added or checker.changed or checker.removed:
+        header += (
+            f"\n🆕 Нових: {len(checker.added)}, 🔼 нові версії: {len(checker.changed)}, "
+            f"✔️ зникли: {len(checker.removed)}"
+        )
+    if not checker.updates:
+        return (f"✅ Система оновлена.\n{header}", 1)
+
+    pages = (len(checker.updates) + UPDATES_PAGE_SIZE - 1) // UPDATES_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
+    chunk = checker.updates[page * UPDATES_PAGE_SIZE : (page + 1) * UPDATES_PAGE_SIZE]
+    new_names = {u.name for u in checker.added + checker.changed}
+    lines = [
+        ("🆕 " if u.name in new_names else "") + format_package_update(u)
+        for u in chunk
+    ]
+    text = (
+        f"✅ <b>Доступні оновлення: {len(checker.updates)}</b>\n{header}\n"
+        f"<pre>{html.escape(chr(10).join(lines))}</pre>"
+    )
+    if pages > 1:
+        text += f"\nСторінка {page + 1}/{pages}"
+    return (text, pages)
+
+
+UPDATE_CHECKER = UpdateChecker()
+
+
+# --- ФОНОВЕ ЗАВАНТАЖЕННЯ ОНОВЛЕНЬ ---
+PREFETCH_COMMANDS = {
+    # checkupdates (pacman-contrib) синхронізує тимчасову копію бази, тож
+    # /var/lib/pacman/sync лишається як є — без стану часткового оновлення
+    "pacman": ["checkupdates", "-d"],
+    "dnf": ["dnf", "upgrade", "-y", "--downloadonly"],
+    "apt": ["apt-get", "-q", "-y", "--download-only", "upgrade"],
+}
+# checkupdates: 2 — оновлень немає, завантажувати нічого
+PREFETCH_OK_CODES = {"pacman": {0, 2}, "dnf": {0}, "apt": {0}}
+PACKAGE_CACHE_GLOBS = {
+    "pacman": "/var/cache/pacman/pkg/*.pkg.tar*",
+    "dnf": "/var/cache/dnf/*/packages/*.rpm",
+    "apt": "/var/cache/apt/archives/*.deb",
+}
+
+
+def build_prefetch_command(pm_family: str, bandwidth_kb: int = PREFETCH_BANDWIDTH_KB) -> list[str]:
+    """Команда завантаження з обмеженням швидкості та низьким пріоритетом"""
+    command = list(PREFETCH_COMMANDS[pm_family])
+    if bandwidth_kb > 0:
+        # pacman не має власного обмеження (лише через XferCommand у pacman.conf)
+        if pm_family == "apt":
+            command[1:1] = [
+                "-o", f"Acquire::http::Dl-Limit={bandwidth_kb}",
+                "-o", f"Acquire::https::Dl-Limit={bandwidth_kb}",
+            ]
+        elif pm_family == "dnf":
+            command.append(f"--setopt=throttle={bandwidth_kb}k")
+    if os.geteuid() != 0:
+        # -n: без запиту пароля, потрібне правило NOPASSWD саме для цієї команди
+        command = ["sudo", "-n", *command]
+    # nice та ionice успадковуються через sudo
+    return [
+        "nice", "-n", str(PREFETCH_NICE),
+        "ionice", "-c", str(PREFETCH_IONICE_CLASS),
+        *command,
+    ]
+
+
+def package_cache_size(pm_family: str) -> int:
+    total = 0
+    for path in glob.glob(PACKAGE_CACHE_GLOBS[pm_family]):
+        try:
+            total += os.stat(path).st_size
+        except OSError:
+            pass
+    return total
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class UpdatePrefetcher:
+    """Завантажує знайдені оновлення в кеш пакетного менеджера у фоні.
+
+    Стартує, коли CPU не зайнятий і оновлення не виконується, тож
+    "🚀 Оновити" далі лише встановлює пакети з кешу. Це фонова задача JOBS
+    виду "pkg": перевірка чи оновлення від користувача її перериває.
+    """
+
+    IDLE_CPU_PERCENT = 50
+    IDLE_POLL = 30
+    TIMEOUT = 3600
+
+    def __init__(self):
+        # Байти, завантажені наперед з моменту останнього оновлення
+        self.staged_bytes = 0
+        # Набір (пакет, версія), для якого кеш уже заповнено
+        self.staged_for: frozenset = frozenset()
+        self.error: str | None = None
+        self.disabled = False
+        self.process: asyncio.subprocess.Process | None = None
+        self._job: Job | None = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._job is not None and not self._job.done
+
+    def schedule(self, updates: list[PackageUpdate]):
+        if self.disabled or self.is_running:
+            return
+        if frozenset((u.name, u.new_version) for u in updates) == self.staged_for:
+            return
+        self._job, _ = JOBS.submit(
+            "pkg",
+            "Завантаження оновлень наперед",
+            lambda: self.prefetch(updates),
+            key="updates_prefetch",
+            preemptible=True,
+        )
+
+    async def wait_idle(self):
+        while ACTIVE_UPGRADE is not None or (
+            METRICS_HISTORY and METRICS_HISTORY[-1].cpu_percent > self.IDLE_CPU_PERCENT
+        ):
+            await asyncio.sleep(self.IDLE_POLL)
+
+    async def prefetch(self, updates: list[PackageUpdate]):
+        pm_family = get_package_manager()
+        if pm_family not in PREFETCH_COMMANDS:
+            return
+        await self.wait_idle()
+        command = build_prefetch_command(pm_family)
+        before = await run_in_thread(package_cache_size, pm_family)
+        started = time.monotonic()
+        logging.info(f"📦 Завантажую оновлення наперед ({len(updates)} пакетів)...")
+        self.process = process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=self.TIMEOUT)
+        except asyncio.TimeoutError:
+            record_subprocess(command, started, None, timed_out=True)
+            self.error = "тайм-аут"
+            return
+        finally:
+            if process.returncode is None:
+                process.terminate()
+                await process.wait()
+            self.process = None
+        record_subprocess(command, started, process.returncode)
+        if process.returncode not in PREFETCH_OK_CODES[pm_family]:
+            error = stderr.decode(errors="replace").strip()
+            if "password is required" in error:
+                # Без правила NOPASSWD кожна спроба лише засмічує auth-лог
+                self.disabled = True
+                logging.warning(
+                    "⚠️ Фонове завантаження вимкнено: sudo просить пароль. "
+                    f"Додайте правило NOPASSWD для: {shlex.join(command[command.index('sudo') + 2:])}"
+                )
+            self.error = error[-300:] or f"код {process.returncode}"
+            logging.error(f"Помилка фонового завантаження: {self.error}")
+            return
+        after = await run_in_thread(package_cache_size, pm_family)
+        self.staged_bytes += max(0, after - before)
+        self.staged_for = frozenset((u.name, u.new_version) for u in updates)
+        self.error = None
+        logging.info(f"📦 Завантажено наперед: {format_bytes(self.staged_bytes)}")
+
+    async def stop(self):
+        """Зупиняє завантаження (перед оновленням, щоб не чекати на lock)"""
+        if self.is_running:
+            JOBS.cancel(self._job.id)
+            try:
+                await self._job.wait()
+            except Exception:
+                pass
+
+    def upgraded(self):
+        self.staged_bytes = 0
+        self.staged_for = frozenset()
+
+    def status(self) -> str:
+        if self.is_running:
+            return "📦 Завантаження оновлень у фоні..."
+        if self.error:
+            return f"📦 Фонове завантаження не вдалося: {html.escape(self.error)}"
+        if self.staged_bytes:
+            return f"📦 Завантажено наперед: {format_bytes(self.staged_bytes)}"
+        return ""
+
+
+UPDATE_PREFETCHER = UpdatePrefetcher()
+
+
+UPGRADE_COMMANDS = {
+    "pacman": ["sudo", "-p", "", "-S", "pacman", "-Syu", "--noconfirm"],
+    "dnf": ["sudo", "-p", "", "-S", "dnf", "upgrade", "-y"],
+    # APT::Status-Fd=1 дає машинний прогрес: pmstatus:<пакет>:<відсоток>:<опис>
+    "apt": [
+        "sudo",
+        "-p",
+        "",
+        "-S",
+        "bash",
+        "-c",
+        "apt-get update && apt-get -y -o APT::Status-Fd=1 upgrade",
+    ],
+}
+
+# (3/15) upgrading linux ...
+REGEX_PACMAN_PROGRESS = re.compile(
+    r"^\((\d+)/(\d+)\)\s+(?:upgrading|installing|reinstalling|downgrading|removing)\s+(\S+)"
+)
+#   Upgrading        : bash-5.2.26-3.fc40.x86_64        5/20
+REGEX_DNF_PROGRESS = re.compile(
+    r"^\s*(?:Upgrading|Installing|Reinstalling|Downgrading)\s*:\s*(\S+)\s+(\d+)/(\d+)\s*$"
+)
+# pmstatus:bash:42.8571:Unpacking bash (amd64)
+REGEX_APT_PROGRESS = re.compile(r"^pmstatus:([^:]+):([\d.]+):")
+
+
+class UpgradeProgress:
+    """Стан запущеного оновлення: прогрес, поточний пакет та стиснутий лог"""
+
+    def __init__(self, pm_family: str | None):
+        self.pm_family = pm_family
+        self.percent: float | None = None
+        self.package = ""
+        self.started = time.monotonic()
+        self.finished: float | None = None
+        self.process: asyncio.subprocess.Process | None = None
+        self.cancelled = False
+        self.tail: deque[str] = deque(maxlen=30)
+        self.log_size = 0
+        self._log = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self._log_parts: list[bytes] = []
+
+    def feed(self, line: str):
+        """Обробляє один рядок виводу пакетного менеджера"""
+        self.log_size += len(line) + 1
+        self._log_parts.append(self._log.compress(line.encode() + b"\n"))
+        # Прогрес-бари можуть перемальовуватися через \r — беремо останній стан
+        line = line.rsplit("\r", 1)[-1].rstrip()
+        if not line:
+            return
+        self.tail.append(line)
+
+        if self.pm_family == "pacman":
+            match = REGEX_PACMAN_PROGRESS.match(line)
+            if match:
+                done, total, self.package = match.groups()
+                self.percent = int(done) / int(total) * 100
+        elif self.pm_family == "dnf":
+            match = REGEX_DNF_PROGRESS.match(line)
+            if match:
+                self.package, done, total = match.groups()
+                self.percent = int(done) / int(total) * 100
+        elif self.pm_family == "apt":
+            match = REGEX_APT_PROGRESS.match(line)
+            if match:
+                self.package = match.group(1)
+                self.percent = float(match.group(2))
+
+    def cancel(self):
+        if self.process and self.process.returncode is None:
+            self.cancelled = True
+            # sudo передає SIGTERM дочірньому процесу
+            self.process.terminate()
+
+    def elapsed(self) -> str:
+        end = self.finished or time.monotonic()
+        return str(datetime.timedelta(seconds=int(end - self.started)))
+
+    def render(self) -> str:
+        if self.percent is None:
+            bar = "підготовка..."
+        else:
+            filled = int(self.percent // 10)
+            bar = "▓" * filled + "░" * (10 - filled) + f" {self.percent:.0f}%"
+        msg = f"⏳ <b>Оновлення системи</b>\n{bar}\n⏱ {self.elapsed()}"
+        if self.package:
+            msg += f"\n📦 <code>{self.package}</code>"
+        return msg
+
+    def log_bytes(self) -> bytes:
+        """Повний лог (gzip); після виклику лог закривається"""
+        self._log_parts.append(self._log.flush())
+        return b"".join(self._log_parts)
+
+
+async def run_system_upgrade(password: str, progress: UpgradeProgress) -> tuple[bool, str]:
+    """Запускає оновлення і передає вивід у progress рядок за рядком"""
+    command = UPGRADE_COMMANDS.get(progress.pm_family)
+    if not command:
+        return (False, "Менеджер не знайдено")
+
+    started = time.monotonic()
+    try:
+        progress.process = process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        process.stdin.write(password.encode() + b"\n")
+        await process.stdin.drain()
+        process.stdin.close()
+
+        async def pump():
+            while line := await process.stdout.readline():
+                progress.feed(line.decode("utf-8", errors="replace").rstrip("\n"))
+            await process.wait()
+
+        try:
+            await asyncio.wait_for(pump(), timeout=UPGRADE_TIMEOUT)
+        except asyncio.TimeoutError:
+            progress.cancel()
+            await process.wait()
+            record_subprocess(command, started, None, timed_out=True)
+            return (False, "❌ Тайм-аут оновлення.")
+    except Exception as e:
+        return (False, str(e))
+    finally:
+        progress.finished = time.monotonic()
+    record_subprocess(command, started, process.returncode)
+
+    output = "\n".join(progress.tail)
+    if progress.cancelled:
+        return (False, "⛔ Оновлення скасовано.")
+    if process.returncode != 0:
+        if "try again" in output or "incorrect password" in output:
+            return (False, "❌ Невірний пароль sudo!")
+        return (False, f"Error:\n{output[-2000:]}")
+    return (True, output[-2000:] or "Оновлення завершено.")
+
+
+# Оновлення, що виконується зараз (для кнопки скасування)
+ACTIVE_UPGRADE: UpgradeProgress | None = None
+
+
+def reboot_system(password: str) -> (bool, str):  # type: ignore
+    try:
+        run_command(
             ["sudo", "-S", "reboot"],
             input=password + "\n",
             check=True,
@@ -277,7 +3138,7 @@ def manage_ssh_service(password: str, action: str) -> tuple[bool, str]:
             cmd = ["sudo", "-p", "", "-S", "pkill", "-KILL", "-f", "sshd"]
 
             # Запускаємо без check=True, щоб обробити коди виходу вручну
-            res = subprocess.run(
+            res = run_command(
                 cmd, input=password + "\n", text=True, capture_output=True
             )
 
@@ -295,7 +3156,7 @@ def manage_ssh_service(password: str, action: str) -> tuple[bool, str]:
         else:
             # start / stop (теж додаємо -p "", щоб прибрати зайвий текст)
             cmd = ["sudo", "-p", "", "-S", "systemctl", action, "sshd"]
-            subprocess.run(
+            run_command(
                 cmd,
                 input=password + "\n",
                 check=True,
@@ -307,7 +3168,7 @@ def manage_ssh_service(password: str, action: str) -> tuple[bool, str]:
 
         # Перевіряємо статус служби
         status_cmd = ["systemctl", "is-active", "sshd"]
-        status_res = subprocess.run(status_cmd, capture_output=True, text=True)
+        status_res = run_command(status_cmd, capture_output=True, text=True)
         current_status = status_res.stdout.strip()
 
         return (True, f"{output_msg}\nСтатус служби sshd: {current_status}")
@@ -322,262 +3183,2878 @@ def manage_ssh_service(password: str, action: str) -> tuple[bool, str]:
         return (False, str(e))
 
 
-def get_system_logs(critical_only: bool = False, boot_offset: int = 0) -> str | None:
-    boot_desc = "current" if boot_offset == 0 else "previous"
-    type_desc = "critical" if critical_only else "all"
-    filename = f"{type_desc}_logs_{boot_desc}_boot.txt"
+# Дії з процесом: підпис для підтвердження та команда (PID додається в кінці)
+PROCESS_ACTIONS = {
+    "term": ("ЗАВЕРШИТИ (SIGTERM)", ["kill", "-TERM"]),
+    "kill": ("ПРИМУСОВО ВБИТИ (SIGKILL)", ["kill", "-KILL"]),
+    "nice0": ("поставити nice 0", ["renice", "-n", "0", "-p"]),
+    "nice10": ("поставити nice 10", ["renice", "-n", "10", "-p"]),
+    "nice19": ("поставити nice 19", ["renice", "-n", "19", "-p"]),
+}
+
+
+def manage_process(password: str, pid: int, started: int, action: str) -> tuple[bool, str]:
+    """
+    action — ключ PROCESS_ACTIONS. started — create_time процесу на момент
+    вибору: якщо PID тим часом зайняв інший процес, нічого не робимо.
+    """
+    if action not in PROCESS_ACTIONS:
+        return (False, "Невідома команда.")
+    try:
+        proc = psutil.Process(pid)
+        if int(proc.create_time()) != started:
+            raise psutil.NoSuchProcess(pid)
+        name = proc.name()
+    except psutil.NoSuchProcess:
+        return (False, f"Процес {pid} вже завершився.")
+
+    label, command = PROCESS_ACTIONS[action]
+    cmd = ["sudo", "-p", "", "-S", *command, str(pid)]
+    try:
+        run_command(
+            cmd,
+            input=password + "\n",
+            check=True,
+            timeout=20,
+            text=True,
+            capture_output=True,
+        )
+    except subprocess.CalledProcessError as e:
+        err_text = e.stderr or ""
+        if "try again" in err_text or "incorrect password" in err_text:
+            return (False, "❌ Невірний пароль sudo!")
+        return (False, f"Помилка виконання:\n{err_text}")
+    except Exception as e:
+        return (False, str(e))
+    return (True, f"{name} (PID {pid}): {label.lower()} — виконано.")
+
+
+class JournalExport:
+    """Потоковий експорт journalctl через gzip-компресор частинами.
+
+    Текст журналу ніде не зберігається повністю: кожна частина стискається
+    "на льоту" і одразу віддається у завантаження.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    # Запас під дані, що залишаються в компресорі до flush()
+    FLUSH_MARGIN = 1024 * 1024
+
+    def __init__(self, command: list[str], part_limit: int):
+        self.command = command
+        self.part_limit = part_limit
+        self.process: asyncio.subprocess.Process | None = None
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.parts = 0
+        self.eof = False
+        self.started = time.monotonic()
+        self._pending = b""
+
+    async def start(self) -> bool:
+        """Запускає journalctl. Повертає False, якщо журнал порожній."""
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        self._pending = await self.process.stdout.read(self.CHUNK_SIZE)
+        if not self._pending:
+            self.eof = True
+            return False
+        return True
+
+    async def _read_chunk(self) -> bytes:
+        if self._pending:
+            chunk, self._pending = self._pending, b""
+            return chunk
+        return await self.process.stdout.read(self.CHUNK_SIZE)
+
+    async def read_part(self):
+        """Віддає одну gzip-частину, не більшу за part_limit"""
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = gzip-обгортка
+        part_size = 0
+        while part_size < self.part_limit - self.FLUSH_MARGIN:
+            chunk = await self._read_chunk()
+            if not chunk:
+                self.eof = True
+                break
+            self.raw_bytes += len(chunk)
+            out = compressor.compress(chunk)
+            if out:
+                part_size += len(out)
+                yield out
+        tail = compressor.flush()
+        part_size += len(tail)
+        self.compressed_bytes += part_size
+        self.parts += 1
+        yield tail
+
+    async def close(self):
+        if self.process and self.process.returncode is None:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass
+            await self.process.wait()
+        if self.process:
+            record_subprocess(self.command, self.started, self.process.returncode)
+
+    def summary(self) -> str:
+        raw_mb = self.raw_bytes / (1024**2)
+        gz_mb = self.compressed_bytes / (1024**2)
+        ratio = self.raw_bytes / self.compressed_bytes if self.compressed_bytes else 0
+        elapsed = time.monotonic() - self.started
+        return (
+            f"🗜 {raw_mb:.1f} MB → {gz_mb:.1f} MB (×{ratio:.1f}), "
+            f"частин: {self.parts}, час: {elapsed:.1f}с"
+        )
+
+
+class JournalPartFile(InputFile):
+    """Одна частина JournalExport як файл для завантаження в Telegram"""
+
+    def __init__(self, export: JournalExport, filename: str):
+        super().__init__(filename=filename)
+        self.export = export
+
+    async def read(self, bot: Bot):
+        async for chunk in self.export.read_part():
+            yield chunk
+
+
+async def get_system_logs(
+    critical_only: bool = False,
+    boot_offset: int = 0,
+    part_limit: int = LOGS_PART_SIZE_MB * 1024 * 1024,
+) -> JournalExport | None:
     command = ["journalctl", "--no-pager", "-b", str(boot_offset)]
     if critical_only:
         command.extend(["-p", "err"])
+    export = JournalExport(command, part_limit)
     try:
-        with open(filename, "w") as f:
-            subprocess.run(command, stdout=f, text=True, check=True)
-        return filename
-    except Exception:
-        return None
+        if await export.start():
+            return export
+    except Exception as e:
+        logging.error(f"Помилка експорту логів: {e}")
+    await export.close()
+    return None
 
 
-# --- ДЕТАЛІ ПРИСТРОЮ ---
-async def get_device_hostname(ip: str) -> str:
-    """Спроба дізнатися ім'я хоста (reverse DNS)"""
+# --- ПОШУК У ЖУРНАЛІ ---
+JOURNAL_SEARCH_USAGE = (
+    "🔎 <b>Пошук у журналі:</b>\n"
+    "<code>/journal [-u служба] [-p err] [-b [-1]] [--since 1h] [--until ...] "
+    "[-g regex] [ПОЛЕ=значення] [текст]</code>\n\n"
+    "Приклади:\n"
+    "<code>/journal -u nginx -p warning --since today</code>\n"
+    "<code>/journal -g \"oom|killed process\" -b -1</code>\n"
+    "<code>/journal SYSLOG_IDENTIFIER=sudo incorrect password</code>"
+)
+# Від найвищого (0) до найнижчого (7), як у journald
+JOURNAL_PRIORITIES = (
+    "emerg", "alert", "crit", "err", "warning", "notice", "info", "debug",
+)
+JOURNAL_PRIORITY_ICONS = ["🆘", "🆘", "🔴", "🔴", "🟠", "🔵", "⚪", "⚫"]
+REGEX_JOURNAL_FIELD_MATCH = re.compile(r"^[A-Z0-9_]+=")
+# Поля, які journalctl віддає у JSON (решта лише роздуває вивід)
+JOURNAL_SEARCH_FIELDS = "MESSAGE,PRIORITY,SYSLOG_IDENTIFIER,_SYSTEMD_UNIT,_PID"
+JOURNAL_SEARCH_TIMEOUT = 30
+JOURNAL_SEARCH_MESSAGE_LIMIT = 300
+
+
+def parse_journal_query(text: str) -> list[str]:
+    """Аргументи команди /journal -> фільтри journalctl. ValueError при помилці.
+
+    Усі фільтри виконує сам journald (поля, --since/--until, --grep),
+    значення передаються як `--опція=значення`, тож не можуть стати опцією.
+    """
     try:
-        # Запускаємо в окремому потоці, бо gethostbyaddr блокуюча
-        host_info = await asyncio.to_thread(socket.gethostbyaddr, ip)
-        return host_info[0]  # Повертаємо ім'я
-    except Exception:
-        return "Невідомо"
+        tokens = shlex.split(text)
+    except ValueError as e:
+        raise ValueError(f"Помилка в лапках: {e}")
+    filters, words = [], []
+    options = {
+        "-u": "--unit", "--unit": "--unit",
+        "-p": "--priority", "--priority": "--priority",
+        "-S": "--since", "--since": "--since",
+        "-U": "--until", "--until": "--until",
+        "-g": "--grep", "--grep": "--grep",
+    }
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in options:
+            if i + 1 >= len(tokens):
+                raise ValueError(f"Опція {token} потребує значення")
+            option, value = options[token], tokens[i + 1]
+            if option == "--priority" and not (
+                value in JOURNAL_PRIORITIES or re.fullmatch(r"[0-7](\.\.[0-7])?", value)
+            ):
+                raise ValueError(f"Невідомий пріоритет: {value}")
+            if option in ("--since", "--until") and re.fullmatch(r"\d+[smhdw]", value):
+                # Скорочення "1h" -> "-1h" (відносний час journalctl)
+                value = "-" + value
+            filters.append(f"{option}={value}")
+            i += 2
+        elif token == "-b":
+            # -b [зміщення]: поточне або попереднє завантаження
+            if i + 1 < len(tokens) and re.fullmatch(r"-?\d+", tokens[i + 1]):
+                filters.append(f"--boot={tokens[i + 1]}")
+                i += 2
+            else:
+                filters.append("--boot=0")
+                i += 1
+        elif token.startswith("-"):
+            raise ValueError(f"Невідома опція: {token}")
+        elif REGEX_JOURNAL_FIELD_MATCH.match(token):
+            filters.append(token)
+            i += 1
+        else:
+            words.append(token)
+            i += 1
+    if words:
+        if any(f.startswith("--grep=") for f in filters):
+            raise ValueError("Вкажіть або текст, або -g regex")
+        filters.append("--grep=" + re.escape(" ".join(words)))
+    if not filters:
+        raise ValueError("Потрібен хоча б один фільтр")
+    return filters
+
+
+class JournalSearch:
+    """Пошук з посторінковою видачею (від нових записів до старих).
+
+    Для кожної сторінки запам'ятовується курсор останнього показаного
+    запису, тож наступна сторінка — це `--after-cursor`: journald одразу
+    переходить до потрібного місця, без повторного сканування.
+    """
+
+    def __init__(self, filters: list[str], page_size: int = JOURNAL_SEARCH_PAGE_SIZE):
+        self.filters = filters
+        self.page_size = page_size
+        self.has_since = any(f.startswith("--since=") for f in filters)
+        # page_cursors[N] — (курсор, час у мкс, курсори записів з тим самим
+        # часом) останнього запису попередньої сторінки; None для першої
+        self.page_cursors: list[tuple[str, int, frozenset] | None] = [None]
+
+    def command(self, page: int) -> list[str]:
+        filters, lines = list(self.filters), self.page_size + 1
+        anchor = self.page_cursors[page]
+        if anchor:
+            cursor, usec, ties = anchor
+            if self.has_since:
+                # journalctl не приймає --since разом з --after-cursor:
+                # продовжуємо з часу останнього запису (--until включний),
+                # а вже показані записи з тим самим часом відкидаємо у fetch()
+                filters = [f for f in filters if not f.startswith("--until=")]
+                filters.append(f"--until=@{usec // 1_000_000}.{usec % 1_000_000:06d}")
+                lines += len(ties)
+            else:
+                filters.append(f"--after-cursor={cursor}")
+        return [
+            "journalctl", "--no-pager", "--quiet", "--reverse",
+            "--output=json", f"--output-fields={JOURNAL_SEARCH_FIELDS}",
+            f"--lines={lines}",
+            *filters,
+        ]
+
+    async def fetch(self, page: int) -> tuple[list[dict], bool]:
+        """Записи сторінки та ознака, що є наступна. RuntimeError при помилці."""
+        command = self.command(page)
+        started = time.monotonic()
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(), timeout=JOURNAL_SEARCH_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            record_subprocess(command, started, None, timed_out=True)
+            raise RuntimeError("тайм-аут пошуку, звузьте фільтри")
+        record_subprocess(command, started, process.returncode)
+        anchor = self.page_cursors[page]
+        seen = anchor[2] if anchor and self.has_since else frozenset()
+        entries = []
+        for line in stdout.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("__CURSOR") not in seen:
+                entries.append(entry)
+        if process.returncode and not entries:
+            # journalctl повертає 1, якщо --grep нічого не знайшов
+            error = stderr.decode(errors="replace").strip()
+            if error:
+                raise RuntimeError(error[-500:])
+        return entries[: self.page_size], len(entries) > self.page_size
+
+    def remember_page(self, page: int, shown: list[dict]):
+        """Запам'ятовує, де закінчилась показана сторінка"""
+        if page + 1 != len(self.page_cursors):
+            return
+        usec = int(shown[-1].get("__REALTIME_TIMESTAMP", 0))
+        ties = frozenset(
+            e.get("__CURSOR") for e in shown if int(e.get("__REALTIME_TIMESTAMP", 0)) == usec
+        )
+        self.page_cursors.append((shown[-1].get("__CURSOR"), usec, ties))
+
+
+def journal_entry_message(entry: dict) -> str:
+    message = entry.get("MESSAGE") or ""
+    if isinstance(message, list):
+        # Повідомлення з недрукованими байтами journald віддає масивом чисел
+        message = bytes(message).decode("utf-8", errors="replace")
+    return message
 
 
-async def get_local_mac(ip: str) -> str:
-    """Шукаємо MAC адресу в ARP таблиці (тільки для локальних)"""
+def format_journal_entry(entry: dict) -> str:
+    message = journal_entry_message(entry)
+    if len(message) > JOURNAL_SEARCH_MESSAGE_LIMIT:
+        message = message[:JOURNAL_SEARCH_MESSAGE_LIMIT] + "…"
+    ts = int(entry.get("__REALTIME_TIMESTAMP", 0)) / 1_000_000
+    when = datetime.datetime.fromtimestamp(ts).strftime("%d.%m %H:%M:%S")
     try:
-        # Читаємо /proc/net/arp (стандарт Linux)
-        with open("/proc/net/arp", "r") as f:
-            for line in f:
-                parts = line.split()
-                if len(parts) >= 4 and parts[0] == ip:
-                    return parts[3]  # MAC адреса
-    except Exception:
+        icon = JOURNAL_PRIORITY_ICONS[int(entry.get("PRIORITY", 6))]
+    except (ValueError, IndexError):
+        icon = "⚪"
+    source = entry.get("SYSLOG_IDENTIFIER") or entry.get("_SYSTEMD_UNIT") or "?"
+    return (
+        f"{icon} <code>{when}</code> <b>{html.escape(source)}</b>: "
+        f"{html.escape(message)}"
+    )
+
+
+def render_journal_page(
+    search: JournalSearch, page: int, entries: list[dict], has_more: bool,
+    limit: int = 3900,
+) -> tuple[str, bool]:
+    """Текст сторінки в межах ліміту Telegram та ознака наступної сторінки.
+
+    Якщо всі записи не вмістились, сторінка закінчується на останньому
+    показаному, а решта переходить на наступну.
+    """
+    header = f"🔎 <b>Журнал</b>, сторінка {page + 1}\n"
+    lines, shown, size = [], [], len(header)
+    for entry in entries:
+        line = format_journal_entry(entry)
+        if lines and size + len(line) + 1 > limit:
+            has_more = True
+            break
+        lines.append(line)
+        shown.append(entry)
+        size += len(line) + 1
+    if not lines:
+        return header + "Нічого не знайдено.", False
+    if has_more:
+        search.remember_page(page, shown)
+    return header + "\n".join(lines), has_more
+
+
+# Активні пошуки: id -> JournalSearch (курсори не вміщаються в callback_data)
+JOURNAL_SEARCHES: OrderedDict[int, JournalSearch] = OrderedDict()
+JOURNAL_SEARCHES_LIMIT = 32
+_journal_search_ids = itertools.count(1)
+
+
+def register_journal_search(search: JournalSearch) -> int:
+    search_id = next(_journal_search_ids)
+    JOURNAL_SEARCHES[search_id] = search
+    while len(JOURNAL_SEARCHES) > JOURNAL_SEARCHES_LIMIT:
+        JOURNAL_SEARCHES.popitem(last=False)
+    return search_id
+
+
+# --- ЖИВИЙ ЖУРНАЛ ---
+LIVE_TAIL_USAGE = (
+    "📡 <b>Живий журнал:</b>\n"
+    "<code>/tail [-u служба] [-p err] [-g regex] [ПОЛЕ=значення] [текст]</code>\n\n"
+    "Нові записи з'являються в одному повідомленні, яке оновлюється не частіше "
+    f"ніж раз на {LIVE_TAIL_EDIT_INTERVAL:g}с. Зупинка — кнопкою або через "
+    f"{LIVE_TAIL_TIMEOUT / 60:g} хв. Без фільтрів показується весь журнал.\n\n"
+    "Приклади:\n"
+    "<code>/tail -u nginx</code>\n"
+    "<code>/tail -p warning</code>\n"
+    "<code>/tail _COMM=sshd -g \"invalid|failed\"</code>"
+)
+# Telegram пропускає приблизно одне повідомлення на секунду в один чат,
+# тож спільний інтервал редагування росте з кількістю хвостів
+LIVE_TAIL_CHAT_RATE = 1.0
+LIVE_TAIL_LINE_LIMIT = 1024 * 1024
+# Поля, які потрібні фільтрам і format_journal_entry (UNIT — повідомлення
+# самого systemd про службу, як у `journalctl -u`)
+LIVE_TAIL_FIELDS = frozenset(JOURNAL_SEARCH_FIELDS.split(",")) | {"UNIT"}
+
+
+def parse_journal_priority(value: str) -> tuple[int, int]:
+    """"err", "3" або "0..4" -> діапазон числових пріоритетів (включно)"""
+    def level(name: str) -> int:
+        return JOURNAL_PRIORITIES.index(name) if name in JOURNAL_PRIORITIES else int(name)
+
+    low, _, high = value.partition("..")
+    if not high:
+        return 0, level(low)
+    return level(low), level(high)
+
+
+class TailFilter:
+    """Фільтри /tail, які перевіряються в процесі бота.
+
+    Синтаксис той самий, що в /journal (parse_journal_query), і семантика
+    journalctl: кілька -u або однакових полів — "або", різні умови — "і".
+    Часові фільтри та -b для живого режиму не мають сенсу.
+    """
+
+    def __init__(self, filters: list[str]):
+        self.units: set[str] = set()
+        self.unit_globs: list[str] = []
+        self.priority: tuple[int, int] | None = None
+        self.grep: re.Pattern | None = None
+        self.fields: dict[str, set[str]] = {}
+        for item in filters:
+            option, _, value = item.partition("=")
+            if option == "--unit":
+                if not re.search(r"[.*?\[]", value):
+                    value += ".service"
+                if re.search(r"[*?\[]", value):
+                    self.unit_globs.append(value)
+                else:
+                    self.units.add(value)
+            elif option == "--priority":
+                self.priority = parse_journal_priority(value)
+            elif option == "--grep":
+                # Як у journalctl: без великих літер пошук нечутливий до регістру
+                flags = 0 if value != value.lower() else re.IGNORECASE
+                try:
+                    self.grep = re.compile(value, flags)
+                except re.error as e:
+                    raise ValueError(f"Помилка в regex: {e}")
+            elif option.startswith("-"):
+                raise ValueError(f"Опція {option} недоступна в живому режимі")
+            else:
+                self.fields.setdefault(option, set()).add(value)
+
+    def match(self, entry: dict) -> bool:
+        if self.units or self.unit_globs:
+            units = (entry.get("_SYSTEMD_UNIT"), entry.get("UNIT"))
+            if not any(
+                unit in self.units
+                or any(fnmatch.fnmatchcase(unit, glob) for glob in self.unit_globs)
+                for unit in units if unit
+            ):
+                return False
+        if self.priority:
+            try:
+                priority = int(entry.get("PRIORITY", 6))
+            except ValueError:
+                return False
+            if not self.priority[0] <= priority <= self.priority[1]:
+                return False
+        for field, values in self.fields.items():
+            if entry.get(field) not in values:
+                return False
+        if self.grep and not self.grep.search(journal_entry_message(entry)):
+            return False
+        return True
+
+
+class JournalFollower:
+    """Один `journalctl -f` на всі живі хвости.
+
+    Кожен запис розбирається один раз і роздається підписникам, чиї
+    фільтри він проходить. Процес працює, лише поки є підписники. Якщо
+    новому хвосту потрібне поле, якого немає в --output-fields, journalctl
+    перезапускається з останнього курсора — без пропусків і дублікатів.
+    """
+
+    RESTART_DELAY = 5
+
+    def __init__(self):
+        self.subscribers: set = set()
+        self.fields = set(LIVE_TAIL_FIELDS)
+        self.cursor: str | None = None
+        self.process: asyncio.subprocess.Process | None = None
+        self.task: asyncio.Task | None = None
+        self.entries = 0
+        self.restarts = 0
+        self._reload = False
+
+    def subscribe(self, tail: "LiveTail"):
+        self.subscribers.add(tail)
+        missing = tail.filter.fields.keys() - self.fields
+        if missing:
+            self.fields |= missing
+            if self.process and self.process.returncode is None:
+                self._reload = True
+                self.process.kill()
+        if self.task is None:
+            self.task = spawn(self.run())
+
+    def unsubscribe(self, tail: "LiveTail"):
+        self.subscribers.discard(tail)
+        if not self.subscribers and self.task:
+            self.task.cancel()
+            self.task = None
+            self.cursor = None
+            self.fields = set(LIVE_TAIL_FIELDS)
+
+    def command(self) -> list[str]:
+        cmd = [
+            "journalctl", "--follow", "--quiet", "--output=json",
+            f"--output-fields={','.join(sorted(self.fields))}",
+        ]
+        if self.cursor:
+            cmd += ["--no-tail", f"--after-cursor={self.cursor}"]
+        else:
+            cmd += ["--lines=0"]
+        return cmd
+
+    async def run(self):
+        while self.subscribers:
+            self._reload = False
+            try:
+                await self.read()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"❌ Живий журнал: {e}")
+            if self._reload:
+                continue
+            self.restarts += 1
+            logging.warning(f"⚠️ journalctl (живий журнал) завершився, перезапуск через {self.RESTART_DELAY}с")
+            await asyncio.sleep(self.RESTART_DELAY)
+
+    async def read(self):
+        self.process = process = await asyncio.create_subprocess_exec(
+            *self.command(),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=LIVE_TAIL_LINE_LIMIT,
+        )
+        try:
+            while True:
+                try:
+                    line = await process.stdout.readline()
+                except ValueError:
+                    # Запис довший за ліміт буфера — пропускаємо
+                    continue
+                if not line:
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.cursor = entry.get("__CURSOR") or self.cursor
+                self.entries += 1
+                for tail in tuple(self.subscribers):
+                    if tail.filter.match(entry):
+                        tail.push(entry)
+        finally:
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+
+    def stats(self) -> str:
+        state = "працює" if self.task else "зупинено"
+        return (
+            f"{state}, хвостів {len(self.subscribers)}, записів {self.entries}, "
+            f"перезапусків {self.restarts}"
+        )
+
+
+class LiveTail:
+    """Останні рядки журналу в одному повідомленні з кнопкою "Стоп" """
+
+    def __init__(
+        self, tail_id: int, tail_filter: TailFilter, query: str, message: Message,
+        lines: int = LIVE_TAIL_LINES, timeout: float = LIVE_TAIL_TIMEOUT,
+    ):
+        self.id = tail_id
+        self.filter = tail_filter
+        self.query = query
+        self.message = message
+        self.lines: deque[str] = deque(maxlen=lines)
+        self.matched = 0
+        self.deadline = time.time() + timeout
+        self.stop_reason = ""
+        self.changed = asyncio.Event()
+        self.stopped = asyncio.Event()
+
+    def push(self, entry: dict):
+        self.lines.append(format_journal_entry(entry))
+        self.matched += 1
+        self.changed.set()
+
+    def stop(self, reason: str):
+        if not self.stop_reason:
+            self.stop_reason = reason
+            self.changed.set()
+            self.stopped.set()
+
+    def render(self, limit: int = 3900) -> str:
+        query = html.escape(self.query) if self.query else "весь журнал"
+        if self.stop_reason:
+            status = f"⏹ {self.stop_reason}"
+        else:
+            status = f"🟢 до {datetime.datetime.fromtimestamp(self.deadline):%H:%M:%S}"
+        header = (
+            f"📡 <b>Живий журнал:</b> <code>{query}</code>\n"
+            f"{status}, записів: {self.matched}\n\n"
+        )
+        # Найновіші рядки важливіші: відкидаємо старі, поки текст не влізе
+        body, size = [], len(header)
+        for line in reversed(self.lines):
+            if size + len(line) + 1 > limit:
+                break
+            body.append(line)
+            size += len(line) + 1
+        if not body:
+            return header + "<i>Очікую нових записів...</i>"
+        return header + "\n".join(reversed(body))
+
+    def keyboard(self):
+        builder = InlineKeyboardBuilder()
+        builder.button(text="⏹ Стоп", callback_data=f"tail_stop:{self.id}")
+        return builder.as_markup()
+
+    async def edit(self, text: str, final: bool = False) -> bool:
+        try:
+            await self.message.edit_text(
+                text, parse_mode="HTML", reply_markup=None if final else self.keyboard()
+            )
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            return False
+        except Exception as e:
+            logging.debug("Живий журнал: редагування не вдалося: %s", e)
+        return True
+
+    async def run(self):
+        """Редагує повідомлення при нових рядках, не частіше за спільний ліміт"""
+        LIVE_TAILS[self.id] = self
+        FOLLOWER.subscribe(self)
+        last_text = ""
+        try:
+            while not self.stop_reason:
+                remaining = self.deadline - time.time()
+                if remaining <= 0:
+                    self.stop("Зупинено за тайм-аутом")
+                    break
+                try:
+                    await asyncio.wait_for(self.changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    continue
+                self.changed.clear()
+                if self.stop_reason:
+                    break
+                text = self.render()
+                if text != last_text:
+                    if await self.edit(text):
+                        last_text = text
+                    else:
+                        self.changed.set()
+                # Нові рядки за цей час накопичуються і підуть одним редагуванням
+                interval = max(LIVE_TAIL_EDIT_INTERVAL, len(LIVE_TAILS) * LIVE_TAIL_CHAT_RATE)
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            FOLLOWER.unsubscribe(self)
+            LIVE_TAILS.pop(self.id, None)
+        await self.edit(self.render(), final=True)
+
+
+FOLLOWER = JournalFollower()
+LIVE_TAILS: dict[int, LiveTail] = {}
+_live_tail_ids = itertools.count(1)
+
+
+def collect_live_tail_metrics() -> list[str]:
+    lines = metric_lines(
+        "lmb_live_tails", "Активні живі хвости журналу", [({}, len(LIVE_TAILS))]
+    )
+    lines += metric_lines(
+        "lmb_live_tail_entries_total", "Записи, прочитані спільним journalctl -f",
+        [({}, FOLLOWER.entries)], "counter",
+    )
+    return lines
+
+
+METRICS_COLLECTORS.append(collect_live_tail_metrics)
+
+
+# --- ДЕТАЛІ ПРИСТРОЮ ---
+class AsyncTTLCache:
+    """Обмежений LRU-кеш з TTL для async-запитів.
+
+    Невдалі результати (None) кешуються на negative_ttl. Одночасні запити
+    одного ключа чекають на один спільний запит.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # key -> (час закінчення, значення); час — wall clock для знімків
+        self._data: OrderedDict = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _store(self, key, value, expires: float):
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def get(self, key, loader):
+        entry = self._data.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self.hits += 1
+                self._data.move_to_end(key)
+                return entry[1]
+            del self._data[key]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            try:
+                value = await loader(key)
+            except Exception:
+                value = None
+            ttl = self.ttl if value is not None else self.negative_ttl
+            self._store(key, value, time.time() + ttl)
+            future.set_result(value)
+            return value
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._inflight[key]
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        return (
+            f"{len(self._data)}/{self.maxsize} записів, hit {self.hits}, "
+            f"miss {self.misses}, спільних {self.coalesced} ({rate:.0f}% hit)"
+        )
+
+    def dump(self) -> dict:
+        now = time.time()
+        return {k: [exp, v] for k, (exp, v) in self._data.items() if exp > now}
+
+    def load(self, data: dict):
+        now = time.time()
+        for key, (expires, value) in data.items():
+            if expires > now:
+                self._store(key, value, expires)
+
+
+HOSTNAME_CACHE = AsyncTTLCache(IP_CACHE_SIZE, IP_CACHE_TTL, IP_CACHE_NEGATIVE_TTL)
+GEOIP_CACHE = AsyncTTLCache(IP_CACHE_SIZE, IP_CACHE_TTL, IP_CACHE_NEGATIVE_TTL)
+
+# Спільна HTTP-сесія для зовнішніх API (створюється при першому запиті)
+_http_session: aiohttp.ClientSession | None = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession()
+    return _http_session
+
+
+async def close_http_session():
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+
+
+def load_ip_cache():
+    """Відновлює кеш IP зі знімка на диску"""
+    if not IP_CACHE_FILE:
+        return
+    try:
+        with open(IP_CACHE_FILE) as f:
+            data = json.load(f)
+        HOSTNAME_CACHE.load(data.get("hostname", {}))
+        GEOIP_CACHE.load(data.get("geo", {}))
+    except FileNotFoundError:
         pass
-    return ""
+    except Exception as e:
+        logging.error(f"Не вдалося завантажити кеш IP: {e}")
+
+
+def save_ip_cache():
+    if not IP_CACHE_FILE:
+        return
+    try:
+        os.makedirs(os.path.dirname(IP_CACHE_FILE) or ".", exist_ok=True)
+        tmp_path = f"{IP_CACHE_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"hostname": HOSTNAME_CACHE.dump(), "geo": GEOIP_CACHE.dump()}, f)
+        os.replace(tmp_path, IP_CACHE_FILE)
+    except Exception as e:
+        logging.error(f"Не вдалося зберегти кеш IP: {e}")
+
+
+async def _lookup_hostname(ip: str) -> str | None:
+    # Запускаємо в окремому потоці, бо gethostbyaddr блокуюча
+    host_info = await run_in_thread(socket.gethostbyaddr, ip)
+    return host_info[0]  # Повертаємо ім'я
+
+
+async def _lookup_geoip(ip: str) -> dict | None:
+    async with get_http_session().get(
+        f"http://ip-api.com/json/{ip}?fields=status,country,city,isp,org",
+        timeout=aiohttp.ClientTimeout(total=5),
+    ) as resp:
+        if resp.status != 200:
+            return None
+        data = await resp.json()
+        if data.get("status") == "fail":
+            return None
+        return data
+
+
+async def get_device_hostname(ip: str) -> str:
+    """Спроба дізнатися ім'я хоста (reverse DNS)"""
+    hostname = await HOSTNAME_CACHE.get(ip, _lookup_hostname)
+    return hostname or "Невідомо"
+
+
+PROC_NET_ARP = "/proc/net/arp"
+
+# rtnetlink (linux/rtnetlink.h, linux/neighbour.h)
+RTMGRP_NEIGH = 0x4
+RTM_NEWNEIGH, RTM_DELNEIGH, RTM_GETNEIGH = 28, 29, 30
+NLM_F_REQUEST, NLM_F_DUMP = 0x1, 0x300
+NDA_DST, NDA_LLADDR = 1, 2
+# INCOMPLETE | FAILED | NOARP — записи без придатної MAC-адреси
+NUD_UNUSABLE = 0x01 | 0x20 | 0x40
+NLMSG_HEADER = struct.Struct("=LHHLL")
+NDMSG = struct.Struct("=BBHiHBB")
+RTATTR = struct.Struct("=HH")
+
+
+def parse_neighbor_messages(data: bytes):
+    """Розбирає повідомлення rtnetlink -> (тип, ip, mac або None, стан NUD)"""
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, msg_type = NLMSG_HEADER.unpack_from(data, offset)[:2]
+        if length < NLMSG_HEADER.size:
+            break
+        end = offset + length
+        if msg_type in (RTM_NEWNEIGH, RTM_DELNEIGH):
+            family, _, _, _, state, _, _ = NDMSG.unpack_from(data, offset + NLMSG_HEADER.size)
+            dst = lladdr = None
+            pos = offset + NLMSG_HEADER.size + NDMSG.size
+            while pos + RTATTR.size <= end:
+                attr_len, attr_type = RTATTR.unpack_from(data, pos)
+                if attr_len < RTATTR.size:
+                    break
+                if attr_type == NDA_DST:
+                    dst = data[pos + RTATTR.size : pos + attr_len]
+                elif attr_type == NDA_LLADDR:
+                    lladdr = data[pos + RTATTR.size : pos + attr_len]
+                pos += (attr_len + 3) & ~3
+            if dst and family in (socket.AF_INET, socket.AF_INET6):
+                mac = lladdr.hex(":") if lladdr else None
+                yield msg_type, socket.inet_ntop(family, dst), mac, state
+        offset += (length + 3) & ~3
+
+
+class NeighborTable:
+    """Таблиця сусідів (ARP та IPv6 NDP): ip -> MAC.
+
+    Підтримується подіями rtnetlink (RTM_NEWNEIGH/RTM_DELNEIGH), тож пошук —
+    це звернення до dict. Якщо netlink недоступний, таблиця перечитується з
+    /proc/net/arp (лише IPv4) при промаху, не частіше ніж раз на 5 секунд.
+    """
+
+    FALLBACK_REFRESH = 5
+
+    def __init__(self):
+        self.entries: dict[str, str] = {}
+        self.netlink = False
+        self.sock: socket.socket | None = None
+        self._proc_loaded = 0.0
+        self._seq = 0
+
+    def lookup(self, ip: str) -> str:
+        mac = self.entries.get(ip)
+        if (
+            mac is None
+            and not self.netlink
+            and time.monotonic() - self._proc_loaded > self.FALLBACK_REFRESH
+        ):
+            self.load_proc_arp()
+            mac = self.entries.get(ip)
+        return mac or ""
+
+    def load_proc_arp(self, path: str | None = None):
+        entries = {}
+        try:
+            with open(path or PROC_NET_ARP, "r") as f:
+                next(f, None)  # заголовок
+                for line in f:
+                    parts = line.split()
+                    # Flags 0x0 — запис ще не розв'язаний
+                    if len(parts) >= 4 and parts[2] != "0x0":
+                        entries[parts[0]] = parts[3]
+        except OSError:
+            pass
+        self.entries = entries
+        self._proc_loaded = time.monotonic()
+
+    def apply(self, data: bytes):
+        for msg_type, ip, mac, state in parse_neighbor_messages(data):
+            if msg_type == RTM_NEWNEIGH and mac and not state & NUD_UNUSABLE:
+                self.entries[ip] = mac
+            else:
+                self.entries.pop(ip, None)
+
+    def _request_dump(self):
+        self._seq += 1
+        # nlmsghdr + ndmsg з AF_UNSPEC: усі сім'ї адрес
+        request = NLMSG_HEADER.pack(
+            NLMSG_HEADER.size + NDMSG.size, RTM_GETNEIGH, NLM_F_REQUEST | NLM_F_DUMP, self._seq, 0
+        ) + NDMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0, 0, 0)
+        self.sock.send(request)
+
+    def _on_readable(self):
+        while True:
+            try:
+                data = self.sock.recv(1 << 16)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # ENOBUFS: ядро відкинуло події, таблиця могла розійтися
+                logging.warning(f"⚠️ rtnetlink: {e}, перечитую таблицю сусідів.")
+                self.entries.clear()
+                self._request_dump()
+                return
+            self.apply(data)
+
+    def start(self):
+        """Підписується на rtnetlink у поточному event loop"""
+        try:
+            sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_NONBLOCK, socket.NETLINK_ROUTE
+            )
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            sock.bind((0, RTMGRP_NEIGH))
+        except (OSError, AttributeError) as e:
+            logging.warning(f"⚠️ rtnetlink недоступний ({e}), таблиця сусідів з {PROC_NET_ARP}.")
+            return
+        self.sock = sock
+        # Спершу підписка, потім дамп: події між ними не загубляться
+        self._request_dump()
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable)
+        self.netlink = True
+        logging.info("✅ Таблиця сусідів: підписка rtnetlink.")
+
+    def stats(self) -> str:
+        source = "rtnetlink" if self.netlink else PROC_NET_ARP
+        return f"{len(self.entries)} записів ({source})"
+
+
+NEIGHBORS = NeighborTable()
+
+
+def get_local_mac(ip: str) -> str:
+    """MAC адреса з таблиці сусідів (тільки для локальних)"""
+    return NEIGHBORS.lookup(ip)
+
+
+# Мережі, для яких GeoIP не має сенсу. Довірені мережі перевіряються першими.
+LOCAL_NETWORKS = {
+    "loopback": ("127.0.0.0/8", "::1/128"),
+    "lan": ("10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16"),
+    "cgnat": ("100.64.0.0/10",),
+    "link-local": ("169.254.0.0/16", "fe80::/10"),
+    "ula": ("fc00::/7",),
+}
+IP_CLASS_LABELS = {
+    "trusted": "✅ Довірена мережа",
+    "loopback": "🔁 Цей хост",
+    "lan": "🏠 Локальна мережа",
+    "cgnat": "📡 CGNAT (мережа провайдера)",
+    "link-local": "🔗 Link-local",
+    "ula": "🏠 Локальна мережа (IPv6 ULA)",
+}
+# Версія IP -> [(мережа, категорія)], щоб не порівнювати IPv4 з IPv6
+CLASSIFIED_NETWORKS: dict[int, list] = {4: [], 6: []}
+for _net in TRUSTED_NETWORKS:
+    CLASSIFIED_NETWORKS[_net.version].append((_net, "trusted"))
+for _category, _nets in LOCAL_NETWORKS.items():
+    for _net in map(ipaddress.ip_network, _nets):
+        CLASSIFIED_NETWORKS[_net.version].append((_net, _category))
+
+
+@functools.lru_cache(maxsize=IP_CACHE_SIZE)
+def classify_ip(ip: str) -> str | None:
+    """Категорія адреси з LOCAL_NETWORKS/TRUSTED_NETWORKS або None для публічної"""
+    try:
+        addr = ipaddress.ip_address(ip.split("%", 1)[0])
+    except ValueError:
+        return None
+    if addr.version == 6 and addr.ipv4_mapped:
+        addr = addr.ipv4_mapped
+    for network, category in CLASSIFIED_NETWORKS[addr.version]:
+        if addr in network:
+            return category
+    return None
 
 
 async def get_ip_details(ip: str) -> str:
     """Збирає всю інформацію про IP (Geo + Device Name)"""
-    is_local = ip.startswith(("192.168.", "10.", "172.", "127."))
+    category = classify_ip(ip)
 
     # 1. Дізнаємося ім'я пристрою
     hostname = await get_device_hostname(ip)
     device_str = f"💻 Пристрій: <code>{hostname}</code>"
 
     # 2. Якщо локальний - додаємо MAC
-    if is_local:
-        mac = await get_local_mac(ip)
+    if category:
+        mac = get_local_mac(ip.removeprefix("::ffff:"))
         if mac:
             device_str += f"\n🔌 MAC: <code>{mac}</code>"
-        return f"🏠 Локальна мережа\n{device_str}"
+        return f"{IP_CLASS_LABELS[category]}\n{device_str}"
 
     # 3. Якщо зовнішній - пробиваємо GeoIP
+    data = await GEOIP_CACHE.get(ip, _lookup_geoip)
+    if data:
+        country = data.get("country", "Невідомо")
+        city = data.get("city", "")
+        isp = data.get("isp", data.get("org", "Невідомо"))
+        return f"🌍 {country}, {city}\n🏢 ISP: {isp}\n{device_str}"
+
+    return f"🌐 Інфо недоступне\n{device_str}"
+
+
+# --- ЧЕРГА СПОВІЩЕНЬ ---
+class TokenBucket:
+    """Обмежувач швидкості: rate токенів/сек, не більше capacity за раз"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Забирає всі токени на seconds секунд (після flood control)"""
+        self.tokens = -seconds * self.rate
+        self.updated = time.monotonic()
+
+
+class NotificationQueue:
+    """Черга вихідних сповіщень з окремим відправником.
+
+    notify() ніколи не чекає на мережу: при переповненні повідомлення
+    відкидається і рахується у dropped.
+    """
+
+    MAX_RETRIES = 3
+
+    def __init__(self, maxsize: int, rate: float, burst: int, coalesce_window: float):
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize)
+        self.bucket = TokenBucket(rate, burst)
+        self.coalesce_window = coalesce_window
+        # coalesce_key -> [кількість пропущених подій, шаблон зведення]
+        self._groups: dict = {}
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def notify(self, text: str, coalesce_key=None, summary: str = "") -> bool:
+        """Ставить повідомлення в чергу.
+
+        Якщо задано coalesce_key, перша подія відправляється одразу, а
+        наступні з тим самим ключем протягом вікна лише рахуються і в кінці
+        вікна надсилаються одним зведенням (summary з полем {count}).
+        """
+        if coalesce_key is not None:
+            group = self._groups.get(coalesce_key)
+            if group is not None:
+                group[0] += 1
+                self.coalesced += 1
+                return True
+            self._groups[coalesce_key] = [0, summary]
+            asyncio.get_running_loop().call_later(
+                self.coalesce_window, self._flush_group, coalesce_key
+            )
+        return self._put(text)
+
+    def _put(self, text: str) -> bool:
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    def _flush_group(self, coalesce_key):
+        count, summary = self._groups.pop(coalesce_key)
+        if count:
+            self._put(summary.format(count=count, window=int(self.coalesce_window)))
+
+    async def run(self, bot: Bot):
+        """Відправник: бере повідомлення з черги з урахуванням ліміту"""
+        while True:
+            text = await self.queue.get()
+            for _ in range(self.MAX_RETRIES):
+                await self.bucket.acquire()
+                try:
+                    await bot.send_message(ALLOWED_USER_ID, text, parse_mode="HTML")
+                    self.sent += 1
+                    break
+                except TelegramRetryAfter as e:
+                    logging.warning(f"Flood control: пауза {e.retry_after}с")
+                    self.bucket.pause(e.retry_after)
+                except Exception as e:
+                    logging.error(f"Send Notification Error: {e}")
+                    self.failed += 1
+                    break
+            else:
+                self.failed += 1
+            self.queue.task_done()
+
+    def stats(self) -> str:
+        return (
+            f"у черзі {self.queue.qsize()}/{self.queue.maxsize}, "
+            f"надіслано {self.sent}, об'єднано {self.coalesced}, "
+            f"відкинуто {self.dropped}, помилок {self.failed}"
+        )
+
+
+NOTIFIER = NotificationQueue(
+    NOTIFY_QUEUE_SIZE, NOTIFY_RATE, NOTIFY_BURST, NOTIFY_COALESCE_WINDOW
+)
+
+# Посилання на фонові задачі, щоб їх не зібрав GC
+_background_tasks: set[asyncio.Task] = set()
+
+
+def spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+# --- ІСТОРІЯ SSH (SQLITE) ---
+SSH_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ssh_events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    user TEXT,
+    ip TEXT,
+    port INTEGER,
+    method TEXT,
+    pid INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_ssh_events_ts ON ssh_events(ts);
+CREATE INDEX IF NOT EXISTS ix_ssh_events_ip_ts ON ssh_events(ip, ts);
+CREATE TABLE IF NOT EXISTS ssh_sessions (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    port INTEGER,
+    pid INTEGER,
+    method TEXT,
+    start REAL NOT NULL,
+    end REAL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS ix_ssh_sessions_start ON ssh_sessions(start);
+CREATE INDEX IF NOT EXISTS ix_ssh_sessions_user_start ON ssh_sessions(user, start);
+CREATE INDEX IF NOT EXISTS ix_ssh_sessions_ip_start ON ssh_sessions(ip, start);
+-- Відкриті сесії: закриття при виході за (ip, port) або PID
+CREATE INDEX IF NOT EXISTS ix_ssh_sessions_open ON ssh_sessions(ip, port) WHERE end IS NULL;
+CREATE INDEX IF NOT EXISTS ix_ssh_sessions_open_pid ON ssh_sessions(pid) WHERE end IS NULL;
+"""
+
+
+class SshEventStore:
+    """Запис SSH-подій у SQLite (WAL) пачками з окремого потоку.
+
+    add() лише перетворює подію на рядки таблиць у буфері (без I/O), тож
+    читач журналу не чекає на диск; потік запису виконує тільки SQL.
+    Буфер скидається, коли набирається batch_size подій або минає
+    flush_ms. Вхід відкриває сесію, вихід (за ip+port) або закриття
+    PAM-сесії (за PID) — закриває її з тривалістю. Ключі відкритих сесій
+    тримаються в пам'яті, тож тисячі preauth-відключень під час атаки не
+    перетворюються на тисячі UPDATE.
+    """
+
+    RETENTION_INTERVAL = 3600
+    MAX_BUFFER = 100_000
+
+    def __init__(
+        self,
+        path: str = SSH_DB_FILE,
+        batch_size: int = SSH_DB_BATCH_SIZE,
+        flush_ms: float = SSH_DB_FLUSH_MS,
+        retention_days: float = SSH_DB_RETENTION_DAYS,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.retention_days = retention_days
+        self.conn: sqlite3.Connection | None = None
+        # Рядки для ssh_events, нові сесії, закриття за (ip, port) та за PID
+        self.buffer: list[tuple] = []
+        self.opened: list[tuple] = []
+        self.closed_addrs: list[tuple] = []
+        self.closed_pids: list[tuple] = []
+        # Відкриті сесії: (ip, port) та PID
+        self.open_addrs: set[tuple] = set()
+        self.open_pids: set[int] = set()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def add(self, event: dict):
+        if not self.path:
+            return
+        if len(self.buffer) >= self.MAX_BUFFER:
+            # Диск не встигає: краще втратити історію, ніж пам'ять
+            self.dropped += 1
+            return
+        get = event.get
+        kind, ts, ip, port, pid = event["kind"], event["ts"], get("ip"), get("port"), get("pid")
+        self.buffer.append((ts, kind, get("user"), ip, port, get("method"), pid))
+        if kind == "login":
+            self.opened.append((event["user"], ip, port, pid, event["method"], ts))
+            self.open_addrs.add((ip, port))
+            if pid:
+                self.open_pids.add(pid)
+        elif kind == "logout" and (ip, port) in self.open_addrs:
+            self.open_addrs.discard((ip, port))
+            self.closed_addrs.append((ts, ip, port))
+        elif kind == "session_closed" and pid in self.open_pids:
+            self.open_pids.discard(pid)
+            self.closed_pids.append((ts, pid))
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        # auto_vacuum діє лише для нової бази (до створення таблиць)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        # У WAL synchronous=NORMAL не ламає базу при збої, лише може
+        # втратити останні транзакції
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SSH_DB_SCHEMA)
+        self.conn = conn
+        self.close_stale_sessions()
+        for ip, port, pid in conn.execute(
+            "SELECT ip, port, pid FROM ssh_sessions WHERE end IS NULL"
+        ):
+            self.open_addrs.add((ip, port))
+            if pid:
+                self.open_pids.add(pid)
+
+    def close_stale_sessions(self):
+        """Сесії, відкриті до перезавантаження, вже не отримають події виходу"""
+        boot = psutil.boot_time()
+        self.conn.execute(
+            "UPDATE ssh_sessions SET end = ?, duration = ? - start "
+            "WHERE end IS NULL AND start < ?",
+            (boot, boot, boot),
+        )
+
+    def write_batch(self, rows, opened, closed_addrs, closed_pids):
+        conn = self.conn
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO ssh_events (ts, kind, user, ip, port, method, pid) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            # Порядок важливий: вхід і вихід можуть потрапити в одну пачку
+            conn.executemany(
+                "INSERT INTO ssh_sessions (user, ip, port, pid, method, start) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                opened,
+            )
+            conn.executemany(
+                "UPDATE ssh_sessions SET end = ?1, duration = ?1 - start "
+                "WHERE end IS NULL AND ip = ?2 AND port = ?3",
+                closed_addrs,
+            )
+            conn.executemany(
+                "UPDATE ssh_sessions SET end = ?1, duration = ?1 - start "
+                "WHERE end IS NULL AND pid = ?2",
+                closed_pids,
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def apply_retention(self):
+        cutoff = time.time() - self.retention_days * 86400
+        self.conn.execute("DELETE FROM ssh_events WHERE ts < ?", (cutoff,))
+        self.conn.execute(
+            "DELETE FROM ssh_sessions WHERE start < ? AND end IS NOT NULL", (cutoff,)
+        )
+        # Повертаємо звільнені сторінки та обрізаємо WAL
+        self.conn.execute("PRAGMA incremental_vacuum")
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    async def flush(self):
+        async with self._lock:
+            if not self.buffer or self.conn is None:
+                return
+            batch = (self.buffer, self.opened, self.closed_addrs, self.closed_pids)
+            self.buffer, self.opened, self.closed_addrs, self.closed_pids = [], [], [], []
+            try:
+                await run_in_thread(self.write_batch, *batch)
+            except Exception as e:
+                logging.error(f"Помилка запису SSH-подій у базу: {e}")
+                self.dropped += len(batch[0])
+                return
+            self.written += len(batch[0])
+            self.batches += 1
+
+    async def run(self):
+        if not self.path:
+            return
+        try:
+            await run_in_thread(self.open)
+        except Exception as e:
+            logging.error(f"Не вдалося відкрити базу SSH-подій: {e}")
+            self.path = ""
+            return
+        logging.info(f"🗃 База SSH-подій: {self.path}")
+        last_retention = 0.0
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if time.monotonic() - last_retention > self.RETENTION_INTERVAL:
+                last_retention = time.monotonic()
+                async with self._lock:
+                    await run_in_thread(self.apply_retention)
+
+    async def close(self):
+        await self.flush()
+        if self.conn is not None:
+            async with self._lock:
+                self.conn.close()
+                self.conn = None
+
+    def query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """Читання через окреме з'єднання: у WAL не заважає записувачу"""
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def top_ips(self, days: float = 7, limit: int = 10) -> list[tuple]:
+        return self.query(
+            "SELECT ip, SUM(kind = 'login'), SUM(kind IN ('failed', 'invalid_user')), "
+            "COUNT(*), COUNT(DISTINCT user), MAX(ts) "
+            "FROM ssh_events WHERE ts >= ? AND ip IS NOT NULL "
+            "GROUP BY ip ORDER BY 2 DESC, 4 DESC LIMIT ?",
+            (time.time() - days * 86400, limit),
+        )
+
+    def active_sessions(self) -> list[tuple]:
+        return self.query(
+            "SELECT user, ip, port, method, start FROM ssh_sessions "
+            "WHERE end IS NULL ORDER BY start DESC"
+        )
+
+    def user_history(self, user: str, limit: int = 15) -> list[tuple]:
+        return self.query(
+            "SELECT ip, method, start, end, duration FROM ssh_sessions "
+            "WHERE user = ? ORDER BY start DESC LIMIT ?",
+            (user, limit),
+        )
+
+    def stats(self) -> str:
+        return (
+            f"записано {self.written} ({self.batches} пачок), "
+            f"у буфері {len(self.buffer)}, втрачено {self.dropped}"
+        )
+
+
+SSH_STORE = SshEventStore()
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}с"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}хв {seconds}с"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours}год {minutes}хв"
+    days, hours = divmod(hours, 24)
+    return f"{days}д {hours}год"
+
+
+def format_ts(ts: float) -> str:
+    return datetime.datetime.fromtimestamp(ts).strftime("%d.%m %H:%M")
+
+
+# --- ЗАХИСТ ВІД ПЕРЕБОРУ ---
+class SlidingWindowCounter:
+    """Лічильники подій за ковзне вікно для багатьох ключів в обмеженій пам'яті.
+
+    Вікно поділене на buckets кошиків, тож ключ займає buckets чисел
+    незалежно від кількості подій (точність — ширина кошика). Ключів не
+    більше max_keys: при переповненні витісняється той, що найдовше не
+    оновлювався (LRU з точністю до кошика), тож ботнет зі 100k адрес не
+    роздуває пам'ять.
+    """
+
+    def __init__(self, window: float, max_keys: int, buckets: int = 10):
+        self.width = window / buckets
+        self.buckets = buckets
+        self.max_keys = max_keys
+        # ключ -> [номер останнього кошика, сума у вікні, лічильники по кошиках]
+        self.entries: OrderedDict = OrderedDict()
+        self.evicted = 0
+
+    def add(self, key, ts: float) -> int:
+        """Рахує подію і повертає кількість подій ключа у вікні"""
+        slot = int(ts // self.width)
+        entry = self.entries.get(key)
+        if entry is None:
+            if len(self.entries) >= self.max_keys:
+                self.entries.popitem(last=False)
+                self.evicted += 1
+            entry = self.entries[key] = [slot, 0, [0] * self.buckets]
+        else:
+            last = entry[0]
+            if slot > last:
+                # Порядок LRU оновлюємо раз на кошик, а не на кожну подію
+                self.entries.move_to_end(key)
+                # Віднімаємо кошики, що випали з вікна
+                counts = entry[2]
+                for stale in range(last + 1, min(slot, last + self.buckets) + 1):
+                    entry[1] -= counts[stale % self.buckets]
+                    counts[stale % self.buckets] = 0
+                entry[0] = slot
+            elif last - slot >= self.buckets:
+                # Запізніла подія, старша за вікно
+                return entry[1]
+        entry[2][slot % self.buckets] += 1
+        entry[1] += 1
+        return entry[1]
+
+    def _live(self, entry: list, slot: int) -> int:
+        last, total, counts = entry
+        if slot - last >= self.buckets:
+            return 0
+        if slot <= last:
+            return total
+        return sum(counts[s % self.buckets] for s in range(slot - self.buckets + 1, last + 1))
+
+    def count(self, key, now: float) -> int:
+        entry = self.entries.get(key)
+        return self._live(entry, int(now // self.width)) if entry else 0
+
+    def top(self, n: int, now: float) -> list[tuple]:
+        slot = int(now // self.width)
+        counts = ((key, self._live(entry, slot)) for key, entry in self.entries.items())
+        return heapq.nlargest(n, (item for item in counts if item[1]), key=lambda item: item[1])
+
+
+def build_nft_command(nft_set: str, addrs: list[str], timeout: int = BRUTEFORCE_NFT_TIMEOUT) -> list[str]:
+    """nft add element <family> <table> <set> { адреса timeout Ns, ... }"""
+    suffix = f" timeout {timeout}s" if timeout else ""
+    elements = ", ".join(f"{addr}{suffix}" for addr in addrs)
+    command = ["nft", "add", "element", *nft_set.split(), "{", elements, "}"]
+    if os.geteuid() != 0:
+        # -n: без запиту пароля, потрібне правило NOPASSWD для nft
+        command = ["sudo", "-n", *command]
+    return command
+
+
+class BruteForceDetector:
+    """Невдалі входи SSH: лічильники за вікно по IP, користувачу та загалом.
+
+    record() лише оновлює лічильники. Ключі, що перетнули поріг, збираються
+    і через ALERT_DELAY секунд надсилаються одним сповіщенням з топом
+    порушників, а нові IP (крім довірених) додаються в набір nftables.
+    Про той самий ключ повторно повідомляється не раніше, ніж через вікно.
+    """
+
+    ALERT_DELAY = 5
+    TOP = 5
+    # Скільки адрес передавати nft за один виклик
+    NFT_CHUNK = 1000
+
+    def __init__(
+        self,
+        window: float = BRUTEFORCE_WINDOW,
+        ip_threshold: int = BRUTEFORCE_IP_THRESHOLD,
+        user_threshold: int = BRUTEFORCE_USER_THRESHOLD,
+        total_threshold: int = BRUTEFORCE_TOTAL_THRESHOLD,
+        max_keys: int = BRUTEFORCE_MAX_KEYS,
+    ):
+        self.window = window
+        self.thresholds = {"ip": ip_threshold, "user": user_threshold, "total": total_threshold}
+        self.counters = {
+            kind: SlidingWindowCounter(window, 1 if kind == "total" else max_keys)
+            for kind in self.thresholds
+        }
+        # Увімкнені пороги: (вид, поле події, лічильник, поріг)
+        fields = {"ip": "ip", "user": "user", "total": None}
+        self._checks = [
+            (kind, fields[kind], self.counters[kind], threshold)
+            for kind, threshold in self.thresholds.items()
+            if threshold
+        ]
+        # (вид, ключ) -> час останнього сповіщення, теж з обмеженням розміру
+        self.alerted: OrderedDict = OrderedDict()
+        self.max_alerted = 2 * max_keys
+        self.pending: dict[str, set] = {kind: set() for kind in self.thresholds}
+        self.now = 0.0
+        self.failures = 0
+        self.alerts = 0
+        self.banned = 0
+        self._scheduled = False
+
+    def record(self, event: dict):
+        ts = event["ts"]
+        self.failures += 1
+        if time.time() - ts > self.window:
+            # Старі записи (догоняємо журнал після перезапуску) не сповіщаємо
+            return
+        if ts > self.now:
+            self.now = ts
+        for kind, field, counter, threshold in self._checks:
+            key = event[field] if field else "*"
+            if counter.add(key, ts) >= threshold:
+                self._crossed(kind, key, ts)
+
+    def _crossed(self, kind: str, key: str, ts: float):
+        if key in self.pending[kind]:
+            return
+        alerted = self.alerted.get((kind, key))
+        if alerted is not None and ts - alerted < self.window:
+            return
+        self.pending[kind].add(key)
+        if not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_later(self.ALERT_DELAY, self._flush)
+
+    def _flush(self):
+        self._scheduled = False
+        pending, self.pending = self.pending, {kind: set() for kind in self.thresholds}
+        for kind, keys in pending.items():
+            for key in keys:
+                self.alerted[(kind, key)] = self.now
+                self.alerted.move_to_end((kind, key))
+        while len(self.alerted) > self.max_alerted:
+            self.alerted.popitem(last=False)
+        self.alerts += 1
+        NOTIFIER.notify(self.render_alert(pending))
+        if pending["ip"] and (BRUTEFORCE_NFT_SET or BRUTEFORCE_NFT_SET6):
+            spawn(self.ban(pending["ip"]))
+
+    def render_alert(self, pending: dict[str, set]) -> str:
+        lines = ["🛡 <b>SSH: перебір паролів!</b>"]
+        for kind, title in (("ip", "🖥 IP"), ("user", "👤 Юзери")):
+            keys = sorted(pending[kind], key=lambda key: -self.counters[kind].count(key, self.now))
+            if keys:
+                shown = ", ".join(f"<code>{html.escape(key)}</code>" for key in keys[:10])
+                more = f" і ще {len(keys) - 10}" if len(keys) > 10 else ""
+                lines.append(f"{title} (≥{self.thresholds[kind]}): {shown}{more}")
+        if pending["total"]:
+            lines.append(
+                f"🌐 Розподілена атака: ≥{self.thresholds['total']} невдалих спроб за вікно"
+            )
+        lines.append(self.render_top())
+        return "\n".join(lines)
+
+    def render_top(self, now: float | None = None) -> str:
+        now = now or self.now
+        minutes = self.window / 60
+        total = self.counters["total"].count("*", now)
+        lines = [f"📉 За {minutes:g} хв: {total} невдалих спроб"] if total else []
+        for kind, title in (("ip", "🏆 Топ IP"), ("user", "🏆 Топ юзерів")):
+            top = self.counters[kind].top(self.TOP, now)
+            if top:
+                lines.append(f"{title}:")
+                lines += [f"  <code>{html.escape(key)}</code> — {count}" for key, count in top]
+        return "\n".join(lines)
+
+    async def ban(self, ips: set[str]):
+        """Додає IP у набори nftables (IPv4 та IPv6 окремо)"""
+        targets: dict[str, list[str]] = {}
+        for ip in ips:
+            if classify_ip(ip) in ("trusted", "loopback"):
+                continue
+            try:
+                addr = ipaddress.ip_address(ip.split("%", 1)[0])
+            except ValueError:
+                continue
+            if addr.version == 6 and addr.ipv4_mapped:
+                addr = addr.ipv4_mapped
+            nft_set = BRUTEFORCE_NFT_SET6 if addr.version == 6 else BRUTEFORCE_NFT_SET
+            if nft_set:
+                targets.setdefault(nft_set, []).append(str(addr))
+
+        for nft_set, addrs in targets.items():
+            for i in range(0, len(addrs), self.NFT_CHUNK):
+                chunk = addrs[i:i + self.NFT_CHUNK]
+                command = build_nft_command(nft_set, chunk)
+                started = time.monotonic()
+                try:
+                    process = await asyncio.create_subprocess_exec(
+                        *command,
+                        stdout=asyncio.subprocess.DEVNULL,
+                        stderr=asyncio.subprocess.PIPE,
+                    )
+                    _, stderr = await process.communicate()
+                except OSError as e:
+                    logging.error(f"Не вдалося запустити nft: {e}")
+                    return
+                record_subprocess(command, started, process.returncode)
+                if process.returncode:
+                    logging.error(f"nft: {stderr.decode(errors='replace').strip()}")
+                else:
+                    self.banned += len(chunk)
+                    logging.warning(f"⛔ Заблоковано в {nft_set}: {len(chunk)} IP")
+
+    def stats(self) -> str:
+        evicted = sum(counter.evicted for counter in self.counters.values())
+        return (
+            f"невдалих спроб {self.failures}, у пам'яті IP {len(self.counters['ip'].entries)}, "
+            f"юзерів {len(self.counters['user'].entries)}, витіснено {evicted}, "
+            f"сповіщень {self.alerts}, заблоковано {self.banned}"
+        )
+
+
+BRUTEFORCE = BruteForceDetector()
+
+
+def collect_bruteforce_metrics() -> list[str]:
+    lines = metric_lines(
+        "lmb_ssh_failed_logins_total", "Невдалі спроби входу SSH", [({}, BRUTEFORCE.failures)], "counter"
+    )
+    lines += metric_lines(
+        "lmb_bruteforce_tracked_keys",
+        "Ключів у лічильниках перебору",
+        [({"kind": kind}, len(counter.entries)) for kind, counter in BRUTEFORCE.counters.items()],
+    )
+    lines += metric_lines(
+        "lmb_bruteforce_evictions_total",
+        "Витіснені з лічильників ключі (LRU)",
+        [({"kind": kind}, counter.evicted) for kind, counter in BRUTEFORCE.counters.items()],
+        "counter",
+    )
+    lines += metric_lines(
+        "lmb_bruteforce_actions_total",
+        "Сповіщення про перебір та заблоковані IP",
+        [({"action": "alert"}, BRUTEFORCE.alerts), ({"action": "ban"}, BRUTEFORCE.banned)],
+        "counter",
+    )
+    return lines
+
+
+METRICS_COLLECTORS.append(collect_bruteforce_metrics)
+
+
+# --- SSH МОНІТОРИНГ ---
+# Фільтр на боці journald: лише записи sshd (PAM-повідомлення теж пише sshd).
+# Однакові поля об'єднуються через OR, "+" додає альтернативну групу.
+SSH_JOURNAL_MATCHES = [
+    "SYSLOG_IDENTIFIER=sshd",
+    "SYSLOG_IDENTIFIER=sshd-session",
+    "+",
+    "_SYSTEMD_UNIT=sshd.service",
+    "+",
+    "_SYSTEMD_UNIT=ssh.service",
+]
+
+# Лічильники SSH-монітора (для /stats та бенчмарків)
+SSH_MONITOR_STATS = {"entries": 0, "events": 0, "restarts": 0}
+
+REGEX_SSH_LOGIN = re.compile(
+    r"Accepted\s+(password|publickey|keyboard-interactive/pam)\s+for\s+(\S+)\s+from\s+(\S+)\s+port\s+(\d+)"
+)
+REGEX_SSH_LOGOUT = re.compile(
+    r"Disconnected\s+from\s+(?:(?:invalid\s+|authenticating\s+)?user\s+(\S+)\s+)?(\S+)\s+port\s+(\d+)"
+)
+REGEX_SSH_SESSION_CLOSED = re.compile(r"session closed for user\s+(\S+)")
+# Ім'я може бути порожнім ("Invalid user  from ...") і містити пробіли та
+# " from <IP> port <N>" — його обирає атакуючий, тож IP беремо з кінця рядка
+REGEX_SSH_FAILED = re.compile(
+    r"Failed\s+(\S+)\s+for\s+(?:invalid\s+user\s+)?(.*)\s+from\s+(\S+)\s+port\s+(\d+)(?:\s+ssh2)?$"
+)
+REGEX_SSH_INVALID_USER = re.compile(
+    r"Invalid\s+user\s+(.*)\s+from\s+(\S+)\s+port\s+(\d+)$"
+)
+
+
+def parse_journal_entry(line: bytes) -> tuple[str | None, str, float, int | None]:
+    """Розбирає рядок `journalctl -o json` -> (cursor, MESSAGE, час, PID)"""
+    entry = json.loads(line)
+    message = entry.get("MESSAGE") or ""
+    if isinstance(message, list):
+        # journald віддає не-UTF8 повідомлення масивом байтів
+        message = bytes(message).decode("utf-8", errors="replace")
+    ts = int(entry.get("__REALTIME_TIMESTAMP", 0)) / 1_000_000 or time.time()
+    pid = entry.get("_PID")
+    return entry.get("__CURSOR"), message, ts, int(pid) if pid else None
+
+
+def is_ip_address(value: str) -> bool:
+    try:
+        ipaddress.ip_address(value.split("%", 1)[0])
+    except ValueError:
+        return False
+    return True
+
+
+def parse_ssh_event(message: str) -> dict | None:
+    """Розбирає повідомлення sshd у подію login / logout / session_closed /
+    failed / invalid_user"""
+    if message.startswith("Accepted "):
+        match = REGEX_SSH_LOGIN.match(message)
+        if match:
+            method, user, ip, port = match.groups()
+            return {
+                "kind": "login",
+                "method": method,
+                "user": user,
+                "ip": ip,
+                "port": int(port),
+            }
+    elif message.startswith("Disconnected from "):
+        match = REGEX_SSH_LOGOUT.match(message)
+        if match:
+            user, ip, port = match.groups()
+            return {"kind": "logout", "user": user, "ip": ip, "port": int(port)}
+    elif message.startswith("Failed "):
+        match = REGEX_SSH_FAILED.match(message)
+        if match and is_ip_address(match.group(3)):
+            method, user, ip, port = match.groups()
+            return {
+                "kind": "failed",
+                "method": method,
+                "user": user,
+                "ip": ip,
+                "port": int(port),
+            }
+    elif message.startswith("Invalid user "):
+        match = REGEX_SSH_INVALID_USER.match(message)
+        if match and is_ip_address(match.group(2)):
+            user, ip, port = match.groups()
+            return {"kind": "invalid_user", "user": user, "ip": ip, "port": int(port)}
+    elif "session closed" in message:
+        match = REGEX_SSH_SESSION_CLOSED.search(message)
+        if match:
+            return {"kind": "session_closed", "user": match.group(1)}
+    return None
+
+
+def load_journal_cursor(path: str = SSH_CURSOR_FILE) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.error(f"Не вдалося прочитати курсор журналу: {e}")
+        return None
+
+
+def save_journal_cursor(cursor: str, path: str = SSH_CURSOR_FILE):
+    """Атомарно зберігає курсор (через тимчасовий файл)"""
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(cursor)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.error(f"Не вдалося зберегти курсор журналу: {e}")
+
+
+async def notify_ssh_login(event: dict):
+    # Отримуємо розширену інфу про пристрій
+    geo_and_device = await get_ip_details(event["ip"])
+    NOTIFIER.notify(
+        f"🚨 <b>SSH: Вхід (Arch)!</b>\n"
+        f"👤 Юзер: <code>{event['user']}</code>\n"
+        f"🔑 Метод: {event['method']}\n"
+        f"🖥 IP: <code>{event['ip']}</code>\n"
+        f"{geo_and_device}"
+    )
+
+
+def handle_ssh_event(event: dict):
+    """Ставить сповіщення про SSH-подію в чергу, не чекаючи на мережу"""
+    kind = event["kind"]
+    logging.debug("SSH event: %s", event)
+    SSH_STORE.add(event)
+
+    # === ВХІД ===
+    if kind == "login":
+        # GeoIP/DNS — у фоні, щоб не гальмувати читання журналу
+        spawn(notify_ssh_login(event))
+
+    # === ВИХІД (Disconnected) ===
+    elif kind == "logout":
+        user = event["user"] or "Невідомо (preauth)"
+        ip = event["ip"]
+        NOTIFIER.notify(
+            f"👋 <b>SSH: Відключено</b>\n"
+            f"👤 Юзер: <code>{user}</code>\n"
+            f"🖥 IP: <code>{ip}</code>",
+            coalesce_key=("logout", ip),
+            summary=(
+                f"👋 <b>SSH: Відключено ще {{count}} раз(ів) за {{window}}с</b>\n"
+                f"🖥 IP: <code>{ip}</code>"
+            ),
+        )
+
+    # === НЕВДАЛА СПРОБА: лише лічильники, сповіщення — при перевищенні порогу ===
+    elif kind in ("failed", "invalid_user"):
+        BRUTEFORCE.record(event)
+
+    # === ВИХІД (PAM Session Closed) ===
+    else:
+        user = event["user"]
+        NOTIFIER.notify(
+            f"👋 <b>SSH: Сесію завершено</b>\n👤 Юзер: <code>{user}</code>",
+            coalesce_key=("session_closed", user),
+            summary=(
+                f"👋 <b>SSH: Завершено ще {{count}} сесій за {{window}}с</b>\n"
+                f"👤 Юзер: <code>{user}</code>"
+            ),
+        )
+
+
+async def read_ssh_journal():
+    """Один запуск journalctl: читає записи sshd, поки процес живий"""
+    cursor = load_journal_cursor()
+    resumed = cursor is not None
+    cmd = [
+        "journalctl",
+        "-f",
+        "-o",
+        "json",
+        "--output-fields=MESSAGE,_PID",
+        *SSH_JOURNAL_MATCHES,
+    ]
+    if resumed:
+        # Продовжуємо з місця зупинки: без пропусків і без дублікатів
+        cmd += ["--no-tail", f"--after-cursor={cursor}"]
+    else:
+        cmd += ["-n", "0"]
+
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+    )
+    logging.info("✅ Процес journalctl підключено.")
+
+    entries = 0
+    saved_cursor = cursor
+    last_save = time.monotonic()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"http://ip-api.com/json/{ip}?fields=country,city,isp,org", timeout=5
-            ) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    country = data.get("country", "Невідомо")
-                    city = data.get("city", "")
-                    isp = data.get("isp", data.get("org", "Невідомо"))
-                    return f"🌍 {country}, {city}\n🏢 ISP: {isp}\n{device_str}"
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            try:
+                cursor, message, ts, pid = parse_journal_entry(line)
+            except ValueError:
+                continue
+            entries += 1
+            SSH_MONITOR_STATS["entries"] += 1
+
+            event = parse_ssh_event(message)
+            if event:
+                SSH_MONITOR_STATS["events"] += 1
+                event["ts"] = ts
+                event["pid"] = pid
+                handle_ssh_event(event)
+
+            # Курсор пишемо не частіше ніж раз на секунду (під час атаки подій
+            # тисячі на секунду); після події — з затримкою до 1с, без подій — 5с
+            since_save = time.monotonic() - last_save
+            if cursor and (since_save > 5 or (event and since_save > 1)):
+                save_journal_cursor(cursor)
+                saved_cursor = cursor
+                last_save = time.monotonic()
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+        if cursor and cursor != saved_cursor:
+            save_journal_cursor(cursor)
+
+    if resumed and not entries and process.returncode:
+        # Курсор міг застаріти після ротації журналу — починаємо з кінця
+        logging.warning("⚠️ Курсор журналу недійсний, скидаю.")
+        try:
+            os.remove(SSH_CURSOR_FILE)
+        except FileNotFoundError:
+            pass
+
+
+async def monitor_ssh_logins():
+    logging.info("🐉 Arch Linux SSH Monitor: ЗАПУЩЕНО")
+    backoff = 1.0
+    while True:
+        started = time.monotonic()
+        try:
+            await read_ssh_journal()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"❌ SSH Monitor CRITICAL ERROR: {e}")
+
+        # Якщо процес пропрацював довго — це не "флапання", скидаємо паузу
+        if time.monotonic() - started > SSH_MONITOR_MAX_BACKOFF:
+            backoff = 1.0
+        SSH_MONITOR_STATS["restarts"] += 1
+        logging.warning(f"⚠️ journalctl завершився, перезапуск через {backoff:.0f}с")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, SSH_MONITOR_MAX_BACKOFF)
+
+
+# --- FLEET: АГЕНТИ НА ІНШИХ ХОСТАХ ---
+# Протокол: JSON-рядки поверх TCP/unix-сокета. Після підключення агент
+# надсилає {"nonce": ...}, клієнт відповідає {"auth": HMAC-SHA256(секрет, nonce)},
+# далі запити {"id", "method", "params"} -> відповіді {"id", "result"|"error"}.
+# Кілька запитів можуть виконуватися одночасно в одному з'єднанні.
+FLEET_STREAM_LIMIT = (FLEET_LOG_LIMIT_MB * 2 + 1) * 1024 * 1024
+# Запити до агента (і рядок автентифікації) маленькі; великі лише відповіді,
+# тож агент не буферизує мегабайти від ще не автентифікованого клієнта
+FLEET_REQUEST_LIMIT = 64 * 1024
+
+
+def fleet_signature(nonce: str) -> str:
+    return hmac.new(FLEET_SECRET.encode(), nonce.encode(), hashlib.sha256).hexdigest()
+
+
+def parse_fleet_endpoint(address: str) -> tuple[str, str, int]:
+    """'unix:/run/agent.sock' -> ('unix', шлях, 0); 'host:port' -> ('tcp', host, port)"""
+    if address.startswith("unix:"):
+        return ("unix", address[5:], 0)
+    host, _, port = address.rpartition(":")
+    return ("tcp", host.strip("[]"), int(port))
+
+
+async def fleet_send(writer: asyncio.StreamWriter, payload: dict):
+    writer.write(json.dumps(payload).encode() + b"\n")
+    await writer.drain()
+
+
+async def agent_dashboard(params: dict) -> dict:
+    if METRICS_HISTORY:
+        sample = METRICS_HISTORY[-1]
+    else:
+        sample = await run_in_thread(collect_metrics_sample, 1)
+    return {"sample": sample._asdict(), "text": get_system_dashboard(sample)}
+
+
+async def agent_updates(params: dict) -> dict:
+    checked_at = UPDATE_CHECKER.checked_at
+    if checked_at is None or time.time() - checked_at > UPDATES_CHECK_INTERVAL:
+        await UPDATE_CHECKER.refresh()
+    updates = UPDATE_CHECKER.updates
+    return {
+        "updates": [u._asdict() for u in updates] if updates is not None else None,
+        "checked_at": UPDATE_CHECKER.checked_at,
+        "error": UPDATE_CHECKER.error,
+    }
+
+
+def list_failed_units_systemctl() -> list[str]:
+    result = run_command(
+        ["systemctl", "list-units", "--state=failed", "--plain", "--no-legend", "--no-pager"],
+        capture_output=True,
+        text=True,
+    )
+    return [line.split()[0] for line in result.stdout.splitlines() if line.strip()]
+
+
+async def agent_failed(params: dict) -> dict:
+    if SYSTEMD_WATCHER.connected:
+        units = sorted(SYSTEMD_WATCHER.failed)
+    else:
+        units = await run_in_thread(list_failed_units_systemctl)
+    return {"units": units}
+
+
+async def agent_logs(params: dict) -> dict:
+    """Перша gzip-частина журналу (до FLEET_LOG_LIMIT_MB) у base64"""
+    export = await get_system_logs(
+        bool(params.get("critical", True)),
+        int(params.get("boot_offset", 0)),
+        part_limit=FLEET_LOG_LIMIT_MB * 1024 * 1024,
+    )
+    if not export:
+        return {"data": "", "truncated": False}
+    try:
+        data = b"".join([chunk async for chunk in export.read_part()])
+    finally:
+        await export.close()
+    return {
+        "data": base64.b64encode(data).decode(),
+        "truncated": not export.eof,
+        "summary": export.summary(),
+    }
+
+
+AGENT_METHODS = {
+    "dashboard": agent_dashboard,
+    "updates": agent_updates,
+    "failed": agent_failed,
+    "logs": agent_logs,
+}
+
+
+async def agent_dispatch(request: dict, writer: asyncio.StreamWriter):
+    request_id = request.get("id") if isinstance(request, dict) else None
+    try:
+        if not isinstance(request, dict):
+            raise ValueError("запит має бути JSON-об'єктом")
+        handler = AGENT_METHODS.get(request.get("method"))
+        if handler is None:
+            raise ValueError(f"невідомий метод {request.get('method')!r}")
+        reply = {"id": request_id, "result": await handler(request.get("params") or {})}
+    except Exception as e:
+        reply = {"id": request_id, "error": str(e)}
+    try:
+        await fleet_send(writer, reply)
+    except ConnectionError:
+        pass
+
+
+async def handle_agent_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    peer = writer.get_extra_info("peername")
+    try:
+        nonce = os.urandom(16).hex()
+        await fleet_send(writer, {"nonce": nonce})
+        line = await asyncio.wait_for(reader.readline(), timeout=FLEET_TIMEOUT)
+        message = json.loads(line or b"{}")
+        auth = message.get("auth") if isinstance(message, dict) else None
+        # Байти: compare_digest не приймає не-ASCII рядки
+        if not isinstance(auth, str) or not hmac.compare_digest(
+            auth.encode(), fleet_signature(nonce).encode()
+        ):
+            logging.warning(f"Fleet: невдала автентифікація {peer}")
+            return
+        while line := await reader.readline():
+            spawn(agent_dispatch(json.loads(line), writer))
+    except (asyncio.TimeoutError, ConnectionError, ValueError) as e:
+        logging.warning(f"Fleet: з'єднання {peer} закрито: {e}")
+    finally:
+        writer.close()
+
+
+async def start_agent_server(address: str = FLEET_AGENT_LISTEN):
+    ssl_context = None
+    if FLEET_TLS_CERT:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(FLEET_TLS_CERT, FLEET_TLS_KEY or None)
+    kind, host, port = parse_fleet_endpoint(address)
+    if kind == "unix":
+        return await asyncio.start_unix_server(
+            handle_agent_connection, host, limit=FLEET_REQUEST_LIMIT
+        )
+    return await asyncio.start_server(
+        handle_agent_connection, host, port, ssl=ssl_context, limit=FLEET_REQUEST_LIMIT
+    )
+
+
+class AgentClient:
+    """Постійне з'єднання з одним агентом; перепідключається за потреби"""
+
+    def __init__(self, name: str, address: str):
+        self.name = name
+        self.address = address
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._pending: dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _connect(self):
+        kind, host, port = parse_fleet_endpoint(self.address)
+        if kind == "unix":
+            reader, writer = await asyncio.open_unix_connection(
+                host, limit=FLEET_STREAM_LIMIT
+            )
+        else:
+            ssl_context = None
+            if FLEET_TLS_CA:
+                ssl_context = ssl.create_default_context(cafile=FLEET_TLS_CA)
+                # Агентів часто адресують за IP — перевіряємо лише ланцюжок сертифікатів
+                ssl_context.check_hostname = False
+            reader, writer = await asyncio.open_connection(
+                host, port, ssl=ssl_context, limit=FLEET_STREAM_LIMIT
+            )
+        hello = json.loads(await reader.readline() or b"{}")
+        await fleet_send(writer, {"auth": fleet_signature(hello.get("nonce", ""))})
+        self._reader, self._writer = reader, writer
+        spawn(self._read_loop(reader))
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        try:
+            while line := await reader.readline():
+                reply = json.loads(line)
+                future = self._pending.pop(reply.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in reply:
+                    future.set_exception(RuntimeError(reply["error"]))
+                else:
+                    future.set_result(reply.get("result"))
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("з'єднання з агентом втрачено"))
+        self._pending.clear()
+
+    async def call(self, method: str, params: dict | None = None):
+        async with self._connect_lock:
+            if not self.connected:
+                await self._connect()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await fleet_send(
+                self._writer, {"id": request_id, "method": method, "params": params or {}}
+            )
+            return await future
+        finally:
+            self._pending.pop(request_id, None)
+
+
+class Fleet:
+    """Паралельні запити до всіх агентів з тайм-аутом на кожен хост"""
+
+    def __init__(self, agents: dict[str, str]):
+        self.clients = {name: AgentClient(name, address) for name, address in agents.items()}
+
+    async def _call(self, client: AgentClient, method: str, params: dict | None, timeout: float):
+        try:
+            return (True, await asyncio.wait_for(client.call(method, params), timeout))
+        except asyncio.TimeoutError:
+            return (False, "тайм-аут")
+        except Exception as e:
+            if isinstance(e, (ConnectionError, OSError)):
+                client.close()
+            return (False, str(e) or type(e).__name__)
+
+    async def fan_out(
+        self, method: str, params: dict | None = None, timeout: float = FLEET_TIMEOUT
+    ) -> dict[str, tuple[bool, object]]:
+        names = list(self.clients)
+        results = await asyncio.gather(
+            *(self._call(self.clients[name], method, params, timeout) for name in names)
+        )
+        return dict(zip(names, results))
+
+    async def summary(self) -> str:
+        dashboards, updates, failed = await asyncio.gather(
+            self.fan_out("dashboard"),
+            # Перевірка оновлень на агенті може тривати довше
+            self.fan_out("updates", timeout=max(FLEET_TIMEOUT, 120)),
+            self.fan_out("failed"),
+        )
+        lines = []
+        offline, with_updates, with_failed = [], 0, 0
+        for name in self.clients:
+            ok, dash = dashboards[name]
+            if not ok:
+                offline.append(name)
+                lines.append(f"❌ <b>{html.escape(name)}</b>: {html.escape(str(dash))}")
+                continue
+            sample = dash["sample"]
+            line = (
+                f"🖥 <b>{html.escape(name)}</b>: CPU {sample['cpu_percent']:.0f}% · "
+                f"RAM {sample['mem_percent']:.0f}% · Disk {sample['disk_percent']:.0f}%"
+            )
+            ok, upd = updates[name]
+            if ok and upd["updates"]:
+                with_updates += 1
+                line += f" · 📦 {len(upd['updates'])}"
+            ok, units = failed[name]
+            if ok and units["units"]:
+                with_failed += 1
+                line += f" · 🔥 {', '.join(units['units'][:3])}"
+            lines.append(line)
+        online = len(self.clients) - len(offline)
+        header = (
+            f"🛰 <b>Флот: {online}/{len(self.clients)} онлайн</b>\n"
+            f"📦 {with_updates} хостів з оновленнями, "
+            f"🔥 {with_failed} зі службами, що впали"
+        )
+        return header + "\n\n" + "\n".join(lines)
+
+
+FLEET = Fleet(FLEET_AGENTS)
+
+
+async def agent_main():
+    """Режим агента: без Telegram, лише RPC для бота-контролера"""
+    if not FLEET_SECRET:
+        raise ValueError("Помилка: для режиму агента потрібен FLEET_SECRET у .env файлі.")
+    # Сповіщення надсилає лише бот — агент нічого не ставить у чергу:
+    # NOTIFIER.run тут не запущений, тож і алерти, і зміни юнітів вимкнені
+    SYSTEMD_WATCHER.on_change = None
+    ALERT_ENGINE.rules = []
+    spawn(metrics_sampler())
+    spawn(SYSTEMD_WATCHER.run())
+    server = await start_agent_server()
+    logging.info(f"🛰 Агент слухає {FLEET_AGENT_LISTEN}")
+    async with server:
+        await server.serve_forever()
+
+
+# --- КЛАВІАТУРИ ---
+def get_main_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.button(text="📊 Стан системи", callback_data="sys_dashboard")
+    builder.button(text="🚀 Оновити", callback_data="run_upgrade")
+    builder.button(text="⚠️ Перевірка сервісів", callback_data="sys_failed")
+    builder.button(text="🔄 Перевірка оновлень", callback_data="check_updates")
+    builder.button(text="🌐 Мережа (IP/Ports)", callback_data="net_menu")
+    builder.button(text="📄 Логи", callback_data="logs_menu")
+    builder.button(text="📈 Графіки", callback_data="chart:1d")
+    builder.button(text="🔝 Процеси", callback_data="procs:cpu")
+    builder.button(text="💽 Диск", callback_data="du_root")
+    if FLEET.clients:
+        builder.button(text="🛰 Флот", callback_data="fleet_summary")
+    builder.adjust(2, 2, 2, 2)
+    return builder.as_markup()
+
+
+def get_processes_keyboard(rows: list[ProcessRow], sort: str):
+    builder = InlineKeyboardBuilder()
+    for key, text in (("cpu", "🔥 CPU"), ("mem", "🧠 RAM"), ("io", "💽 IO")):
+        builder.button(
+            text=f"• {text}" if key == sort else text, callback_data=f"procs:{key}"
+        )
+    builder.button(text="🔄", callback_data=f"procs:{sort}")
+    for row in rows:
+        builder.button(
+            text=f"{row.name[:14]} · {row.pid}",
+            callback_data=f"proc:{row.pid}:{int(row.started)}:{sort}",
+        )
+    builder.button(text="🔙 Назад", callback_data="menu_main")
+    builder.adjust(4, *[2] * (len(rows) // 2), 1)
+    return builder.as_markup()
+
+
+def get_process_keyboard(pid: int, started: int, sort: str):
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🛑 SIGTERM", callback_data=f"procact:term:{pid}:{started}")
+    builder.button(text="☠️ SIGKILL", callback_data=f"procact:kill:{pid}:{started}")
+    builder.button(text="⚖️ nice 0", callback_data=f"procact:nice0:{pid}:{started}")
+    builder.button(text="🐢 nice 10", callback_data=f"procact:nice10:{pid}:{started}")
+    builder.button(text="🐌 nice 19", callback_data=f"procact:nice19:{pid}:{started}")
+    builder.button(text="🔄", callback_data=f"proc:{pid}:{started}:{sort}")
+    builder.button(text="🔙 До списку", callback_data=f"procs:{sort}")
+    builder.adjust(2, 3, 2)
+    return builder.as_markup()
+
+
+def get_disk_usage_keyboard(report_id: int, report: DiskUsageReport):
+    builder = InlineKeyboardBuilder()
+    for index, (size, path) in enumerate(report.children):
+        builder.button(
+            text=f"📁 {os.path.basename(path)[:20]} · {format_bytes(size)}",
+            callback_data=f"du:{report_id}:{index}",
+        )
+    navigation = 2
+    if report.root != "/":
+        builder.button(text="⬆️ Вгору", callback_data=f"du:{report_id}:up")
+        navigation += 1
+    builder.button(text="🔄 Оновити", callback_data=f"du:{report_id}:re")
+    builder.button(text="🔁 Без кешу", callback_data=f"du:{report_id}:full")
+    rows, odd = divmod(len(report.children), 2)
+    builder.adjust(*[2] * rows, *[1] * odd, navigation)
+    return builder.as_markup()
+
+
+def get_network_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🟢 Start SSH", callback_data="ssh_start")
+    builder.button(text="🔴 Stop SSH", callback_data="ssh_stop")
+    builder.button(text="☠️ Kill Active Sessions", callback_data="ssh_kill")  
+    builder.button(text="🌍 Зовнішня IP", callback_data="net_ip")
+    builder.button(text="🛡 Відкриті порти", callback_data="net_ports")
+    builder.button(text="🚀 Speedtest", callback_data="net_speed")
+    builder.button(text="🔙 Назад", callback_data="menu_main")
+    builder.adjust(2, 1, 2, 1, 1)
+    return builder.as_markup()
+
+
+def get_logs_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.button(text="📄 Логи (поточні)", callback_data="get_logs_current")
+    builder.button(text="🚨 Помилки (поточні)", callback_data="get_errors_current")
+    builder.button(text="📄 Логи (минулі)", callback_data="get_logs_previous")
+    builder.button(text="🚨 Помилки (минулі)", callback_data="get_errors_previous")
+    builder.button(text="🔎 Пошук у журналі", callback_data="journal_help")
+    builder.button(text="📡 Живий журнал", callback_data="tail_help")
+    builder.button(text="🔙 Назад", callback_data="menu_main")
+    builder.adjust(2, 2, 2, 1)
+    return builder.as_markup()
+
+
+def get_journal_keyboard(search_id: int, page: int, has_more: bool):
+    builder = InlineKeyboardBuilder()
+    if page > 0:
+        builder.button(text="⬅️", callback_data=f"jsearch:{search_id}:{page - 1}")
+    if has_more:
+        builder.button(text="➡️ Далі", callback_data=f"jsearch:{search_id}:{page + 1}")
+    return builder.as_markup()
+
+
+# --- ОБРОБНИКИ (HANDLERS) ---
+@router.message(Command("start"))
+async def send_welcome(message: types.Message, state: FSMContext):
+    await state.clear()
+    await message.answer(
+        "👋 Привіт! Бот моніторингу активний.",
+        reply_markup=get_main_keyboard(),
+    )
+
+
+@router.callback_query(F.data == "menu_main")
+async def menu_main(cb: CallbackQuery):
+    await cb.message.edit_text("Головне меню:", reply_markup=get_main_keyboard())
+
+
+@router.callback_query(F.data == "logs_menu")
+async def menu_logs(cb: CallbackQuery):
+    await cb.message.edit_text(
+        "Оберіть потрібні логи:", reply_markup=get_logs_keyboard()
+    )
+
+
+@router.callback_query(F.data == "net_menu")
+async def menu_network(cb: CallbackQuery):
+    await cb.message.edit_text(
+        "Мережеві інструменти:", reply_markup=get_network_keyboard()
+    )
+
+
+# --- DASHBOARD & SERVICES ---
+@router.callback_query(F.data == "sys_dashboard")
+async def show_dashboard(cb: CallbackQuery):
+    if METRICS_HISTORY:
+        # Рендер з останнього заміру, без блокування
+        msg = get_system_dashboard()
+    else:
+        msg = await run_in_thread(get_system_dashboard)
+    try:
+        await cb.message.edit_text(
+            msg, parse_mode="HTML", reply_markup=get_main_keyboard()
+        )
+    except Exception:
+        await cb.message.answer(msg, parse_mode="HTML")
+
+
+def build_metrics_chart(range_name: str) -> tuple[bytes, str]:
+    """PNG та підпис з підсумками за діапазон (у потоці: рендер — чистий Python)"""
+    seconds = CHART_RANGES[range_name]
+    end = time.time()
+    step, points = METRICS_DB.query(seconds, CHART_POINTS, end)
+    summary = []
+    for name, title, _, _ in CHART_PANELS:
+        series = RRD_SERIES.index(name)
+        values = [v[series] for _, v in points if v[series] is not None]
+        if values:
+            avg = sum(value[0] for value in values) / len(values)
+            peak = max(value[2] for value in values)
+            summary.append(f"{title}: сер. {avg:.0f}, макс {peak:.0f}")
+    caption = f"📈 За {range_name} (крок {format_step(step)})\n" + (
+        "\n".join(summary) or "Даних за цей період ще немає."
+    )
+    return render_metrics_chart(points, end - seconds, end, step), caption
+
+
+def get_chart_keyboard(current: str):
+    builder = InlineKeyboardBuilder()
+    for name in CHART_RANGES:
+        text = f"• {name} •" if name == current else name
+        builder.button(text=text, callback_data=f"chart:{name}")
+    builder.adjust(len(CHART_RANGES))
+    return builder.as_markup()
+
+
+@router.message(Command("chart"))
+async def chart_command(message: Message):
+    """/chart [1h|6h|1d|7d|30d|1y] — графіки CPU, RAM, диска та температури"""
+    if METRICS_DB.mm is None:
+        await message.answer("📈 Історія метрик вимкнена (METRICS_DB_FILE).")
+        return
+    args = (message.text or "").split()[1:]
+    range_name = args[0] if args else "1d"
+    if range_name not in CHART_RANGES:
+        await message.answer(f"Використання: /chart [{'|'.join(CHART_RANGES)}]")
+        return
+    image, caption = await run_in_thread(build_metrics_chart, range_name)
+    await message.answer_photo(
+        BufferedInputFile(image, "metrics.png"),
+        caption=caption,
+        reply_markup=get_chart_keyboard(range_name),
+    )
+
+
+@router.callback_query(F.data.startswith("chart:"))
+async def chart_handler(cb: CallbackQuery):
+    range_name = cb.data.split(":", 1)[1]
+    if METRICS_DB.mm is None or range_name not in CHART_RANGES:
+        await cb.answer("📈 Історія метрик вимкнена (METRICS_DB_FILE).")
+        return
+    await cb.answer()
+    image, caption = await run_in_thread(build_metrics_chart, range_name)
+    photo = BufferedInputFile(image, "metrics.png")
+    if cb.message.photo:
+        # Перемикання діапазону — замінюємо картинку в тому ж повідомленні
+        try:
+            await cb.message.edit_media(
+                InputMediaPhoto(media=photo, caption=caption),
+                reply_markup=get_chart_keyboard(range_name),
+            )
+        except Exception:
+            pass
+        return
+    await cb.message.answer_photo(photo, caption=caption, reply_markup=get_chart_keyboard(range_name))
+
+
+@router.callback_query(F.data == "sys_failed")
+async def show_failed_services(cb: CallbackQuery):
+    await cb.answer("Перевіряю сервіси...")
+    if SYSTEMD_WATCHER.connected:
+        # Відповідь зі стану, який підтримується сигналами D-Bus
+        msg = SYSTEMD_WATCHER.render_failed()
+    else:
+        msg = await run_in_thread(get_failed_services)
+    await cb.message.answer(msg, parse_mode="HTML")
+
+
+@router.message(Command("alerts"))
+async def show_alerts(message: Message):
+    await message.answer(
+        f"🚨 <b>Алерти:</b>\n{ALERT_ENGINE.render()}", parse_mode="HTML"
+    )
+
+
+@router.message(Command("stats"))
+async def show_bot_stats(message: Message):
+    await message.answer(
+        f"🗄 <b>Кеш IP:</b>\n"
+        f"💻 DNS: {HOSTNAME_CACHE.stats()}\n"
+        f"🌍 GeoIP: {GEOIP_CACHE.stats()}\n"
+        f"🔌 Сусіди: {NEIGHBORS.stats()}\n\n"
+        f"📨 <b>Сповіщення:</b> {NOTIFIER.stats()}\n"
+        f"🐉 <b>SSH-монітор:</b> записів {SSH_MONITOR_STATS['entries']}, "
+        f"подій {SSH_MONITOR_STATS['events']}, перезапусків {SSH_MONITOR_STATS['restarts']}\n"
+        f"🗃 <b>База SSH:</b> {SSH_STORE.stats()}\n"
+        f"🛡 <b>Перебір паролів:</b> {BRUTEFORCE.stats()}\n"
+        f"⚙️ <b>Задачі:</b> {JOBS.stats()}\n"
+        f"📡 <b>Живий журнал:</b> {FOLLOWER.stats()}\n"
+        f"🔝 <b>Процеси:</b> {PROCESS_SAMPLER.stats()}\n"
+        f"💽 <b>Кеш аналізу диска:</b> {DISK_USAGE_CACHE.stats()}\n"
+        f"📈 <b>Історія метрик:</b> {METRICS_DB.stats()}",
+        parse_mode="HTML",
+    )
+
+
+# --- PROCESSES ---
+async def show_top_processes(message: Message, sort: str, edit: bool):
+    rows = await PROCESS_SAMPLER.top(sort)
+    text = render_top_processes(rows, sort)
+    keyboard = get_processes_keyboard(rows, sort)
+    if edit:
+        try:
+            await message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+        except Exception:
+            pass
+    else:
+        await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+
+@router.message(Command("top"))
+async def top_command(message: Message):
+    """/top [cpu|mem|io] — процеси, що найбільше навантажують систему"""
+    args = (message.text or "").split()[1:]
+    sort = args[0].lower() if args else "cpu"
+    if sort not in PROCESS_SORT_KEYS:
+        await message.answer("Використання: /top [cpu|mem|io]")
+        return
+    await show_top_processes(message, sort, edit=False)
+
+
+@router.callback_query(F.data.startswith("procs:"))
+async def top_processes_callback(cb: CallbackQuery):
+    sort = cb.data.split(":")[1]
+    if sort not in PROCESS_SORT_KEYS:
+        await cb.answer()
+        return
+    await cb.answer()
+    await show_top_processes(cb.message, sort, edit=True)
+
+
+@router.callback_query(F.data.startswith("proc:"))
+async def process_details(cb: CallbackQuery):
+    _, pid, started, sort = cb.data.split(":")
+    text = await run_in_thread(describe_process, int(pid), int(started))
+    if text is None:
+        await cb.answer("Процес вже завершився.", show_alert=True)
+        return
+    await cb.answer()
+    try:
+        await cb.message.edit_text(
+            text, parse_mode="HTML",
+            reply_markup=get_process_keyboard(int(pid), int(started), sort),
+        )
     except Exception:
         pass
 
-    return f"🌐 Інфо недоступне\n{device_str}"
 
+@router.callback_query(F.data.startswith("procact:"))
+async def process_action(cb: CallbackQuery, state: FSMContext):
+    _, action, pid, started = cb.data.split(":")
+    if action not in PROCESS_ACTIONS:
+        await cb.answer()
+        return
+    await state.update_data(proc_action=action, proc_pid=int(pid), proc_started=int(started))
+    await state.set_state(ActionStates.waiting_for_process_password)
+    label = PROCESS_ACTIONS[action][0]
+    await cb.message.answer(
+        f"🔑 Ви хочете <b>{label}</b> для процесу з PID {pid}.\nВведіть sudo пароль:",
+        parse_mode="HTML",
+    )
+    await cb.answer()
 
-# --- SSH МОНІТОРИНГ ---
-async def monitor_ssh_logins(bot: Bot):
-    logging.info("🐉 Arch Linux SSH Monitor: ЗАПУЩЕНО")
-    cmd = ["journalctl", "-f", "-n", "0", "-o", "cat"]
 
+# --- DISK USAGE ---
+async def disk_progress_updater(msg: Message, scanner: DiskUsageScanner, job: Job):
+    """Показує хід сканування не частіше ніж DISK_SCAN_PROGRESS_INTERVAL"""
+    last_text = ""
+    while True:
+        await asyncio.sleep(DISK_SCAN_PROGRESS_INTERVAL)
+        text = scanner.render_progress()
+        if text != last_text:
+            try:
+                await msg.edit_text(text, parse_mode="HTML", reply_markup=job_cancel_keyboard(job))
+                last_text = text
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except Exception:
+                pass
+
+
+async def send_disk_usage(message: Message, scanner: DiskUsageScanner, job: Job, edit: bool):
+    text = scanner.render_progress()
+    if edit:
+        await message.edit_text(text, parse_mode="HTML", reply_markup=job_cancel_keyboard(job))
+    else:
+        message = await message.answer(
+            text, parse_mode="HTML", reply_markup=job_cancel_keyboard(job)
+        )
+    updater = spawn(disk_progress_updater(message, scanner, job))
     try:
-        process = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        report = await run_in_thread(scanner.run)
+    except OSError as e:
+        await message.edit_text(
+            f"❌ Не вдалося прочитати {html.escape(scanner.root)}: {html.escape(str(e))}",
+            parse_mode="HTML",
         )
+        return
+    finally:
+        updater.cancel()
+    report_id = register_disk_report(report)
+    await message.edit_text(
+        render_disk_usage(report), parse_mode="HTML",
+        reply_markup=get_disk_usage_keyboard(report_id, report),
+    )
 
-        logging.info("✅ Процес journalctl підключено.")
 
-        regex_login = re.compile(
-            r"Accepted\s+(password|publickey)\s+for\s+(\S+)\s+from\s+(\S+)\s+port\s+(\d+)"
-        )
-        regex_logout = re.compile(
-            r"Disconnected\s+from\s+(?:user\s+)?(\S+)\s+(\S+)\s+port\s+(\d+)"
-        )
+async def start_disk_scan(message: Message, path: str, use_cache: bool = True, edit: bool = False) -> bool:
+    """Ставить сканування в чергу JOBS; False, якщо цей шлях вже сканується"""
+    scanner = DiskUsageScanner(path, use_cache=use_cache)
+    # job потрапляє в замикання: factory викликається вже після submit()
+    job, created = JOBS.submit(
+        "disk",
+        f"Аналіз диска {path}",
+        lambda: send_disk_usage(message, scanner, job, edit),
+        key=f"du:{path}",
+        on_cancel=scanner.cancel,
+    )
+    if created:
+        await report_job_queue(message, job)
+    return created
 
-        while True:
-            line = await process.stdout.readline()
-            if not line:
-                break
 
-            decoded_line = line.decode("utf-8", errors="replace").strip()
+@router.message(Command("du"))
+async def disk_usage_command(message: Message):
+    """/du [шлях] — що займає місце на розділі (за замовчуванням /)"""
+    path = os.path.realpath((message.text or "").partition(" ")[2].strip() or "/")
+    if not os.path.isdir(path):
+        await message.answer("Використання: /du [каталог]")
+        return
+    if not await start_disk_scan(message, path):
+        await message.answer(f"⏳ {html.escape(path)} вже сканується.")
 
-            if "ssh" not in decoded_line.lower():
-                continue
 
-            # DEBUG вивід
-            if (
-                "Accepted" in decoded_line
-                or "Disconnected" in decoded_line
-                or "session closed" in decoded_line
-            ):
-                print(f"[DEBUG LOG]: {decoded_line}")
-
-            # === ВХІД ===
-            if "Accepted" in decoded_line:
-                match = regex_login.search(decoded_line)
-                if match:
-                    method, user, ip, port = match.groups()
-
-                    # Отримуємо розширену інфу про пристрій
-                    geo_and_device = await get_ip_details(ip)
-
-                    msg = (
-                        f"🚨 <b>SSH: Вхід (Arch)!</b>\n"
-                        f"👤 Юзер: <code>{user}</code>\n"
-                        f"🔑 Метод: {method}\n"
-                        f"🖥 IP: <code>{ip}</code>\n"
-                        f"{geo_and_device}"
-                    )
-                    try:
-                        await bot.send_message(ALLOWED_USER_ID, msg, parse_mode="HTML")
-                    except Exception as e:
-                        logging.error(f"Send Login Error: {e}")
-
-            # === ВИХІД (Disconnected) ===
-            elif "Disconnected from" in decoded_line:
-                match = regex_logout.search(decoded_line)
-                if match:
-                    user_or_ip = match.group(1)
-                    if user_or_ip.replace(".", "").isdigit():
-                        user = "Невідомо (preauth)"
-                        ip = user_or_ip
-                    else:
-                        user = user_or_ip
-                        ip = match.group(2)
+@router.callback_query(F.data == "du_root")
+async def disk_usage_root(cb: CallbackQuery):
+    if await start_disk_scan(cb.message, "/"):
+        await cb.answer()
+    else:
+        await cb.answer("⏳ Аналіз диска вже виконується.")
 
-                    msg = (
-                        f"👋 <b>SSH: Відключено</b>\n"
-                        f"👤 Юзер: <code>{user}</code>\n"
-                        f"🖥 IP: <code>{ip}</code>"
-                    )
-                    try:
-                        await bot.send_message(ALLOWED_USER_ID, msg, parse_mode="HTML")
-                    except Exception:
-                        pass
-
-            # === ВИХІД (PAM Session Closed) ===
-            elif "session closed" in decoded_line and "user" in decoded_line:
-                parts = decoded_line.split()
-                if "user" in parts:
-                    try:
-                        user_index = parts.index("user") + 1
-                        if user_index < len(parts):
-                            user = parts[user_index]
-                            await bot.send_message(
-                                ALLOWED_USER_ID,
-                                f"👋 <b>SSH: Сесію завершено</b>\n👤 Юзер: <code>{user}</code>",
-                                parse_mode="HTML",
-                            )
-                    except Exception:
-                        pass
 
-    except Exception as e:
-        logging.error(f"❌ SSH Monitor CRITICAL ERROR: {e}")
+@router.callback_query(F.data.startswith("du:"))
+async def disk_usage_navigate(cb: CallbackQuery):
+    _, report_id, action = cb.data.split(":")
+    report = DISK_REPORTS.get(int(report_id))
+    if report is None:
+        await cb.answer("⌛ Результат застарів, повторіть /du.", show_alert=True)
+        return
+    if action == "up":
+        path = os.path.dirname(report.root)
+    elif action in ("re", "full"):
+        path = report.root
+    else:
+        path = report.children[int(action)][1]
+    # Перехід у підкаталог майже миттєвий: його каталоги вже в кеші
+    if await start_disk_scan(cb.message, path, use_cache=action != "full", edit=True):
+        await cb.answer()
+    else:
+        await cb.answer("⏳ Цей каталог вже сканується.")
 
 
-# --- КЛАВІАТУРИ ---
-def get_main_keyboard():
-    builder = InlineKeyboardBuilder()
-    builder.button(text="📊 Стан системи", callback_data="sys_dashboard")
-    builder.button(text="🚀 Оновити", callback_data="run_upgrade")
-    builder.button(text="⚠️ Перевірка сервісів", callback_data="sys_failed")
-    builder.button(text="🔄 Перевірка оновлень", callback_data="check_updates")
-    builder.button(text="🌐 Мережа (IP/Ports)", callback_data="net_menu")
-    builder.button(text="📄 Логи", callback_data="logs_menu")
-    builder.adjust(2, 2, 2)
-    return builder.as_markup()
+# --- SSH HISTORY ---
+SSH_STORE_DISABLED = "🗃 База SSH-подій вимкнена або ще не відкрита (SSH_DB_FILE)."
 
 
-def get_network_keyboard():
-    builder = InlineKeyboardBuilder()
-    builder.button(text="🟢 Start SSH", callback_data="ssh_start")
-    builder.button(text="🔴 Stop SSH", callback_data="ssh_stop")
-    builder.button(text="☠️ Kill Active Sessions", callback_data="ssh_kill")  
-    builder.button(text="🌍 Зовнішня IP", callback_data="net_ip")
-    builder.button(text="🛡 Відкриті порти (Файл)", callback_data="net_ports")
-    builder.button(text="🚀 Speedtest", callback_data="net_speed")
-    builder.button(text="🔙 Назад", callback_data="menu_main")
-    builder.adjust(2, 1, 2, 1, 1)
-    return builder.as_markup()
+@router.message(Command("ssh_top"))
+async def ssh_top_command(message: Message):
+    """/ssh_top [днів] — IP з найбільшою кількістю входів"""
+    if SSH_STORE.conn is None:
+        await message.answer(SSH_STORE_DISABLED)
+        return
+    args = (message.text or "").split()[1:]
+    try:
+        days = float(args[0]) if args else 7
+    except ValueError:
+        await message.answer("Використання: /ssh_top [днів]")
+        return
+    await SSH_STORE.flush()
+    rows = await run_in_thread(SSH_STORE.top_ips, days)
+    if not rows:
+        await message.answer(f"За {days:g} дн. SSH-подій немає.")
+        return
+    lines = [
+        f"<code>{html.escape(ip)}</code>: входів {logins}, невдалих {failed}, "
+        f"подій {events}, юзерів {users}, останнє {format_ts(last)}"
+        for ip, logins, failed, events, users, last in rows
+    ]
+    await message.answer(
+        f"🏆 <b>Топ IP за {days:g} дн.:</b>\n" + "\n".join(lines), parse_mode="HTML"
+    )
 
 
-def get_logs_keyboard():
-    builder = InlineKeyboardBuilder()
-    builder.button(text="📄 Логи (поточні)", callback_data="get_logs_current")
-    builder.button(text="🚨 Помилки (поточні)", callback_data="get_errors_current")
-    builder.button(text="📄 Логи (минулі)", callback_data="get_logs_previous")
-    builder.button(text="🚨 Помилки (минулі)", callback_data="get_errors_previous")
-    builder.button(text="🔙 Назад", callback_data="menu_main")
-    builder.adjust(2, 2, 1)
-    return builder.as_markup()
+@router.message(Command("ssh_attacks"))
+async def ssh_attacks_command(message: Message):
+    """/ssh_attacks — поточні лічильники невдалих спроб"""
+    top = BRUTEFORCE.render_top(time.time())
+    await message.answer(
+        f"🛡 <b>Невдалі входи SSH:</b>\n{top}" if top else "🛡 Невдалих спроб входу за вікно немає.",
+        parse_mode="HTML",
+    )
 
 
-# --- ОБРОБНИКИ (HANDLERS) ---
-@router.message(Command("start"))
-async def send_welcome(message: types.Message, state: FSMContext):
-    await state.clear()
+@router.message(Command("ssh_active"))
+async def ssh_active_command(message: Message):
+    if SSH_STORE.conn is None:
+        await message.answer(SSH_STORE_DISABLED)
+        return
+    await SSH_STORE.flush()
+    rows = await run_in_thread(SSH_STORE.active_sessions)
+    if not rows:
+        await message.answer("🟢 Активних SSH-сесій немає.")
+        return
+    now = time.time()
+    lines = [
+        f"👤 <code>{html.escape(user)}</code> з <code>{html.escape(ip)}</code> "
+        f"({html.escape(method or '?')}), з {format_ts(start)}, {format_duration(now - start)}"
+        for user, ip, port, method, start in rows
+    ]
     await message.answer(
-        "👋 Привіт! Бот моніторингу активний.",
-        reply_markup=get_main_keyboard(),
+        f"🟢 <b>Активні SSH-сесії ({len(rows)}):</b>\n" + "\n".join(lines),
+        parse_mode="HTML",
     )
 
 
-@router.callback_query(F.data == "menu_main")
-async def menu_main(cb: CallbackQuery):
-    await cb.message.edit_text("Головне меню:", reply_markup=get_main_keyboard())
+@router.message(Command("ssh_history"))
+async def ssh_history_command(message: Message):
+    """/ssh_history <юзер> — останні сесії користувача з тривалістю"""
+    if SSH_STORE.conn is None:
+        await message.answer(SSH_STORE_DISABLED)
+        return
+    args = (message.text or "").split()[1:]
+    if not args:
+        await message.answer("Використання: /ssh_history <юзер>")
+        return
+    await SSH_STORE.flush()
+    rows = await run_in_thread(SSH_STORE.user_history, args[0])
+    if not rows:
+        await message.answer(f"Сесій користувача {args[0]} не знайдено.")
+        return
+    lines = [
+        f"{format_ts(start)} <code>{html.escape(ip)}</code> "
+        + (f"{format_duration(duration)}" if end is not None else "🟢 активна")
+        for ip, method, start, end, duration in rows
+    ]
+    await message.answer(
+        f"📜 <b>Сесії {html.escape(args[0])}:</b>\n" + "\n".join(lines), parse_mode="HTML"
+    )
 
 
-@router.callback_query(F.data == "logs_menu")
-async def menu_logs(cb: CallbackQuery):
-    await cb.message.edit_text(
-        "Оберіть потрібні логи:", reply_markup=get_logs_keyboard()
-    )
+# --- JOBS ---
+def job_cancel_keyboard(job: Job):
+    builder = InlineKeyboardBuilder()
+    builder.button(text="⛔ Скасувати", callback_data=f"job_cancel:{job.id}")
+    return builder.as_markup()
 
 
-@router.callback_query(F.data == "net_menu")
-async def menu_network(cb: CallbackQuery):
-    await cb.message.edit_text(
-        "Мережеві інструменти:", reply_markup=get_network_keyboard()
-    )
+def render_job_status(job: Job) -> str:
+    position = JOBS.position(job)
+    if position:
+        return f"🕒 {job.title}: у черзі, позиція {position}"
+    return f"▶️ {job.title}: виконується"
 
 
-# --- DASHBOARD & SERVICES ---
-@router.callback_query(F.data == "sys_dashboard")
-async def show_dashboard(cb: CallbackQuery):
-    msg = await asyncio.to_thread(get_system_dashboard)
+async def report_job_queue(message: Message, job: Job):
+    """Якщо задача чекає в черзі — показує позицію з кнопкою скасування"""
+    if job.started is not None or job.done:
+        return
+    status = await message.answer(render_job_status(job), reply_markup=job_cancel_keyboard(job))
+    spawn(track_job_status(status, job))
+
+
+async def track_job_status(status: Message, job: Job):
+    """Оновлює позицію в черзі; після завершення задачі прибирає повідомлення"""
+    last_text = status.text
+    while not job.done:
+        await asyncio.wait([job.future], timeout=JOB_STATUS_INTERVAL)
+        text = render_job_status(job)
+        if not job.done and text != last_text:
+            try:
+                await status.edit_text(text, reply_markup=job_cancel_keyboard(job))
+                last_text = text
+            except Exception:
+                pass
     try:
-        await cb.message.edit_text(
-            msg, parse_mode="HTML", reply_markup=get_main_keyboard()
-        )
+        if job.cancelled:
+            await status.edit_text(f"⛔ {job.title}: скасовано")
+        else:
+            await status.delete()
     except Exception:
-        await cb.message.answer(msg, parse_mode="HTML")
+        pass
 
 
-@router.callback_query(F.data == "sys_failed")
-async def show_failed_services(cb: CallbackQuery):
-    await cb.answer("Перевіряю сервіси...")
-    msg = await asyncio.to_thread(get_failed_services)
-    await cb.message.answer(msg, parse_mode="HTML")
+def get_jobs_keyboard():
+    builder = InlineKeyboardBuilder()
+    for job_id in JOBS.jobs:
+        builder.button(text=f"⛔ #{job_id}", callback_data=f"jobs_cancel:{job_id}")
+    builder.button(text="🔄 Оновити", callback_data="jobs_refresh")
+    builder.adjust(4)
+    return builder.as_markup()
+
+
+@router.message(Command("jobs"))
+async def jobs_command(message: Message):
+    """/jobs — задачі, що виконуються та чекають у черзі"""
+    await message.answer(JOBS.render(), parse_mode="HTML", reply_markup=get_jobs_keyboard())
+
+
+@router.callback_query(F.data == "jobs_refresh")
+async def jobs_refresh_handler(cb: CallbackQuery):
+    await cb.answer()
+    try:
+        await cb.message.edit_text(JOBS.render(), parse_mode="HTML", reply_markup=get_jobs_keyboard())
+    except Exception:
+        pass
+
+
+@router.callback_query(F.data.startswith(("job_cancel:", "jobs_cancel:")))
+async def job_cancel_handler(cb: CallbackQuery):
+    prefix, job_id = cb.data.split(":", 1)
+    job = JOBS.cancel(int(job_id))
+    if job is None:
+        await cb.answer("Задача вже завершилась.")
+    else:
+        await cb.answer(f"Скасовую «{job.title}»...")
+        # Скасування асинхронне: даємо задачі завершитись перед оновленням списку
+        await asyncio.wait([job.future], timeout=2)
+    if prefix == "jobs_cancel":
+        await jobs_refresh_handler(cb)
 
 
 # --- NETWORK TOOLS ---
@@ -591,29 +6068,61 @@ async def show_ip(cb: CallbackQuery):
 @router.callback_query(F.data == "net_ports")
 async def show_ports(cb: CallbackQuery):
     await cb.answer("Сканую порти...")
-    wait_msg = await cb.message.answer("⏳ Формую файл з портами...")
-
-    # Запускаємо сканування у потоці
-    file_path = await asyncio.to_thread(get_open_ports_file)
+    try:
+        listeners = await run_in_thread(collect_listeners)
+    except Exception as e:
+        logging.error(f"Помилка сканування портів: {e}")
+        await cb.message.answer(f"❌ Не вдалося прочитати /proc/net: {e}")
+        return
 
-    await wait_msg.delete()
+    opened, closed = PORTS_WATCHER.update(listeners)
+    new_keys = {PortsWatcher._key(l) for l in opened}
+    lines = [
+        ("+ " if PortsWatcher._key(l) in new_keys else "  ") + format_listener(l)
+        for l in listeners
+    ]
+    lines += [f"- {format_listener(l)}" for l in closed]
 
-    if file_path and os.path.exists(file_path):
-        await cb.message.answer_document(FSInputFile(file_path))
-        # Видаляємо файл після відправки
-        os.remove(file_path)
-    else:
-        await cb.message.answer(
-            "❌ Не вдалося створити файл або команда 'ss' відсутня."
-        )
+    header = f"🛡 <b>Відкриті порти: {len(listeners)}</b>"
+    if opened or closed:
+        header += f" (нових: {len(opened)}, закритих: {len(closed)})"
+    for i, chunk in enumerate(split_message(lines)):
+        text = f"<pre>{html.escape(chunk)}</pre>"
+        if i == 0:
+            text = f"{header}\n{text}"
+        await cb.message.answer(text, parse_mode="HTML")
 
 
 @router.callback_query(F.data == "net_speed")
-async def run_speedtest(cb: CallbackQuery):
-    await cb.message.answer("⏳ Запускаю Speedtest... Це займе близько 30 сек.")
+async def speedtest_handler(cb: CallbackQuery):
+    job, created = JOBS.submit(
+        "net",
+        "Тест швидкості",
+        lambda: send_speedtest(cb.message),
+        key="speedtest",
+        timeout=SPEEDTEST_DURATION * 2 + 60,
+    )
+    if not created:
+        await cb.answer(f"⏳ Тест швидкості вже {job.describe()}.")
+        return
     await cb.answer()
-    msg = await asyncio.to_thread(run_speedtest_cli)
-    await cb.message.answer(msg, parse_mode="HTML")
+    await report_job_queue(cb.message, job)
+
+
+async def send_speedtest(message: Message):
+    wait = await message.answer(
+        f"⏳ Тест швидкості... Це займе близько {int(SPEEDTEST_DURATION * 2 + 5)} сек."
+    )
+    try:
+        result = await run_speedtest()
+    except asyncio.CancelledError:
+        await wait.edit_text("⛔ Тест швидкості скасовано.")
+        raise
+    except Exception as e:
+        await wait.edit_text(f"❌ Помилка тесту швидкості: {html.escape(str(e) or 'тайм-аут')}")
+        return
+    history = await run_in_thread(save_speedtest_result, result)
+    await wait.edit_text(format_speedtest(result, history), parse_mode="HTML")
 
 
 # --- UPDATES & REBOOT ---
@@ -627,7 +6136,9 @@ async def process_upgrade(cb: CallbackQuery, state: FSMContext):
 @router.message(ActionStates.waiting_for_upgrade_password)
 @router.message(ActionStates.waiting_for_reboot_password)
 @router.message(ActionStates.waiting_for_ssh_password)
+@router.message(ActionStates.waiting_for_process_password)
 async def handle_password(message: Message, state: FSMContext):
+    global ACTIVE_UPGRADE
     if not message.text:
         return
     password = message.text
@@ -639,10 +6150,54 @@ async def handle_password(message: Message, state: FSMContext):
 
     wait_msg = await message.answer("⏳ Пароль прийнято, виконую...")
     current_state = await state.get_state()
+    data = await state.get_data()
+    # Скидаємо стан одразу, щоб під час довгої операції повідомлення
+    # не сприймалися як пароль
+    await state.clear()
 
     if current_state == ActionStates.waiting_for_upgrade_password:
-        success, output = await asyncio.to_thread(run_system_upgrade, password)
-        await wait_msg.delete()
+        if ACTIVE_UPGRADE is not None:
+            await wait_msg.edit_text("⚠️ Оновлення вже виконується.")
+            return
+
+        progress = ACTIVE_UPGRADE = UpgradeProgress(get_package_manager())
+        # Пакетний менеджер тримає lock: незавершене завантаження зупиняємо,
+        # вже завантажені пакети лишаються в кеші
+        await UPDATE_PREFETCHER.stop()
+        staged = UPDATE_PREFETCHER.staged_bytes
+        job, _ = JOBS.submit(
+            "pkg",
+            "Оновлення системи",
+            lambda: run_system_upgrade(password, progress),
+            key="upgrade",
+            on_cancel=progress.cancel,
+        )
+        await report_job_queue(message, job)
+        updater = spawn(upgrade_progress_updater(wait_msg, progress))
+        try:
+            success, output = await job.wait()
+        except JobCancelled:
+            success, output = False, "⛔ Оновлення скасовано."
+        finally:
+            ACTIVE_UPGRADE = None
+            updater.cancel()
+
+        status = "✅ Оновлення завершено" if success else "❌ Оновлення не вдалося"
+        if staged:
+            status += f"\n📦 З кешу (завантажено наперед): {format_bytes(staged)}"
+        if success:
+            UPDATE_PREFETCHER.upgraded()
+        try:
+            await wait_msg.edit_text(
+                f"{status}\n⏱ {progress.elapsed()}", parse_mode="HTML"
+            )
+        except Exception:
+            pass
+        if progress.log_size:
+            await message.answer_document(
+                BufferedInputFile(progress.log_bytes(), "upgrade_log.txt.gz")
+            )
+
         if success:
             builder = InlineKeyboardBuilder()
             builder.button(text="Так, Reboot", callback_data="reboot_yes")
@@ -654,17 +6209,16 @@ async def handle_password(message: Message, state: FSMContext):
             await message.answer(f"❌ Помилка:\n{output}")
 
     elif current_state == ActionStates.waiting_for_reboot_password:
-        success, output = await asyncio.to_thread(reboot_system, password)
+        success, output = await run_in_thread(reboot_system, password)
         await wait_msg.delete()
         if not success:
             await message.answer(f"❌ Fail:\n{output}")
 
     elif current_state == ActionStates.waiting_for_ssh_password:
         # Отримуємо дію (start/stop), яку ми зберегли раніше
-        data = await state.get_data()
         action = data.get("ssh_action", "start")
 
-        success, output = await asyncio.to_thread(manage_ssh_service, password, action)
+        success, output = await run_in_thread(manage_ssh_service, password, action)
         await wait_msg.delete()
 
         if success:
@@ -672,7 +6226,49 @@ async def handle_password(message: Message, state: FSMContext):
         else:
             await message.answer(f"❌ Помилка:\n{output}")
 
-    await state.clear()
+    elif current_state == ActionStates.waiting_for_process_password:
+        success, output = await run_in_thread(
+            manage_process,
+            password,
+            data.get("proc_pid"),
+            data.get("proc_started"),
+            data.get("proc_action"),
+        )
+        await wait_msg.delete()
+
+        if success:
+            await message.answer(f"✅ Успішно:\n{output}")
+        else:
+            await message.answer(f"❌ Помилка:\n{output}")
+
+
+async def upgrade_progress_updater(msg: Message, progress: UpgradeProgress):
+    """Редагує повідомлення з прогресом не частіше ніж UPGRADE_EDIT_INTERVAL"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="⛔ Скасувати", callback_data="upgrade_cancel")
+    markup = builder.as_markup()
+    last_text = ""
+    while True:
+        text = progress.render()
+        if text != last_text:
+            try:
+                await msg.edit_text(text, parse_mode="HTML", reply_markup=markup)
+                last_text = text
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except Exception:
+                pass
+        await asyncio.sleep(UPGRADE_EDIT_INTERVAL)
+
+
+@router.callback_query(F.data == "upgrade_cancel")
+async def upgrade_cancel(cb: CallbackQuery):
+    job = JOBS.by_key.get("upgrade")
+    if job is None:
+        await cb.answer("Немає активного оновлення.")
+        return
+    JOBS.cancel(job.id)
+    await cb.answer("Скасовую оновлення...")
 
 
 @router.callback_query(F.data == "reboot_yes")
@@ -687,31 +6283,243 @@ async def reboot_cancel(cb: CallbackQuery):
     await cb.message.delete()
 
 
+def get_updates_keyboard(page: int, pages: int):
+    builder = InlineKeyboardBuilder()
+    if page > 0:
+        builder.button(text="⬅️", callback_data=f"updates_page:{page - 1}")
+    if page < pages - 1:
+        builder.button(text="➡️", callback_data=f"updates_page:{page + 1}")
+    builder.button(text="🔄 Перевірити зараз", callback_data="updates_refresh")
+    builder.adjust(2, 1)
+    return builder.as_markup()
+
+
 @router.callback_query(F.data == "check_updates")
 async def check_updates_handler(cb: CallbackQuery):
+    if UPDATE_CHECKER.updates is None:
+        # Кешу ще немає — чекаємо на (можливо вже запущену) перевірку
+        await cb.answer("Перевірка...")
+        job = UPDATE_CHECKER.start()
+        await report_job_queue(cb.message, job)
+        await UPDATE_CHECKER.refresh(job)
+    else:
+        await cb.answer()
+    text, pages = render_updates_page(UPDATE_CHECKER, 0)
+    await cb.message.answer(
+        text, parse_mode="HTML", reply_markup=get_updates_keyboard(0, pages)
+    )
+
+
+@router.callback_query(F.data.startswith("updates_page:"))
+async def updates_page_handler(cb: CallbackQuery):
+    page = int(cb.data.split(":", 1)[1])
+    text, pages = render_updates_page(UPDATE_CHECKER, page)
+    try:
+        await cb.message.edit_text(
+            text, parse_mode="HTML", reply_markup=get_updates_keyboard(page, pages)
+        )
+    except Exception:
+        pass
+    await cb.answer()
+
+
+@router.callback_query(F.data == "updates_refresh")
+async def updates_refresh_handler(cb: CallbackQuery):
     await cb.answer("Перевірка...")
-    chunks = await asyncio.to_thread(check_system_updates)
-    for chunk in chunks:
-        await cb.message.answer(chunk, parse_mode="HTML")
+    job = UPDATE_CHECKER.start()
+    await report_job_queue(cb.message, job)
+    await UPDATE_CHECKER.refresh(job)
+    text, pages = render_updates_page(UPDATE_CHECKER, 0)
+    try:
+        await cb.message.edit_text(
+            text, parse_mode="HTML", reply_markup=get_updates_keyboard(0, pages)
+        )
+    except Exception:
+        pass
+
+
+# --- FLEET HANDLERS ---
+@router.callback_query(F.data == "fleet_summary")
+async def fleet_summary_handler(cb: CallbackQuery):
+    await cb.answer("Опитую агентів...")
+    await cb.message.answer(await FLEET.summary(), parse_mode="HTML")
+
+
+@router.message(Command("fleet"))
+async def fleet_command(message: Message):
+    if not FLEET.clients:
+        await message.answer("🛰 Агенти не налаштовані (FLEET_AGENTS).")
+        return
+    await message.answer(await FLEET.summary(), parse_mode="HTML")
+
+
+@router.message(Command("fleet_logs"))
+async def fleet_logs_command(message: Message):
+    """/fleet_logs <хост> [all] — критичні (або всі) логи поточного завантаження"""
+    args = (message.text or "").split()[1:]
+    client = FLEET.clients.get(args[0]) if args else None
+    if client is None:
+        hosts = ", ".join(FLEET.clients) or "—"
+        await message.answer(f"Використання: /fleet_logs <хост> [all]\nХости: {hosts}")
+        return
+    critical = not (len(args) > 1 and args[1] == "all")
+    wait = await message.answer("⏳ Експорт логів з агента...")
+    try:
+        result = await asyncio.wait_for(
+            client.call("logs", {"critical": critical}), timeout=max(FLEET_TIMEOUT, 300)
+        )
+    except Exception as e:
+        await wait.edit_text(f"❌ {client.name}: {str(e) or 'тайм-аут'}")
+        return
+    await wait.delete()
+    if not result["data"]:
+        await message.answer("❌ Файл пустий або помилка.")
+        return
+    kind = "critical" if critical else "all"
+    await message.answer_document(
+        BufferedInputFile(
+            base64.b64decode(result["data"]), f"{client.name}_{kind}_logs.txt.gz"
+        ),
+        caption=result["summary"] + (" (обрізано)" if result["truncated"] else ""),
+    )
 
 
 # --- LOGS HANDLERS ---
 @router.callback_query(F.data.startswith("get_"))
 async def process_get_logs(cb: CallbackQuery):
-    data = cb.data
+    job, created = JOBS.submit(
+        "logs",
+        "Експорт логів",
+        lambda: send_system_logs(cb.message, cb.data),
+        key=("logs", cb.data),
+        timeout=LOGS_EXPORT_TIMEOUT,
+    )
+    if not created:
+        await cb.answer(f"⏳ Цей експорт уже {job.describe()}.")
+        return
+    await cb.answer()
+    await report_job_queue(cb.message, job)
+
+
+async def send_system_logs(message: Message, data: str):
     is_critical = "errors" in data
     is_previous = "previous" in data
     boot_offset = -1 if is_previous else 0
+    boot_desc = "current" if boot_offset == 0 else "previous"
+    type_desc = "critical" if is_critical else "all"
+    basename = f"{type_desc}_logs_{boot_desc}_boot"
 
-    wait = await cb.message.answer("⏳ Експорт логів...")
-    log_file = await asyncio.to_thread(get_system_logs, is_critical, boot_offset)
-    await wait.delete()
+    wait = await message.answer("⏳ Експорт логів...")
+    export = await get_system_logs(is_critical, boot_offset)
 
-    if log_file and os.path.exists(log_file):
-        await cb.message.answer_document(FSInputFile(log_file))
-        os.remove(log_file)
+    if not export:
+        await wait.delete()
+        await message.answer("❌ Файл пустий або помилка.")
+        return
+
+    try:
+        while not export.eof:
+            part = export.parts + 1
+            suffix = "" if part == 1 else f".part{part}"
+            await message.answer_document(
+                JournalPartFile(export, f"{basename}{suffix}.txt.gz"),
+                request_timeout=600,
+            )
+    except Exception as e:
+        logging.error(f"Помилка відправки логів: {e}")
+        await message.answer(f"❌ Помилка відправки логів: {e}")
     else:
-        await cb.message.answer("❌ Файл пустий або помилка.")
+        await message.answer(export.summary())
+    finally:
+        await export.close()
+        await wait.delete()
+
+
+@router.callback_query(F.data == "journal_help")
+async def journal_help(cb: CallbackQuery):
+    await cb.message.answer(JOURNAL_SEARCH_USAGE, parse_mode="HTML")
+    await cb.answer()
+
+
+async def show_journal_page(search_id: int, page: int) -> tuple[str, object]:
+    search = JOURNAL_SEARCHES.get(search_id)
+    if search is None or page >= len(search.page_cursors):
+        return "⌛ Пошук застарів, повторіть команду /journal.", None
+    try:
+        entries, has_more = await search.fetch(page)
+    except RuntimeError as e:
+        return f"❌ journalctl: {html.escape(str(e))}", None
+    text, has_more = render_journal_page(search, page, entries, has_more)
+    return text, get_journal_keyboard(search_id, page, has_more)
+
+
+@router.message(Command("journal"))
+async def journal_command(message: Message):
+    """/journal <фільтри> — пошук у журналі з посторінковою видачею"""
+    query = (message.text or "").partition(" ")[2]
+    if not query.strip():
+        await message.answer(JOURNAL_SEARCH_USAGE, parse_mode="HTML")
+        return
+    try:
+        filters = parse_journal_query(query)
+    except ValueError as e:
+        await message.answer(f"❌ {html.escape(str(e))}\n\n{JOURNAL_SEARCH_USAGE}", parse_mode="HTML")
+        return
+    search_id = register_journal_search(JournalSearch(filters))
+    text, keyboard = await show_journal_page(search_id, 0)
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+
+@router.callback_query(F.data.startswith("jsearch:"))
+async def journal_page_handler(cb: CallbackQuery):
+    _, search_id, page = cb.data.split(":")
+    await cb.answer()
+    text, keyboard = await show_journal_page(int(search_id), int(page))
+    try:
+        await cb.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    except Exception:
+        pass
+
+
+@router.callback_query(F.data == "tail_help")
+async def live_tail_help(cb: CallbackQuery):
+    await cb.message.answer(LIVE_TAIL_USAGE, parse_mode="HTML")
+    await cb.answer()
+
+
+@router.message(Command("tail"))
+async def live_tail_command(message: Message):
+    """/tail [фільтри] — нові записи журналу в одному повідомленні"""
+    query = (message.text or "").partition(" ")[2].strip()
+    try:
+        tail_filter = TailFilter(parse_journal_query(query) if query else [])
+    except ValueError as e:
+        await message.answer(f"❌ {html.escape(str(e))}\n\n{LIVE_TAIL_USAGE}", parse_mode="HTML")
+        return
+    if len(LIVE_TAILS) >= LIVE_TAIL_MAX:
+        await message.answer(
+            f"⏳ Вже працює {len(LIVE_TAILS)} живих журналів, зупиніть один з них."
+        )
+        return
+    tail = LiveTail(next(_live_tail_ids), tail_filter, query, None)
+    tail.message = await message.answer(
+        tail.render(), parse_mode="HTML", reply_markup=tail.keyboard()
+    )
+    spawn(tail.run())
+
+
+@router.callback_query(F.data.startswith("tail_stop:"))
+async def live_tail_stop(cb: CallbackQuery):
+    tail = LIVE_TAILS.get(int(cb.data.split(":")[1]))
+    if tail is None:
+        await cb.answer("Цей журнал вже зупинено.")
+        try:
+            await cb.message.edit_reply_markup(reply_markup=None)
+        except Exception:
+            pass
+        return
+    tail.stop("Зупинено")
+    await cb.answer("Зупиняю...")
 
 
 @router.callback_query(F.data.in_({"ssh_start", "ssh_stop", "ssh_kill"}))
@@ -738,18 +6546,84 @@ async def process_ssh_manage(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
 
 
-# --- MAIN ---
-async def main():
+# --- ОТРИМАННЯ ОНОВЛЕНЬ (POLLING / WEBHOOK) ---
+def build_dispatcher() -> Dispatcher:
+    """Диспетчер з фільтром власника та вимірюванням часу обробки"""
     dp = Dispatcher(storage=MemoryStorage())
-
     router.message.filter(IsAdminFilter(ALLOWED_USER_ID))
     router.callback_query.filter(IsAdminFilter(ALLOWED_USER_ID))
+    router.message.middleware(handler_timing_middleware)
+    router.callback_query.middleware(handler_timing_middleware)
     dp.include_router(router)
+    return dp
+
+
+def webhook_path(url: str = WEBHOOK_URL) -> str:
+    return urllib.parse.urlsplit(url).path or "/"
+
+
+async def start_webhook_server(
+    dp: Dispatcher,
+    bot: Bot,
+    address: str = WEBHOOK_LISTEN,
+    path: str = "",
+    secret: str = WEBHOOK_SECRET,
+) -> web.AppRunner:
+    """HTTP-сервер для вебхука. Запити без правильного секрету отримують 401,
+    решта віддається диспетчеру у фоні, а Telegram одразу отримує 200.
+    Старт і зупинка сервера викликають startup/shutdown диспетчера."""
+    app = web.Application()
+    SimpleRequestHandler(dp, bot, secret_token=secret).register(
+        app, path=path or webhook_path()
+    )
+    setup_application(app, dp, bot=bot)
+    ssl_context = None
+    if WEBHOOK_TLS_CERT:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(WEBHOOK_TLS_CERT, WEBHOOK_TLS_KEY or None)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    host, _, port = address.rpartition(":")
+    await web.TCPSite(runner, host.strip("[]") or None, int(port), ssl_context=ssl_context).start()
+    return runner
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Реєструє вебхук у Telegram після старту сервера і працює до SIGINT/SIGTERM"""
+    runner = await start_webhook_server(dp, bot)
+    await bot.set_webhook(
+        WEBHOOK_URL,
+        certificate=types.FSInputFile(WEBHOOK_TLS_CERT) if WEBHOOK_SELF_SIGNED else None,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=True,
+    )
+    logging.info(f"🪝 Вебхук: {WEBHOOK_URL} -> {WEBHOOK_LISTEN}{webhook_path()}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
+
+# --- MAIN ---
+async def main():
+    if not API_TOKEN or not ALLOWED_USER_ID:
+        raise ValueError(
+            "Помилка: Не вдалося завантажити API_TOKEN або ALLOWED_USER_ID з .env файлу."
+        )
 
+    dp = build_dispatcher()
     bot = Bot(token=API_TOKEN)
 
     async def on_startup():
-        await bot.delete_webhook(drop_pending_updates=True)
+        if not WEBHOOK_URL:
+            await bot.delete_webhook(drop_pending_updates=True)
         try:
             distro = get_distro_pretty_name()
             await bot.send_message(
@@ -760,12 +6634,61 @@ async def main():
         except Exception as e:
             logging.error(f"Запуск не вдався: {e}")
 
-        asyncio.create_task(monitor_ssh_logins(bot))
+        NEIGHBORS.start()
+        spawn(NOTIFIER.run(bot))
+        spawn(SSH_STORE.run())
+        spawn(monitor_ssh_logins())
+        spawn(UPDATE_CHECKER.run())
+        spawn(SYSTEMD_WATCHER.run())
+        if PORTS_WATCH_INTERVAL > 0:
+            spawn(PORTS_WATCHER.run())
+
+    runners = []
+    if METRICS_LISTEN:
+        runners.append(await start_metrics_server())
+    if SPEEDTEST_SERVER_LISTEN:
+        runners.append(await start_speedtest_server())
+
+    async def on_shutdown():
+        save_ip_cache()
+        await SSH_STORE.close()
+        METRICS_DB.close()
+        await close_http_session()
+        for runner in runners:
+            await runner.cleanup()
 
     dp.startup.register(on_startup)
-    await dp.start_polling(bot)
+    dp.shutdown.register(on_shutdown)
+    load_ip_cache()
+    if METRICS_DB_FILE:
+        try:
+            METRICS_DB.open()
+        except Exception as e:
+            logging.error(f"Не вдалося відкрити історію метрик: {e}")
+    spawn(metrics_sampler())
+    if WEBHOOK_URL:
+        await run_webhook(dp, bot)
+    else:
+        await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telegram Linux Monitor Bot")
+    parser.add_argument(
+        "--agent",
+        action="store_true",
+        help="запустити як агент флоту (без Telegram, див. FLEET_AGENT_LISTEN)",
+    )
+    parser.add_argument(
+        "--speedtest-server",
+        action="store_true",
+        help="запустити лише тестовий сервер швидкості (див. SPEEDTEST_SERVER_LISTEN)",
+    )
+    args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(main())
+    if args.agent:
+        asyncio.run(agent_main())
+    elif args.speedtest_server:
+        asyncio.run(speedtest_server_main())
+    else:
+        asyncio.run(main())